@@ -1,18 +1,18 @@
 import os
-import json
 import subprocess
 import time
 import sys
+from records import iter_latest_records, write_records
+
+# Scraper scripts to run (explicit, so helper modules in this directory are not executed as scripts)
+SCRAPER_SCRIPTS = ['incometax.py', 'rbiextract.py']
 
 def run_python_files(directory, timeout=60, poll_interval=0.5):
-    """Runs other Python scripts in the directory concurrently."""
+    """Runs the scraper scripts in the directory concurrently."""
     print("Running Python files concurrently...")
-    python_files = [
-        f for f in os.listdir(directory)
-        if f.endswith('.py') and f != os.path.basename(__file__)
-    ]
+    python_files = [f for f in SCRAPER_SCRIPTS if os.path.exists(os.path.join(directory, f))]
     if not python_files:
-        print("No other Python files found to run.")
+        print("No scraper scripts found to run.")
         return
 
     python_executable = sys.executable
@@ -74,71 +74,38 @@ def run_python_files(directory, timeout=60, poll_interval=0.5):
 
 
 def combine_json_files(directory, output_file):
-    """Combines JSON files into the desired list-of-single-item-dicts format."""
-    print("Combining JSON files...")
-    combined_data = []
-    output_filename = os.path.basename(output_file)
-    files_processed = 0
+    """Streams the scrapers' record files into one JSON Lines file of single-item dicts."""
+    print("Combining scraped records...")
+    counts = {}
 
-    # Look for specific JSON files likely produced by your scrapers
+    # Record files produced by the scrapers (legacy .json versions are read if the .jsonl is missing)
     # Adjust these names if your scrapers produce different output files
-    source_json_files = ['processed_pdfs.json', 'rbi_notifications.json']
-
-    for json_filename in source_json_files:
-        file_path = os.path.join(directory, json_filename)
-        if not os.path.exists(file_path):
-            print(f"Source file not found, skipping: {json_filename}")
-            continue
-
-        print(f"Processing source file: {json_filename}")
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # *** CORE CHANGE IS HERE ***
-            # Expecting data to be a dictionary like:
-            # {"filename1.pdf": {details}, "filename2.pdf": {details}} OR
-            # {"title1": {details}, "title2": {details}}
-            if isinstance(data, dict):
-                count_added = 0
-                for key, value in data.items():
-                    # Create a new dictionary containing only this single key-value pair
-                    single_record_dict = {key: value}
-                    combined_data.append(single_record_dict)
-                    count_added += 1
-                print(f"  Added {count_added} records from dictionary structure in {json_filename}.")
-                files_processed += 1
-            # If a source file *did* produce a list of single-item dicts already, handle that too
-            elif isinstance(data, list):
-                 # Check if list items are already in the desired format
-                 valid_list = True
-                 for item in data:
-                      if not (isinstance(item, dict) and len(item) == 1):
-                           valid_list = False
-                           break
-                 if valid_list:
-                      combined_data.extend(data)
-                      print(f"  Extended with {len(data)} records from list structure in {json_filename}.")
-                      files_processed += 1
-                 else:
-                      print(f"  Warning: Skipping list in {json_filename} as items are not single-key dictionaries.")
-            else:
-                print(f"  Warning: Unexpected data type ({type(data)}) in {json_filename}. Skipping.")
-
-        except json.JSONDecodeError as e:
-            print(f"  Error decoding JSON from {json_filename}: {e}")
-        except Exception as e:
-            print(f"  Error processing {json_filename}: {e}")
-
-    if not combined_data:
-         print("Warning: No data was combined. Output file will be empty or not updated.")
-         # Optional: Decide whether to write an empty list or skip writing
-         # return # Uncomment to avoid writing empty file
+    source_record_files = ['processed_pdfs.jsonl', 'rbi_notifications.jsonl']
+
+    def iter_combined():
+        for record_filename in source_record_files:
+            file_path = os.path.join(directory, record_filename)
+            if not os.path.exists(file_path) and not os.path.exists(os.path.splitext(file_path)[0] + '.json'):
+                print(f"Source file not found, skipping: {record_filename}")
+                continue
+            print(f"Processing source file: {record_filename}")
+            counts[record_filename] = 0
+            try:
+                for record in iter_latest_records(file_path):
+                    if not (isinstance(record, dict) and len(record) == 1):
+                        print(f"  Warning: Skipping record in {record_filename} that is not a single-key dictionary.")
+                        continue
+                    counts[record_filename] += 1
+                    yield record
+                print(f"  Added {counts[record_filename]} records from {record_filename}.")
+            except Exception as e:
+                print(f"  Error processing {record_filename}: {e}")
 
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(combined_data, f, indent=4, ensure_ascii=False) # ensure_ascii=False is good for non-English text
-        print(f"Combined data written to {output_file}. Total records: {len(combined_data)} from {files_processed} source file(s).")
+        total = write_records(output_file, iter_combined())
+        if not total:
+            print("Warning: No data was combined. Output file is empty.")
+        print(f"Combined data written to {output_file}. Total records: {total} from {len(counts)} source file(s).")
     except Exception as e:
         print(f"Error writing combined data to {output_file}: {e}")
 
@@ -146,7 +113,7 @@ def combine_json_files(directory, output_file):
 if __name__ == "__main__":
     # Assume this script is inside the WebScraping directory
     input_directory = os.path.dirname(os.path.abspath(__file__))
-    output_file = os.path.join(input_directory, 'data.json')
+    output_file = os.path.join(input_directory, 'data.jsonl')
 
     # 1. Run the scraping scripts first
     run_python_files(input_directory)
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# Concurrent PDF downloads over one pooled aiohttp session. The scrapers get their session cookies once
+# (from the listing page request) and hand them over here, instead of driving a browser to every PDF.
+# Each host gets its own concurrency limit and minimum spacing between requests, files are streamed to a
+# unique "<name>.<random>.part" and renamed into place only when complete, and transient failures are
+# retried with backoff.
+# With an http_cache.HttpCache, requests are conditional and complete files go to its content-addressed
+# store instead of download_dir, so an unchanged PDF costs a 304.
+
+DEFAULT_HEADERS = {
+    "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                   "AppleWebKit/537.36 (KHTML, like Gecko) "
+                   "Chrome/115.0.0.0 Safari/537.36"),
+    "Accept": "application/pdf,*/*;q=0.8",
+}
+MAX_CONNECTIONS = 16
+PER_HOST_CONCURRENCY = 4
+PER_HOST_MIN_INTERVAL = 0.2  # Seconds between request starts to one host
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 0.5
+REQUEST_TIMEOUT_SECONDS = 60
+STREAM_CHUNK_BYTES = 64 * 1024
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class HostLimiter:
+    """Per-host concurrency (a semaphore) and minimum spacing between request starts."""
+
+    def __init__(self, concurrency=PER_HOST_CONCURRENCY, min_interval=PER_HOST_MIN_INTERVAL):
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self._semaphores = {}
+        self._locks = {}
+        self._next_start = {}
+
+    async def __call__(self, host):
+        """Waits for this host's turn; returns its semaphore, already acquired (release it when done)."""
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.concurrency))
+        await semaphore.acquire()
+        async with self._locks.setdefault(host, asyncio.Lock()):
+            delay = self._next_start.get(host, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_start[host] = time.monotonic() + self.min_interval
+        return semaphore
+
+
+class RetryableFetchError(Exception):
+    """A failed attempt worth retrying (transient status, connection error or timeout)."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+async def _download_once(session, limiter, url, path, cache):
+    """
+    One attempt: streams url to a unique .part file next to path and renames it into place (into the
+    cache's object store with a cache). Returns the final path, or None if it is not a PDF.
+    """
+    semaphore = await limiter(urlsplit(url).netloc)
+    part_path = None
+    try:
+        async with session.get(url, headers=cache.conditional_headers(url) if cache else None) as response:
+            if response.status == 304 and cache:
+                if cache.path(url):
+                    print(f"Not modified: {url}")
+                    return cache.path(url)
+                cache.forget(url)  # The cached copy went missing: the retry is an unconditional GET
+                raise RetryableFetchError("HTTP 304 without a cached copy", retry_after=0)
+            if response.status in RETRYABLE_STATUSES:
+                raise RetryableFetchError(f"HTTP {response.status}", _retry_after_seconds(response))
+            if response.status != 200:
+                print(f"Failed to download: {url} (Status code: {response.status})")
+                return None
+            written = 0
+            digest = hashlib.sha256()
+            # Unique per attempt: different URLs can share a file name, and they download concurrently
+            fd, part_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_BYTES):
+                    if not written and not chunk.startswith(b"%PDF"):
+                        break  # e.g. an HTML error or login page served with status 200
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+            if not written:
+                print(f"Failed to download: {url} (not a PDF: {response.headers.get('Content-Type', 'unknown type')})")
+                return None
+            if cache:
+                path = cache.store(url, part_path, digest.hexdigest(), response.headers, ".pdf")
+            else:
+                os.replace(part_path, path)
+        print(f"Downloaded: {path}")
+        return path
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise RetryableFetchError(f"{type(e).__name__}: {e}") from e
+    finally:
+        semaphore.release()
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+
+async def _download(session, limiter, url, path, max_attempts, cache):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await _download_once(session, limiter, url, path, cache)
+        except RetryableFetchError as e:
+            if attempt == max_attempts:
+                print(f"Failed to download: {url} after {attempt} attempts ({e})")
+                return None
+            delay = e.retry_after if e.retry_after is not None else BACKOFF_BASE_SECONDS * 2 ** (attempt - 1) * (1 + random.random())
+            print(f"  Retrying {url} in {delay:.1f}s ({e})")
+            await asyncio.sleep(delay)
+        except OSError as e:  # Writing the file failed; retrying would not help
+            print(f"Failed to save {url} to {path}: {e}")
+            return None
+
+
+async def fetch_pdfs_async(downloads, download_dir, cookies=None, headers=None, max_connections=MAX_CONNECTIONS,
+                           limiter=None, max_attempts=MAX_ATTEMPTS, timeout=REQUEST_TIMEOUT_SECONDS, cache=None):
+    """
+    Downloads (url, filename) pairs into download_dir concurrently.
+    Returns the local paths in the same order, None for each download that failed. With a cache the paths
+    are in its object store (cache.entry(url)["sha256"] identifies the content); call cache.save() after.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    async with aiohttp.ClientSession(connector=connector, cookies=cookies, headers={**DEFAULT_HEADERS, **(headers or {})},
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        limiter = limiter or HostLimiter()
+        return await asyncio.gather(*(_download(session, limiter, url, os.path.join(download_dir, filename), max_attempts, cache)
+                                      for url, filename in downloads))
+
+
+def fetch_pdfs(downloads, download_dir, **kwargs):
+    """Blocking wrapper around fetch_pdfs_async for the scraper scripts."""
+    return asyncio.run(fetch_pdfs_async(downloads, download_dir, **kwargs))
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import time
+
+# HTTP cache for the scrapers. Per URL it remembers the ETag/Last-Modified validators and the SHA-256 of
+# the body, so the next run sends a conditional GET and an unchanged source costs a 304. Bodies live in
+# a content-addressed store (objects/<first two hex digits>/<sha256><suffix>), so identical files
+# published under different names or URLs are stored once and can be recognised by their hash.
+# Each scraper keeps its own <name>.json validator file (they run concurrently); the object store is
+# shared, which is safe because objects are only ever written by an atomic rename of a complete file.
+
+
+class HttpCache:
+    def __init__(self, root, name):
+        self.root = root
+        self.index_path = os.path.join(root, f"{name}.json")
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def object_path(self, sha256, suffix=''):
+        return os.path.join(self.root, 'objects', sha256[:2], f"{sha256}{suffix}")
+
+    def entry(self, url):
+        """The cached entry for url ({"sha256", "etag", "last_modified", ...}) if its body is still stored, else None."""
+        entry = self.entries.get(url)
+        if entry and os.path.exists(self.object_path(entry['sha256'], entry.get('suffix', ''))):
+            return entry
+        return None
+
+    def path(self, url):
+        entry = self.entry(url)
+        return self.object_path(entry['sha256'], entry.get('suffix', '')) if entry else None
+
+    def forget(self, url):
+        """Drops url's validators, e.g. after a 304 for a body that is no longer stored, so the next GET is unconditional."""
+        self.entries.pop(url, None)
+
+    def conditional_headers(self, url):
+        """If-None-Match/If-Modified-Since for url, or {} when nothing usable is cached."""
+        entry = self.entry(url)
+        if not entry:
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, part_path, sha256, response_headers, suffix=''):
+        """
+        Moves a completely downloaded body (part_path, whose hash is sha256) into the object store and
+        records url's validators. Returns the object path.
+        """
+        path = self.object_path(sha256, suffix)
+        if os.path.exists(path):
+            os.remove(part_path)  # Same content already stored (unchanged, or a duplicate under another name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part_path, path)
+        self.entries[url] = {
+            'sha256': sha256,
+            'suffix': suffix,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        return path
+
+    def get(self, session, url, suffix='.html', **kwargs):
+        """
+        Conditional GET with a requests session. Returns (body, changed); body is None if the request failed.
+        On a 304 the cached body is returned with changed=False. If that body has gone missing, the entry is
+        dropped and the URL fetched again without validators.
+        """
+        headers = kwargs.pop('headers', {})
+        response = session.get(url, headers={**headers, **self.conditional_headers(url)}, **kwargs)
+        if response.status_code == 304:
+            body = self._read_cached(url)
+            if body is not None:
+                print(f"Not modified: {url}")
+                return body, False
+            print(f"Not modified, but the cached copy of {url} is missing; fetching it again.")
+            self.forget(url)
+            response = session.get(url, headers=headers, **kwargs)
+        if response.status_code != 200:
+            return None, False
+        body = response.content
+        sha256 = hashlib.sha256(body).hexdigest()
+        changed = (self.entry(url) or {}).get('sha256') != sha256
+        part_path = os.path.join(self.root, f"{sha256}.part")
+        with open(part_path, 'wb') as f:
+            f.write(body)
+        self.store(url, part_path, sha256, response.headers, suffix)
+        return body, changed
+
+    def _read_cached(self, url):
+        path = self.path(url)
+        if not path:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:  # Removed since path() looked
+            return None
+
+    def save(self):
+        """Writes the validators atomically; call once at the end of a run."""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.index_path)
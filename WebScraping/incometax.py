@@ -1,96 +1,44 @@
 import os
-import json
 import re
-import time
 import requests
 from bs4 import BeautifulSoup
-from PyPDF2 import PdfReader
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from fetcher import DEFAULT_HEADERS, fetch_pdfs
+from http_cache import HttpCache
+from records import record_hashes, append_record, migrate_legacy_json
+from pdf_text import extract_text_from_pdf
 
 # Set up download directory for PDFs
 DOWNLOAD_DIR = os.path.abspath("pdfs")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+# Validators and content-addressed copies of the listing page and PDFs (see http_cache.py)
+CACHE_DIR = os.path.join(DOWNLOAD_DIR, "cache")
 
-def init_selenium():
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # run headless
-    chrome_options.add_argument("--disable-gpu")
-    # Configure Chrome to automatically download PDFs instead of opening them
-    chrome_options.add_experimental_option("prefs", {
-        "download.default_directory": DOWNLOAD_DIR,
-        "download.prompt_for_download": False,
-        "download.directory_upgrade": True,
-        "plugins.always_open_pdf_externally": True
-    })
-    # Use webdriver-manager to get the correct ChromeDriver version
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-    return driver
+def load_processed_pdfs(jsonl_file='processed_pdfs.jsonl'):
+    """Loads {name: sha256} of previously processed PDFs (not their text) from the JSON Lines store."""
+    migrate_legacy_json(jsonl_file)
+    return record_hashes(jsonl_file)
 
-def selenium_download_pdf(driver, pdf_url, timeout=10):
-    """
-    Uses Selenium to open the PDF URL and download the file.
-    Returns the local file path if successful, else None.
-    """
-    driver.get(pdf_url)
-    # Derive PDF name from URL (remove extra parameters)
-    pdf_name = os.path.basename(pdf_url.split('&')[0])
-    pdf_path = os.path.join(DOWNLOAD_DIR, pdf_name)
-    
-    # Wait until the file is downloaded (or timeout)
-    wait_time = 0
-    while not os.path.exists(pdf_path) and wait_time < timeout:
-        time.sleep(1)
-        wait_time += 1
-        
-    if os.path.exists(pdf_path):
-        print(f"Downloaded: {pdf_path}")
-        return pdf_path
-    else:
-        print(f"Failed to download: {pdf_url}")
-        return None
-
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from the PDF file using PyPDF2."""
-    reader = PdfReader(pdf_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() or ''
-    return text
-
-def filter_ascii(text):
-    """
-    Returns a new string containing only characters with Unicode code points less than 128.
-    This effectively keeps only the ASCII characters.
-    """
-    return ''.join(c for c in text if ord(c) < 128)
-
-def load_processed_pdfs(json_file='processed_pdfs.json'):
-    """Loads previously processed PDF data from JSON."""
-    if os.path.exists(json_file):
-        with open(json_file, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_processed_pdfs(data, json_file='processed_pdfs.json'):
-    """Saves processed PDF data to JSON."""
-    with open(json_file, 'w') as f:
-        json.dump(data, f, indent=4)
+def save_processed_pdf(pdf_name, data, jsonl_file='processed_pdfs.jsonl'):
+    """Appends one processed PDF to the JSON Lines store."""
+    append_record(jsonl_file, pdf_name, data)
 
-def scrape_notifications(base_url, notification_path):
+def scrape_notifications(base_url, notification_path, session=requests, cache=None):
     """
     Scrapes the notifications page to extract the latest 10 PDF details.
     Returns a list of dictionaries with pdf_name, pdf_url, publish_date, and notification_number.
+    With a cache the page is fetched with a conditional GET.
     """
     url = f"{base_url}/{notification_path}"
-    response = requests.get(url)
-    if response.status_code != 200:
+    if cache:
+        content, _ = cache.get(session, url, headers=DEFAULT_HEADERS)
+    else:
+        response = session.get(url, headers=DEFAULT_HEADERS)
+        content = response.content if response.status_code == 200 else None
+    if content is None:
         print("Failed to fetch the website.")
         return []
     
-    soup = BeautifulSoup(response.content, 'html.parser')
+    soup = BeautifulSoup(content, 'html.parser')
     notifications = []
     
     # Extract the latest 10 notifications using the onclick attribute
@@ -119,45 +67,50 @@ def main():
     base_url = 'https://incometaxindia.gov.in'
     notification_path = 'pages/communications/index.aspx'
     
-    # Initialize Selenium driver
-    driver = init_selenium()
-    
-    # Load already processed PDFs from JSON
+    # Load names and content hashes of already processed PDFs
     processed_pdfs = load_processed_pdfs()
+    processed_names_by_hash = {sha256: name for name, sha256 in processed_pdfs.items() if sha256}
+    
+    # Scrape notifications for the latest 10 PDFs; the session keeps the site's cookies for the downloads
+    session = requests.Session()
+    cache = HttpCache(CACHE_DIR, "incometax")
+    notifications = scrape_notifications(base_url, notification_path, session, cache)
     
-    # Scrape notifications for the latest 10 PDFs
-    notifications = scrape_notifications(base_url, notification_path)
+    # Conditionally fetch every listed PDF concurrently with the listing page's cookies: unchanged ones cost a 304
+    pdf_paths = fetch_pdfs([(notification["pdf_url"], notification["pdf_name"]) for notification in notifications], DOWNLOAD_DIR,
+                           cookies=session.cookies.get_dict(), cache=cache)
+    cache.save()
     
-    for notification in notifications:
+    for notification, pdf_path in zip(notifications, pdf_paths):
         pdf_name = notification["pdf_name"]
         pdf_url = notification["pdf_url"]
-        
-        if pdf_name in processed_pdfs:
+        if not pdf_path:
+            print(f"Skipping extraction for {pdf_name} as the file was not downloaded.")
+            continue
+        # The PDF's content hash decides: re-published PDFs are re-extracted, renamed duplicates are not
+        sha256 = cache.entry(pdf_url)["sha256"]
+        if processed_pdfs.get(pdf_name) == sha256:
             print(f"PDF already processed: {pdf_name}")
             continue
-        
+        if sha256 in processed_names_by_hash:
+            print(f"Skipping {pdf_name}: same PDF as already processed {processed_names_by_hash[sha256]}")
+            continue
         print(f"Processing {pdf_name} ...")
-        # Download PDF using Selenium
-        pdf_path = selenium_download_pdf(driver, pdf_url)
-        if pdf_path:
-            extracted_text = extract_text_from_pdf(pdf_path)
-            # Filter the text to keep only ASCII characters (Unicode code points < 128)
-            filtered_text = filter_ascii(extracted_text)
-            processed_pdfs[pdf_name] = {
-                "url": pdf_url,
-                "publish_date": notification["publish_date"],
-                "notification_number": notification["notification_number"],
-                "content": filtered_text
-            }
-            print(f"Extracted and stored text from {pdf_name}")
-        else:
-            print(f"Skipping extraction for {pdf_name} as the file was not downloaded.")
-    
-    save_processed_pdfs(processed_pdfs)
-    print("All PDFs processed and stored in processed_pdfs.json")
+        # Each page is normalised: ASCII punctuation, keeping rupee signs and Devanagari (see text_normalize.py)
+        filtered_text, page_offsets = extract_text_from_pdf(pdf_path)
+        save_processed_pdf(pdf_name, {
+            "url": pdf_url,
+            "publish_date": notification["publish_date"],
+            "notification_number": notification["notification_number"],
+            "content": filtered_text,
+            "page_offsets": page_offsets,
+            "sha256": sha256
+        })
+        processed_pdfs[pdf_name] = sha256
+        processed_names_by_hash[sha256] = pdf_name
+        print(f"Extracted and stored text from {pdf_name}")
     
-    # Quit the Selenium driver
-    driver.quit()
+    print("All PDFs processed and stored in processed_pdfs.jsonl")
 
 if __name__ == "__main__":
     main()
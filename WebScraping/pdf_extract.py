@@ -0,0 +1,93 @@
+# WebScraping/pdf_extract.py
+"""
+Page-parallel, streaming PDF text extraction with PyMuPDF.
+
+Used by the upload pipeline (query_pipeline.py) and, as an identical copy in WebScraping/, by the scrapers,
+which run without backend/ on sys.path. It depends on nothing but fitz. Keep the two copies identical below
+the first line; WebScraping/tests/test_pdf_text.py checks this.
+
+Pages come out one at a time and in order. PDFs of PARALLEL_MIN_PAGES pages or more are split into
+PAGES_PER_TASK page ranges extracted by a process pool (PyMuPDF holds the GIL, so threads would not help);
+only a few ranges are in flight at once, so memory stays bounded by the window, not the file.
+The pool uses spawned processes: forking a process that already runs threads (a web worker with its
+upload queue and model threads) can deadlock the child. The web app defaults to in-process extraction
+(PDF_EXTRACT_PROCESSES=1); the pool is meant for the scrapers.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz # PyMuPDF
+
+PAGES_PER_TASK = 16
+PARALLEL_MIN_PAGES = 48 # Smaller PDFs extract faster in-process than the hand-off to the pool costs
+TASKS_IN_FLIGHT_PER_PROCESS = 2
+DEFAULT_PROCESSES = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_processes = 0
+_pool_lock = threading.Lock()
+
+
+def _extract_range(path, start, stop):
+    """Worker: the text of pages [start, stop) of the PDF at path."""
+    with fitz.open(path) as doc:
+        return [doc[page_index].get_text() for page_index in range(start, stop)]
+
+
+def _get_pool(processes):
+    """One pool per process, created on first use and reused (starting workers costs far more than a range)."""
+    global _pool, _pool_processes
+    with _pool_lock:
+        if _pool is None or _pool_processes != processes:
+            if _pool is not None: _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+            _pool_processes = processes
+            logging.info(f"[pdf_extract] Started PDF extraction pool with {processes} processes.")
+        return _pool
+
+
+def iter_pdf_pages(path, processes=None):
+    """Yields (page_number, text) for every page, 1-based and in order. processes=1 extracts in-process."""
+    processes = DEFAULT_PROCESSES if processes is None else processes
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+        if processes <= 1 or page_count < PARALLEL_MIN_PAGES:
+            for page_index in range(page_count): yield page_index + 1, doc[page_index].get_text()
+            return
+    pool = _get_pool(processes)
+    ranges = deque((start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK))
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < processes * TASKS_IN_FLIGHT_PER_PROCESS:
+                start, stop = ranges.popleft()
+                in_flight.append((start, pool.submit(_extract_range, path, start, stop)))
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()): yield start + offset + 1, text
+    finally:
+        for _, future in in_flight: future.cancel() # Consumer stopped early or a range failed
+
+
+def extract_pdf_text(path, processes=None, transform=None):
+    """
+    The whole text of a PDF and the character offset at which each page starts in it.
+    transform (e.g. a normaliser) is applied to each page's text before the offsets are taken.
+    """
+    parts, page_offsets, length = [], [], 0
+    for _, text in iter_pdf_pages(path, processes):
+        if transform is not None: text = transform(text)
+        page_offsets.append(length)
+        parts.append(text)
+        length += len(text)
+    return "".join(parts), page_offsets
+
+
+def page_for_offset(page_offsets, offset):
+    """1-based page number containing the character at offset, given extract_pdf_text's page offsets."""
+    return max(1, bisect_right(page_offsets, offset))
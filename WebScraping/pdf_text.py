@@ -0,0 +1,14 @@
+from pdf_extract import extract_pdf_text
+from text_normalize import normalize_text
+
+# PDF text extraction for the scrapers. pdf_extract.py is the page-parallel extractor, an identical copy of
+# ../backend/pdf_extract.py (whose page offsets index.py maps chunks to pages with).
+
+
+def extract_text_from_pdf(pdf_path, transform=normalize_text):
+    """
+    Extracts the text of the PDF (page-parallel for large files), applying transform to each page
+    (by default text_normalize.normalize_text: ASCII punctuation, keeping rupee signs and Devanagari).
+    Returns (text, page_offsets): the character offset at which each page starts in text.
+    """
+    return extract_pdf_text(pdf_path, transform=transform)
@@ -0,0 +1,97 @@
+import os
+import json
+
+# Scraped documents are stored as JSON Lines: one {"<filename or title>": {details}} object per line.
+# Everything here reads or writes one record at a time, so memory use does not grow with the archive.
+
+def iter_jsonl(path):
+    """Yields the records of a JSON Lines file one at a time, skipping blank or malformed lines."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"  Warning: Skipping malformed line {line_number} in {os.path.basename(path)}: {e}")
+
+def iter_legacy_json(path):
+    """Yields single-item records from an old whole-file JSON dict/list (migration only; loads the file once)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield {key: value}
+    elif isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict) and len(item) == 1:
+                yield item
+            else:
+                print(f"  Warning: Skipping list item in {os.path.basename(path)} that is not a single-key dictionary.")
+    else:
+        print(f"  Warning: Unexpected data type ({type(data)}) in {os.path.basename(path)}. Skipping.")
+
+def iter_records(path):
+    """Yields records from a .jsonl file, falling back to the legacy .json file of the same name."""
+    if os.path.exists(path):
+        yield from iter_jsonl(path)
+        return
+    legacy_path = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(legacy_path):
+        print(f"  {os.path.basename(path)} not found; reading legacy {os.path.basename(legacy_path)}.")
+        yield from iter_legacy_json(legacy_path)
+
+def record_keys(path):
+    """Returns the set of record keys (filenames/titles) in a record file without keeping the records."""
+    return {next(iter(record)) for record in iter_records(path) if isinstance(record, dict) and record}
+
+def record_hashes(path):
+    """Returns {key: sha256 of the source file} for a record file (None for records stored without one)."""
+    hashes = {}
+    for record in iter_records(path):
+        if isinstance(record, dict) and len(record) == 1:
+            key, value = next(iter(record.items()))
+            hashes[key] = value.get('sha256') if isinstance(value, dict) else None
+    return hashes
+
+def iter_latest_records(path):
+    """
+    Yields the records of a record file, keeping only the last one appended for each key (a re-published
+    document is appended again under the same key). Two passes, so only the keys are held in memory.
+    """
+    last_line = {}
+    for line_number, record in enumerate(iter_records(path)):
+        if isinstance(record, dict) and len(record) == 1:
+            last_line[next(iter(record))] = line_number
+    for line_number, record in enumerate(iter_records(path)):
+        if not (isinstance(record, dict) and len(record) == 1) or last_line.get(next(iter(record))) == line_number:
+            yield record
+
+def append_record(path, key, value):
+    """Appends one record and flushes it to disk, so a crash mid-run keeps everything scraped so far."""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({key: value}, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_records(path, records):
+    """Streams records into a JSON Lines file, replacing it atomically. Returns the number written."""
+    tmp_path = path + '.tmp'
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+def migrate_legacy_json(path):
+    """Converts an old whole-file .json store next to `path` into JSON Lines the first time it is used."""
+    legacy_path = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return
+    count = write_records(path, iter_legacy_json(legacy_path))
+    print(f"Migrated {count} records from {os.path.basename(legacy_path)} to {os.path.basename(path)}.")
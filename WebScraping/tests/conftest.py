@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scraper modules are plain scripts in WebScraping/, imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
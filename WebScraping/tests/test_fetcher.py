@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+
+import fetcher
+from http_cache import HttpCache
+
+PDF = b"%PDF-1.4 " + b"x" * 200000
+
+
+async def serve(routes):
+    """Starts an aiohttp.web app on an ephemeral local port; returns (runner, base_url)."""
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def fetch(routes, downloads, tmp_path, runs=1, **kwargs):
+    """Runs fetch_pdfs_async against a local server `runs` times; returns the last run's paths."""
+    async def run():
+        runner, base = await serve(routes)
+        try:
+            for _ in range(runs):
+                paths = await fetcher.fetch_pdfs_async([(base + url, name) for url, name in downloads], str(tmp_path),
+                                                       limiter=fetcher.HostLimiter(min_interval=0), **kwargs)
+            return paths
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+def part_files(root):
+    return [name for _, _, names in os.walk(root) for name in names if name.endswith(".part")]
+
+
+def test_retries_with_retry_after_then_renames_part_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetcher, "BACKOFF_BASE_SECONDS", 10)  # Only Retry-After keeps this test fast
+    attempts = []
+
+    async def flaky(request):
+        attempts.append(request.path)
+        if len(attempts) == 1:
+            return web.Response(status=503, headers={"Retry-After": "0"})
+        return web.Response(body=PDF, content_type="application/pdf")
+
+    paths = fetch([web.get("/flaky.pdf", flaky)], [("/flaky.pdf", "flaky.pdf")], tmp_path)
+
+    assert len(attempts) == 2
+    assert paths == [str(tmp_path / "flaky.pdf")]
+    assert (tmp_path / "flaky.pdf").read_bytes() == PDF
+    assert part_files(tmp_path) == []
+
+
+def test_gives_up_after_max_attempts(tmp_path):
+    async def down(request):
+        return web.Response(status=502, headers={"Retry-After": "0"})
+
+    assert fetch([web.get("/down.pdf", down)], [("/down.pdf", "down.pdf")], tmp_path, max_attempts=2) == [None]
+    assert os.listdir(tmp_path) == []
+
+
+def test_rejects_non_pdf_and_client_errors(tmp_path):
+    async def login_page(request):
+        return web.Response(text="<html>Please log in</html>", content_type="text/html")
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    paths = fetch([web.get("/login.pdf", login_page), web.get("/missing.pdf", missing)],
+                  [("/login.pdf", "login.pdf"), ("/missing.pdf", "missing.pdf")], tmp_path)
+
+    assert paths == [None, None]
+    assert os.listdir(tmp_path) == []
+
+
+def test_same_file_name_from_different_urls_does_not_collide(tmp_path):
+    bodies = {"a": PDF + b"a", "b": PDF + b"b"}
+
+    async def document(request):
+        await asyncio.sleep(0.05)  # Keep both downloads in flight at once
+        return web.Response(body=bodies[request.match_info["folder"]], content_type="application/pdf")
+
+    cache = HttpCache(str(tmp_path / "cache"), "test")
+    paths = fetch([web.get("/{folder}/notice.pdf", document)], [("/a/notice.pdf", "notice.pdf"), ("/b/notice.pdf", "notice.pdf")],
+                  tmp_path, cache=cache)
+
+    assert [open(path, "rb").read() for path in paths] == [bodies["a"], bodies["b"]]
+    assert [os.path.basename(path) for path in paths] == [hashlib.sha256(bodies[folder]).hexdigest() + ".pdf" for folder in "ab"]
+    assert part_files(tmp_path) == []
+
+
+def test_cached_pdf_costs_a_304(tmp_path):
+    statuses = []
+
+    async def document(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            statuses.append(304)
+            return web.Response(status=304)
+        statuses.append(200)
+        return web.Response(body=PDF, content_type="application/pdf", headers={"ETag": '"v1"'})
+
+    cache = HttpCache(str(tmp_path / "cache"), "test")
+    paths = fetch([web.get("/doc.pdf", document)], [("/doc.pdf", "doc.pdf")], tmp_path, runs=2, cache=cache)
+
+    assert statuses == [200, 304]
+    assert paths == [cache.object_path(hashlib.sha256(PDF).hexdigest(), ".pdf")]
+    assert open(paths[0], "rb").read() == PDF
+
+
+def test_304_for_a_vanished_cached_pdf_refetches_it(tmp_path):
+    cache = HttpCache(str(tmp_path / "cache"), "test")
+    statuses = []
+
+    async def document(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            os.remove(cache.path(request.url.human_repr()))  # Deleted while the conditional GET was in flight
+            statuses.append(304)
+            return web.Response(status=304)
+        statuses.append(200)
+        return web.Response(body=PDF, content_type="application/pdf", headers={"ETag": '"v1"'})
+
+    paths = fetch([web.get("/doc.pdf", document)], [("/doc.pdf", "doc.pdf")], tmp_path, runs=2, cache=cache)
+
+    assert statuses == [200, 304, 200]
+    assert open(paths[0], "rb").read() == PDF
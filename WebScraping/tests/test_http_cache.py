@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+from http_cache import HttpCache
+
+URL = "https://example.com/notices"
+
+
+class FakeSession:
+    """requests.Session stand-in: answers 304 to a matching If-None-Match, else 200 with the current body."""
+
+    def __init__(self, body=b"<html>v1</html>", etag='"v1"'):
+        self.body, self.etag = body, etag
+        self.requests = []
+        self.on_304 = None
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append({"url": url, "headers": dict(headers or {}), **kwargs})
+        if self.etag and (headers or {}).get("If-None-Match") == self.etag:
+            if self.on_304: self.on_304()
+            return SimpleNamespace(status_code=304, content=b"", headers={})
+        return SimpleNamespace(status_code=200, content=self.body, headers={"ETag": self.etag, "Last-Modified": "Mon, 01 Apr 2024 00:00:00 GMT"})
+
+
+def test_first_get_stores_the_body_and_validators(tmp_path):
+    cache, session = HttpCache(str(tmp_path), "rbi"), FakeSession()
+
+    assert cache.get(session, URL, headers={"User-Agent": "ua"}, timeout=5) == (b"<html>v1</html>", True)
+    assert session.requests == [{"url": URL, "headers": {"User-Agent": "ua"}, "timeout": 5}]
+    sha256 = hashlib.sha256(b"<html>v1</html>").hexdigest()
+    assert cache.path(URL) == cache.object_path(sha256, ".html") == os.path.join(str(tmp_path), "objects", sha256[:2], f"{sha256}.html")
+    assert cache.conditional_headers(URL) == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Apr 2024 00:00:00 GMT"}
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".part")] == []
+
+
+def test_unchanged_page_costs_a_304_and_survives_a_restart(tmp_path):
+    cache, session = HttpCache(str(tmp_path), "rbi"), FakeSession()
+    cache.get(session, URL)
+    cache.save()
+
+    reloaded = HttpCache(str(tmp_path), "rbi")
+    assert reloaded.get(session, URL, headers={"User-Agent": "ua"}) == (b"<html>v1</html>", False)
+    assert session.requests[-1]["headers"] == {"User-Agent": "ua", "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Apr 2024 00:00:00 GMT"}
+
+
+def test_changed_page_replaces_the_entry(tmp_path):
+    cache, session = HttpCache(str(tmp_path), "rbi"), FakeSession()
+    cache.get(session, URL)
+    session.body, session.etag = b"<html>v2</html>", '"v2"'
+
+    assert cache.get(session, URL) == (b"<html>v2</html>", True)
+    assert cache.entry(URL)["etag"] == '"v2"'
+    # Same body under a new ETag is stored once and reported unchanged
+    session.etag = '"v3"'
+    assert cache.get(session, URL) == (b"<html>v2</html>", False)
+
+
+def test_304_for_a_missing_object_refetches_without_validators(tmp_path):
+    cache, session = HttpCache(str(tmp_path), "rbi"), FakeSession()
+    cache.get(session, URL, headers={"User-Agent": "ua"})
+    session.on_304 = lambda: os.remove(cache.path(URL))  # Deleted while the conditional GET was in flight
+
+    assert cache.get(session, URL, headers={"User-Agent": "ua"}) == (b"<html>v1</html>", True)
+    assert [request["headers"] for request in session.requests[1:]] == [
+        {"User-Agent": "ua", "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Apr 2024 00:00:00 GMT"},
+        {"User-Agent": "ua"},
+    ]
+    assert os.path.exists(cache.path(URL))
+
+
+def test_missing_object_means_no_conditional_headers(tmp_path):
+    cache, session = HttpCache(str(tmp_path), "rbi"), FakeSession()
+    cache.get(session, URL)
+    os.remove(cache.path(URL))
+
+    assert cache.conditional_headers(URL) == {} and cache.path(URL) is None
+    assert cache.get(session, URL) == (b"<html>v1</html>", True)
+    assert len(session.requests) == 2
+
+
+def test_failed_request_and_corrupt_index(tmp_path):
+    (tmp_path / "rbi.json").write_text("{not json")
+    cache = HttpCache(str(tmp_path), "rbi")
+    assert cache.entries == {}
+
+    session = FakeSession()
+    session.get = lambda url, headers=None, **kwargs: SimpleNamespace(status_code=500, content=b"", headers={})
+    assert cache.get(session, URL) == (None, False) and cache.entries == {}
+
+    cache.save()
+    assert json.loads((tmp_path / "rbi.json").read_text()) == {}
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+WEBSCRAPING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_PDF_EXTRACT = os.path.join(WEBSCRAPING_DIR, "..", "backend", "pdf_extract.py")
+
+
+def read_below_first_line(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().split("\n", 1)[1]
+
+
+@pytest.mark.skipif(not os.path.exists(BACKEND_PDF_EXTRACT), reason="scrapers checked out without the backend")
+def test_pdf_extract_copy_matches_the_backend():
+    # index.py maps chunks to pages with the backend's page_for_offset, so both copies must agree on page offsets
+    assert read_below_first_line(os.path.join(WEBSCRAPING_DIR, "pdf_extract.py")) == read_below_first_line(BACKEND_PDF_EXTRACT)
+
+
+def test_extract_text_from_pdf_normalizes_each_page(tmp_path):
+    fitz = pytest.importorskip("fitz")
+    from pdf_extract import iter_pdf_pages
+    from pdf_text import extract_text_from_pdf
+    from text_normalize import normalize_text
+
+    path = str(tmp_path / "notice.pdf")
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "Rule   1 ;  limit")
+        doc.new_page().insert_text((72, 72), "Rule 2")
+        doc.save(path)
+    pages = [normalize_text(page) for _, page in iter_pdf_pages(path, processes=1)]
+
+    text, page_offsets = extract_text_from_pdf(path)
+    assert text == "".join(pages) and "Rule 2" in text
+    assert page_offsets == [0, len(pages[0])]
+    assert extract_text_from_pdf(path, transform=str.upper)[0] == "RULE   1 ;  LIMIT\nRULE 2\n"
@@ -0,0 +1,59 @@
+import json
+
+from records import append_record, iter_jsonl, iter_latest_records, iter_records, migrate_legacy_json, record_hashes, write_records
+
+
+def test_iter_jsonl_skips_blank_malformed_and_truncated_lines(tmp_path):
+    path = tmp_path / "data.jsonl"
+    path.write_text('{"a.pdf": {"content": "one"}}\n\n{not json}\n{"b.pdf": {"content": "two"}}\n{"c.pdf": {"cont', encoding="utf-8")
+
+    assert list(iter_jsonl(str(path))) == [{"a.pdf": {"content": "one"}}, {"b.pdf": {"content": "two"}}]
+    assert list(iter_jsonl(str(tmp_path / "missing.jsonl"))) == []
+
+
+def test_append_record_round_trips_unicode(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    append_record(path, "a.pdf", {"content": "₹ 50,000 — कर"})
+    append_record(path, "b.pdf", {"content": "two"})
+
+    assert list(iter_jsonl(path)) == [{"a.pdf": {"content": "₹ 50,000 — कर"}}, {"b.pdf": {"content": "two"}}]
+    assert "₹" in open(path, encoding="utf-8").read() # Written with ensure_ascii=False
+
+
+def test_iter_latest_records_keeps_the_last_append_per_key_in_its_position(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    for key, version in [("a.pdf", 1), ("b.pdf", 1), ("a.pdf", 2), ("c.pdf", 1), ("b.pdf", 2)]:
+        append_record(path, key, {"version": version})
+
+    assert list(iter_latest_records(path)) == [{"a.pdf": {"version": 2}}, {"c.pdf": {"version": 1}}, {"b.pdf": {"version": 2}}]
+
+
+def test_iter_latest_records_ignores_a_truncated_final_append(tmp_path):
+    path = tmp_path / "data.jsonl"
+    append_record(str(path), "a.pdf", {"version": 1})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"a.pdf": {"version": 2, "cont') # Crash mid-write
+
+    assert list(iter_latest_records(str(path))) == [{"a.pdf": {"version": 1}}]
+    assert record_hashes(str(path)) == {"a.pdf": None}
+
+
+def test_write_records_replaces_the_file_and_leaves_no_temp_file(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    append_record(path, "old.pdf", {})
+
+    assert write_records(path, iter([{"a.pdf": {"sha256": "ab"}}, {"b.pdf": {}}])) == 2
+    assert list(iter_jsonl(path)) == [{"a.pdf": {"sha256": "ab"}}, {"b.pdf": {}}]
+    assert record_hashes(path) == {"a.pdf": "ab", "b.pdf": None}
+    assert [p.name for p in tmp_path.iterdir()] == ["data.jsonl"]
+
+
+def test_legacy_json_is_read_and_migrated_once(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    (tmp_path / "data.json").write_text(json.dumps({"a.pdf": {"content": "one"}, "b.pdf": {"content": "two"}}), encoding="utf-8")
+
+    assert list(iter_records(path)) == [{"a.pdf": {"content": "one"}}, {"b.pdf": {"content": "two"}}]
+    migrate_legacy_json(path)
+    append_record(path, "c.pdf", {"content": "three"})
+    migrate_legacy_json(path) # The .jsonl file exists now, so this is a no-op
+    assert [next(iter(record)) for record in iter_jsonl(path)] == ["a.pdf", "b.pdf", "c.pdf"]
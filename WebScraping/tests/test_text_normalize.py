@@ -0,0 +1,64 @@
+import random
+import unicodedata
+
+from text_normalize import ASCII_PUNCTUATION, build_normalizer, normalize_text
+
+
+def filter_ascii(text):
+    """The per-character cleaner the scrapers used before text_normalize (kept here as the reference)."""
+    return ''.join(char for char in text if ord(char) < 128)
+
+
+def test_ascii_text_is_returned_unchanged():
+    page = "Notification No. 15/2024 dated 01-04-2024\n\tSection 80C: Rs. 1,50,000 limit."
+    assert normalize_text(page) is page
+    assert normalize_text("") == ""
+
+
+def test_nfkc_folds_compatibility_characters():
+    assert normalize_text("ﬁnance ｆｕｌｌｗｉｄｔｈ") == "finance fullwidth" # Ligature, fullwidth letters
+    assert normalize_text("½ of ₹10") == "1/2 of ₹10" # Fraction slash mapped to "/"
+    assert normalize_text("x² y") == "x2 y" # Superscript, no-break space
+
+
+def test_typographic_punctuation_becomes_ascii():
+    assert normalize_text("“Rule” ‘A’ — 2023–24 • item") == "\"Rule\" 'A' - 2023-24 * item"
+    assert normalize_text("co­oper​ative﻿") == "cooperative"
+    assert all(normalize_text(char).isascii() for char in ASCII_PUNCTUATION)
+
+
+def test_rupee_currency_and_devanagari_survive():
+    assert normalize_text("आयकर अधिनियम, ₹ 50,000 / $ 5 / € 3 / £ 2 / ¥ 1") == "आयकर अधिनियम, ₹ 50,000 / $ 5 / € 3 / £ 2 / ¥ 1"
+    assert normalize_text("क्‍ष") == "क्‍ष" # ZWJ inside a conjunct is kept
+
+
+def test_other_scripts_and_symbols_are_dropped():
+    assert normalize_text("Tax 税 😀 ✓ Ω done") == "Tax     done"
+
+
+def test_keep_rules_and_extra_ranges():
+    ascii_only = build_normalizer(keep=())
+    assert ascii_only("₹ 100 कर") == " 100 "
+    assert build_normalizer(keep=("currency",))("₹ 100 कर") == "₹ 100 "
+    assert build_normalizer(extra_ranges=r"ঀ-৿")("আয়কর ₹") == "আয়কর ₹"
+
+
+def test_ascii_only_rules_match_the_old_cleaner():
+    # Where NFKC and the punctuation map change nothing, keep=() must drop exactly what filter_ascii dropped
+    alphabet = [chr(c) for c in range(32, 127)] + list("\n\té₹€आयकर税😀✓ßñ")
+    alphabet = [char for char in alphabet if char not in ASCII_PUNCTUATION and unicodedata.normalize("NFKC", char) == char]
+    ascii_only = build_normalizer(keep=())
+    rng = random.Random(0)
+    for _ in range(500):
+        page = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        assert ascii_only(page) == filter_ascii(page), page
+
+
+def test_default_rules_only_add_to_the_old_cleaner():
+    rng = random.Random(1)
+    alphabet = [chr(c) for c in range(32, 127)] + list("é₹€आयकर税😀“”–")
+    for _ in range(500):
+        page = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        # Every ASCII character the old cleaner kept is still there, in order
+        remaining = iter(normalize_text(page))
+        assert all(char in remaining for char in filter_ascii(page)), page
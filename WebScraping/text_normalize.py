@@ -0,0 +1,49 @@
+import re
+import unicodedata
+
+# Normalisation of scraped PDF text, applied once at scrape time (per page) so the backend indexes it as is.
+# Everything runs as bulk str operations in C (NFKC, str.replace, one regex substitution) rather than a
+# Python loop over characters, and pure-ASCII pages skip straight through.
+
+# Typographic characters PDFs are full of, mapped to their ASCII equivalents (after NFKC)
+ASCII_PUNCTUATION = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '‟': '"', '″': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-', '−': '-',
+    '•': '*', '●': '*', '▪': '*', '‣': '*', '⁃': '-',
+    '⁄': '/',  # NFKC turns fractions like ½ into 1<fraction slash>2
+    '\u00ad': '', '\u200b': '', '\ufeff': '',  # Soft hyphen, zero-width space, BOM
+}
+
+# Character ranges kept besides ASCII, by rule name (regex character-class syntax)
+KEEP_RANGES = {
+    "currency": r"\u00a2-\u00a5\u20a0-\u20cf",  # Cent to yen, and the Currency Symbols block (includes ₹)
+    "devanagari": r"\u0900-\u097f\ua8e0-\ua8ff\u1cd0-\u1cff\u200c\u200d",  # Devanagari (+ Extended, Vedic), ZWNJ/ZWJ for conjuncts
+}
+DEFAULT_KEEP = ("currency", "devanagari")
+
+
+def build_normalizer(keep=DEFAULT_KEEP, extra_ranges=""):
+    """
+    Returns a function that NFKC-normalises text, maps typographic punctuation to ASCII and drops every
+    character outside ASCII and the kept ranges. keep names KEEP_RANGES rules (keep=() is plain ASCII
+    filtering); extra_ranges adds regex character-class ranges such as r"\\u0980-\\u09ff" (Bengali).
+    """
+    allowed = r"\x00-\x7f" + "".join(KEEP_RANGES[rule] for rule in keep) + extra_ranges
+    disallowed = re.compile(f"[^{allowed}]+")
+
+    def normalize(text):
+        if not text or text.isascii():
+            return text
+        text = unicodedata.normalize("NFKC", text)
+        # One replace per character present beats str.translate, which goes through Python for every
+        # character once the text is not pure ASCII
+        for char, replacement in ASCII_PUNCTUATION.items():
+            if char in text:
+                text = text.replace(char, replacement)
+        return disallowed.sub("", text)
+
+    return normalize
+
+
+normalize_text = build_normalizer()
@@ -1,61 +1,53 @@
 # backend/app.py
 
 # --- Core Flask & Utils ---
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import logging
 import os
 import tempfile
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from werkzeug.utils import secure_filename # For secure file handling
 
 # --- LLM, RAG, Embeddings ---
-from retriever import get_retriever
-from prompt_llm import build_prompt, get_llm_response
+from retriever import get_retriever, search_by_vector
+from metadata_filters import build_metadata_filter, detect_query_filter
+from prompt_llm import build_prompt, get_llm_response, stream_llm_response, LLMStreamError, LLM_EMPTY_RESPONSE, LLM_ERROR_RESPONSE
 from config import GROQ_API_KEY, GROQ_MODEL, EMBEDDING_MODEL # Need embedding model name
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from embedding_service import get_embedding_model, embed_texts
+from session_store import create_session_store
+from upload_jobs import UploadJobQueue, UploadQueueFullError
+from query_cache import SemanticAnswerCache
+from context_packer import get_tokenizer
+from metrics import RequestTimer, ANSWER_CACHE_LOOKUPS, CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+
+# --- Shared Upload/Query Pipeline (also used by asgi_app.py) ---
+from query_pipeline import (MAX_FILE_SIZE_MB, TOP_K_RAG_CHUNKS, CORS_ORIGINS, allowed_file, format_rag_context,
+                            search_session_document, combine_contexts, chat_history_update, serialize_chat, sse_event)
 
 # --- Database ---
 from pymongo import MongoClient, ReturnDocument, errors as mongo_errors
-from config import MONGODB_URI, MONGODB_DB, MONGODB_COLLECTION
+from config import MONGODB_URI, MONGODB_DB, MONGODB_COLLECTION, QUERY_CACHE_ENABLED, RERANK_ENABLED, RERANK_CANDIDATES
+from reranker import CrossEncoderReranker
 from bson import ObjectId # Keep just in case
 
-# --- File Parsing ---
-import fitz # PyMuPDF
-import pandas as pd
-import magic # python-magic or python-magic-bin
-
-# --- Math for Similarity ---
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Constants ---
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 150
-MAX_FILE_SIZE_MB = 10 # Limit upload size
-ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'csv', 'txt'}
-TOP_K_RAG_CHUNKS = 3 # How many chunks to get from Pinecone
-TOP_M_DOC_CHUNKS = 2 # How many chunks to get from user document
+RETRIEVAL_WORKERS = 8 # Threads for concurrent Pinecone retrieval (I/O bound)
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 # Configure CORS - Adjust origins for production
 CORS(app, resources={
-    r"/api/*": {"origins": ["http://localhost:3000", "YOUR_PRODUCTION_FRONTEND_URL_HERE"]}
+    r"/api/*": {"origins": CORS_ORIGINS}
 })
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE_MB * 1024 * 1024
 
-# --- Global In-Memory Store for Document Chunks ---
-# { session_id: { "filename": "...", "chunks": [text_chunk_1, text_chunk_2, ...] } }
-session_document_store = {}
-# WARNING: Temporary storage! Data lost on server restart.
-# TODO: Implement persistent storage and session cleanup later.
-
 # --- MongoDB Connection ---
 db = None
 chat_collection = None
@@ -68,83 +60,76 @@ try:
 except Exception as e:
     logging.error(f"Could not connect to MongoDB: {e}")
 
+# --- Session Document Store (uploaded-document chunks) ---
+# session_id -> { "filename": "...", "chunks": [text_chunk_1, ...], "embeddings": np.ndarray (n_chunks, dim) float32 }
+# Embeddings are L2-normalised at upload time, so cosine similarity is a plain dot product.
+# LRU + idle-TTL eviction within SESSION_STORE_MAX_BYTES. Backend set by SESSION_STORE_BACKEND:
+# "memory" (per worker), "disk" (shared by workers on one host) or "gridfs" (shared via MongoDB).
+session_document_store = create_session_store(db=db)
+
+# --- Background Upload Processing ---
+# /api/upload queues extract -> chunk -> embed on a small bounded pool; clients poll /api/upload/<job_id>
+upload_jobs = UploadJobQueue(session_document_store)
+
+# --- Semantic Answer Cache ---
+# Reuses answers for near-identical knowledge-base questions; cleared when index.py publishes a new index version
+answer_cache = SemanticAnswerCache() if QUERY_CACHE_ENABLED else None
+
+# --- Optional Cross-Encoder Reranker ---
+# Retrieves RERANK_CANDIDATES chunks and keeps the TOP_K_RAG_CHUNKS the cross-encoder scores highest
+reranker = None
+if RERANK_ENABLED:
+    try:
+        reranker = CrossEncoderReranker()
+    except Exception as e:
+        logging.error(f"Failed to load reranker, continuing without it: {e}")
+
 # --- Retriever Initialization ---
 retriever = None
 try:
-    retriever = get_retriever(k_results=TOP_K_RAG_CHUNKS)
+    retriever = get_retriever(k_results=RERANK_CANDIDATES if reranker else TOP_K_RAG_CHUNKS)
     logging.info("Retriever initialized successfully.")
 except Exception as e:
     logging.error(f"CRITICAL: Failed to initialize retriever: {e}")
 
+# --- Retrieval Executor ---
+# Runs the Pinecone round-trip while the request thread searches the uploaded document
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="rag-retrieval")
+
 # --- Embedding Model Initialization ---
+# Same instance the retriever uses (embedding_service keeps one model per process)
 embedding_model = None
 try:
     logging.info(f"Loading embedding model: {EMBEDDING_MODEL}...")
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+    embedding_model = get_embedding_model()
     logging.info("Embedding model loaded successfully.")
 except Exception as e:
     logging.error(f"CRITICAL: Failed to load embedding model: {e}")
 
-# --- Text Splitter Initialization ---
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP,
-    length_function=len,
-)
-
-# --- Helper Functions (unchanged) ---
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def extract_text_from_pdf(filepath):
-    try:
-        doc = fitz.open(filepath)
-        text = "".join(page.get_text() for page in doc)
-        doc.close()
-        return text
-    except Exception as e: logging.error(f"Error extracting PDF text {filepath}: {e}"); return None
-
-def extract_text_from_excel(filepath):
-    try:
-        excel_data = pd.read_excel(filepath, sheet_name=None)
-        text = ""
-        for sheet_name, df in excel_data.items():
-            text += f"--- Sheet: {sheet_name} ---\n"
-            try: text += df.to_markdown(index=False) + "\n\n"
-            except ImportError: text += df.to_string(index=False) + "\n\n"
-        return text
-    except Exception as e: logging.error(f"Error extracting Excel text {filepath}: {e}"); return None
-
-def extract_text_from_csv(filepath):
-    try:
-        df = pd.read_csv(filepath)
-        text = "--- CSV Data ---\n"
-        try: text += df.to_markdown(index=False) + "\n\n"
-        except ImportError: text += df.to_string(index=False) + "\n\n"
-        return text
-    except Exception as e: logging.error(f"Error extracting CSV text {filepath}: {e}"); return None
-
-def extract_text_from_txt(filepath):
-    try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f: return f.read()
-    except Exception as e: logging.error(f"Error extracting TXT {filepath}: {e}"); return None
+# Load the prompt tokenizer now rather than on the first query (context_packer.py)
+get_tokenizer()
 
 # --- Routes ---
 
 # Health check
 @app.route("/", methods=["GET"])
 def home():
+    try: session_store_stats = session_document_store.stats()
+    except Exception as e: logging.error(f"Error reading session store stats: {e}"); session_store_stats = {"error": str(e)}
     status = {
         "service": "RagFin AI Backend",
         "status": "Running" if retriever and embedding_model else "Error",
         "retriever_initialized": retriever is not None,
         "embedding_model_loaded": embedding_model is not None,
         "mongodb_connected": db is not None,
+        "session_store": session_store_stats,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "upload_jobs": upload_jobs.stats(),
     }
     return jsonify(status), 200 if retriever and embedding_model else 503
 
 # File Upload Endpoint (Uses session_id from frontend)
+# Saves the file and queues it for background processing: 202 {"job_id", ...}, or 429 when the upload queue is full
 @app.route("/api/upload", methods=["POST"])
 def upload_document():
     if 'file' not in request.files: return jsonify({"error": "No file part."}), 400
@@ -163,165 +148,237 @@ def upload_document():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         logging.info(f"Received upload for session {session_id}: {filename}")
-        _, temp_filepath = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
-        extracted_text = None
+        fd, temp_filepath = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+        os.close(fd)
         try:
             file.save(temp_filepath)
             logging.info(f"Temp file: {temp_filepath}")
-            mime_type = magic.from_file(temp_filepath, mime=True); logging.info(f"MIME: {mime_type}")
-
-            if 'pdf' in mime_type: extracted_text = extract_text_from_pdf(temp_filepath)
-            elif 'excel' in mime_type or 'spreadsheetml' in mime_type or filename.endswith('.xlsx'): extracted_text = extract_text_from_excel(temp_filepath)
-            elif 'csv' in mime_type or filename.endswith('.csv'): extracted_text = extract_text_from_csv(temp_filepath)
-            elif 'text' in mime_type or filename.endswith('.txt'): extracted_text = extract_text_from_txt(temp_filepath)
-            else: return jsonify({"error": f"Unsupported file type: {mime_type}"}), 415
-
-            if not extracted_text: return jsonify({"error": "Failed to extract text."}), 500
-
-            logging.info(f"Chunking text for {filename}...")
-            text_chunks = text_splitter.split_text(extracted_text)
-            logging.info(f"Created {len(text_chunks)} chunks.")
-
-            # Store text chunks in memory using the session_id from frontend
-            session_document_store[session_id] = { "filename": filename, "chunks": text_chunks }
-            logging.info(f"Stored {len(text_chunks)} text chunks for session {session_id}.")
-
-            # Return success confirmation
-            return jsonify({
-                "message": f"Processed '{filename}'. Context active for session.",
-                "filename": filename
-                # No need to return session_id, frontend sent it
-            }), 200
+            job = upload_jobs.submit(session_id, filename, temp_filepath) # The job deletes the temp file
+        except UploadQueueFullError as e:
+            logging.warning(f"Upload rejected for session {session_id}: {e}")
+            remove_temp_file(temp_filepath)
+            return jsonify({"error": "Too many uploads in progress. Please retry shortly."}), 429, {"Retry-After": "5"}
         except Exception as e:
-            logging.exception(f"Error processing uploaded file {filename}: {e}")
+            logging.exception(f"Error queueing uploaded file {filename}: {e}")
+            remove_temp_file(temp_filepath)
             return jsonify({"error": "Error processing file."}), 500
-        finally:
-            if os.path.exists(temp_filepath):
-                try: os.remove(temp_filepath); logging.info(f"Removed temp file: {temp_filepath}")
-                except OSError as e: logging.error(f"Error removing temp file {temp_filepath}: {e}")
+        return jsonify({
+            "message": f"Processing '{filename}'. Poll the job for status.",
+            "filename": filename,
+            "job_id": job["job_id"],
+            "status": job["status"],
+        }), 202
     else:
         return jsonify({"error": "File type not allowed."}), 400
 
+# Upload Job Status: {"job_id", "status": "queued" | "processing" | "ready" | "failed", "filename", "chunks", "error"}
+@app.route("/api/upload/<string:job_id>", methods=["GET"])
+def upload_status(job_id):
+    job = upload_jobs.status(job_id)
+    if job is None: return jsonify({"error": "Upload job not found."}), 404
+    return jsonify({key: job[key] for key in ("job_id", "status", "filename", "chunks", "error")})
 
-# Query Endpoint (Uses session_id, combines contexts, uses upsert for history)
-@app.route("/api/query", methods=["POST"])
-def query_endpoint():
+def remove_temp_file(temp_filepath):
+    try: os.remove(temp_filepath); logging.info(f"Removed temp file: {temp_filepath}")
+    except OSError as e: logging.error(f"Error removing temp file {temp_filepath}: {e}")
+
+
+# --- Query Pipeline Helpers (shared by /api/query and /api/query/stream) ---
+def parse_query_request():
+    """Validates the JSON body of a query request. Returns (user_query, session_id, metadata_filter, error_response)."""
     if not retriever or not embedding_model:
-        logging.error("Retriever or Embedding Model not available."); return jsonify({"error": "Backend service not fully ready."}), 503
-    if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
+        logging.error("Retriever or Embedding Model not available."); return None, None, None, (jsonify({"error": "Backend service not fully ready."}), 503)
+    if not request.is_json: return None, None, None, (jsonify({"error": "Request must be JSON"}), 415)
 
-    data = request.get_json()
-    user_query = data.get("query", "").strip()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict): return None, None, None, (jsonify({"error": "Invalid JSON body"}), 400)
+    user_query = (data.get("query") or "").strip()
     chat_id = data.get("chat_id") # Use this as the consistent session identifier
 
-    if not user_query: return jsonify({"error": "Query cannot be empty"}), 400
+    if not user_query: return None, None, None, (jsonify({"error": "Query cannot be empty"}), 400)
+    # Optional retrieval filters: {"date_from", "date_to", "source", "notification_number"} (see metadata_filters.py)
+    try: metadata_filter = build_metadata_filter(data.get("filters"))
+    except ValueError as e: return None, None, None, (jsonify({"error": f"Invalid filters: {e}"}), 400)
     # --- Use chat_id consistently as session_id ---
     session_id = chat_id
-    logging.info(f"Processing query: '{user_query}' (Session ID: {session_id or 'None Provided'})")
-    # --- End consistency change ---
+    logging.info(f"Processing query: '{user_query}' (Session ID: {session_id or 'None Provided'}, filter: {metadata_filter})")
+    return user_query, session_id, metadata_filter, None
+
+def retrieve_rag_context(user_query, query_embedding, metadata_filter=None, query_filter=None, timer=None):
+    """Fetches the top knowledge-base chunks for the (already embedded) query. Returns their texts."""
+    timer = timer or RequestTimer("retrieval")
+    logging.info(f"Invoking retriever for RAG context...")
+    with timer.stage("retrieval"): rag_chunks_docs = search_by_vector(retriever, query_embedding, user_query, metadata_filter, query_filter)
+    if reranker is not None:
+        with timer.stage("rerank"): rag_chunks_docs = reranker.rerank(user_query, rag_chunks_docs, TOP_K_RAG_CHUNKS)
+    logging.info(f"Retrieved {len(rag_chunks_docs)} RAG chunks.")
+    return format_rag_context(rag_chunks_docs)
+
+def prepare_query(user_query, session_id, metadata_filter=None, timer=None):
+    """
+    Runs everything before the LLM call: answer cache lookup, RAG retrieval, document search, prompt build.
+    Returns a dict with either "answer" (cache hit) or "prompt", plus what record_answer() needs.
+    Stage timings go to timer (metrics.RequestTimer).
+    """
+    timer = timer or RequestTimer("query")
+    # 0. Embed the query once; reused by the answer cache, the Pinecone search and the document search
+    with timer.stage("embed"): query_embedding = embed_texts([user_query])[0]
+    with timer.stage("session_load"): session_data = session_document_store.get(session_id) if session_id else None
+    prepared = {"query": user_query, "query_embedding": query_embedding, "answer": None, "prompt": None, "cacheable": False}
+    query_filter = detect_query_filter(user_query, metadata_filter)
+    # Filtered answers depend on the filter (or the exact notification number), which the query embedding barely reflects
+    filtered = bool(metadata_filter or query_filter)
+
+    # 1. Semantic answer cache (knowledge-base questions only; document answers are session specific)
+    cached = None
+    if answer_cache is not None and not session_data and not filtered:
+        with timer.stage("answer_cache"): cached = answer_cache.lookup(query_embedding)
+        ANSWER_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+    if cached:
+        logging.info(f"Answer cache hit (similarity {cached['similarity']:.3f} to '{cached['query']}'). Skipping retrieval and LLM.")
+        prepared["answer"] = cached["answer"]
+        return prepared
+
+    # 2-3. RAG retrieval (Pinecone round-trip) and user-document search (CPU) are independent: run them concurrently
+    rag_future = retrieval_executor.submit(retrieve_rag_context, user_query, query_embedding, metadata_filter, query_filter, timer)
+    with timer.stage("doc_search"): doc_context_parts, doc_filename_for_prompt = search_session_document(session_id, session_data, query_embedding)
+    rag_context_parts = rag_future.result()
+
+    # 4-5. Combine Contexts and Build Prompt
+    with timer.stage("prompt_build"):
+        combined_context = combine_contexts(rag_context_parts, doc_context_parts, doc_filename_for_prompt)
+        prepared["prompt"] = build_prompt(user_query, combined_context)
+    # Only answers that depend on the knowledge base alone may be reused for other sessions
+    prepared["cacheable"] = bool(rag_context_parts) and not doc_context_parts and not filtered
+    return prepared
+
+def record_answer(prepared, answer, llm_failed=False):
+    """Caches a freshly generated answer if it only depended on the knowledge base and the LLM call succeeded."""
+    if answer_cache is None or not prepared["cacheable"] or llm_failed: return
+    if answer in (LLM_EMPTY_RESPONSE, LLM_ERROR_RESPONSE): return
+    answer_cache.store(prepared["query"], prepared["query_embedding"], answer)
+
+def save_chat_history(session_id, user_query, answer):
+    """Appends the user/assistant turn to the session's chat document. Returns the chat_id to send back."""
+    session_id_to_return = session_id # Use the ID received from frontend
+
+    # Store/Update chat history using UPSERT
+    if chat_collection is not None:
+        try:
+            # --- Use session_id consistently, require frontend to send it ---
+            if session_id_to_use := session_id: # Python 3.8+ assignment expression
+                logging.info(f"Upserting chat history for session: {session_id_to_use}")
+                update_data = chat_history_update(session_id_to_use, user_query, answer)
+                result = chat_collection.update_one({"session_id": session_id_to_use}, update_data, upsert=True)
+                if result.matched_count > 0: logging.info(f"Appended to existing session: {session_id_to_use}")
+                elif result.upserted_id is not None: logging.info(f"Created new session via upsert: {session_id_to_use}")
+                else: logging.error(f"Chat history upsert failed unexpectedly: {session_id_to_use}")
+                session_id_to_return = session_id_to_use # Ensure we return the ID used/created
+            else:
+                # This case means frontend sent chat_id=null or empty string
+                logging.error("No valid session_id received from frontend in /api/query. Cannot save history.")
+                session_id_to_return = None # Indicate history wasn't saved persistently
+
+        except mongo_errors.PyMongoError as mongo_e:
+            logging.error(f"MongoDB error during chat history upsert: {mongo_e}")
+            session_id_to_return = session_id # Return ID frontend sent even if save failed
+        except Exception as hist_e:
+             logging.exception(f"Unexpected error during chat history handling: {hist_e}")
+             session_id_to_return = session_id
+    else:
+         logging.warning("MongoDB not connected. Chat history not saved.")
+         # If no DB and no ID from frontend, generate temp ID for response consistency
+         if not session_id_to_return: session_id_to_return = str(uuid.uuid4()) + "-tmp-nodb"
+    return session_id_to_return
+
+
+# Query Endpoint (Uses session_id, combines contexts, uses upsert for history)
+@app.route("/api/query", methods=["POST"])
+def query_endpoint():
+    user_query, session_id, metadata_filter, error_response = parse_query_request()
+    if error_response: return error_response
 
+    timer = RequestTimer("query")
     try:
-        # 1. Retrieve RAG Context
-        logging.info(f"Invoking retriever for RAG context...")
-        rag_chunks_docs = retriever.invoke(user_query)
-        logging.info(f"Retrieved {len(rag_chunks_docs)} RAG chunks.")
-        rag_context_parts = []; rag_source_info = []
-        for i, doc in enumerate(rag_chunks_docs):
-            text = doc.page_content if hasattr(doc, 'page_content') and doc.page_content else doc.metadata.get('chunk_text')
-            if text:
-                rag_context_parts.append(text)
-                filename = doc.metadata.get('source_filename', '?'); chunk_idx = doc.metadata.get('chunk_index', '?')
-                rag_source_info.append(f"{filename}({chunk_idx})")
-            else: logging.warning(f"RAG chunk {i} has no text.")
-        rag_context = "\n\n".join(rag_context_parts)
-        logging.info(f"RAG Context from: {', '.join(rag_source_info) if rag_source_info else 'None'}")
-
-        # 2. Retrieve User Document Context (if session_id exists in store)
-        doc_context_parts = []; doc_source_info = []
-        doc_filename_for_prompt = "Uploaded Document"
-        if session_id and session_id in session_document_store:
-            session_data = session_document_store[session_id]
-            doc_filename_for_prompt = session_data.get("filename", doc_filename_for_prompt)
-            doc_text_chunks = session_data.get("chunks", [])
-            logging.info(f"Found {len(doc_text_chunks)} doc chunks for session {session_id} ({doc_filename_for_prompt}). Searching...")
-            if doc_text_chunks:
-                try:
-                    query_embedding = embedding_model.encode([user_query])
-                    doc_chunk_embeddings = embedding_model.encode(doc_text_chunks)
-                    similarities = cosine_similarity(query_embedding, doc_chunk_embeddings)[0]
-                    top_m_indices = np.argsort(similarities)[-TOP_M_DOC_CHUNKS:][::-1]
-                    for idx in top_m_indices:
-                         # Maybe add similarity threshold later: if similarities[idx] > 0.X:
-                         doc_context_parts.append(doc_text_chunks[idx])
-                         doc_source_info.append(f"chunk {idx} (score {similarities[idx]:.3f})")
-                    logging.info(f"Doc Context from {doc_filename_for_prompt}: {', '.join(doc_source_info) if doc_source_info else 'None relevant'}")
-                except Exception as emb_e: logging.exception(f"Error embedding/comparing doc chunks: {emb_e}")
-            else: logging.info(f"No text chunks in store for session {session_id}.")
-        else: logging.info(f"No doc context in store for session {session_id}.")
-        doc_context = "\n\n".join(doc_context_parts)
-
-        # 3. Combine Contexts
-        combined_context = ""
-        if rag_context_parts: combined_context += "Context from Recent Notifications:\n---\n" + rag_context + "\n---\n\n"
-        if doc_context_parts: combined_context += f"Context from User's Document ({doc_filename_for_prompt}):\n---\n" + doc_context + "\n---"
-        if not combined_context: combined_context = "No relevant context found."; logging.warning("No context constructed.")
-
-        # 4. Build Prompt
-        final_prompt = build_prompt(user_query, combined_context)
-
-        # 5. Get LLM Response
-        logging.info("Requesting LLM response...")
-        answer = get_llm_response(final_prompt)
-        logging.info(f"Received LLM response.")
-
-        # 6. Prepare messages
-        now_utc = datetime.now(timezone.utc)
-        message_user = {"role": "user", "content": user_query, "timestamp": now_utc.isoformat()}
-        message_assistant = {"role": "assistant", "content": answer, "timestamp": now_utc.isoformat()}
-        session_id_to_return = session_id # Use the ID received from frontend
-
-        # 7. Store/Update chat history using UPSERT
-        if chat_collection is not None:
-            try:
-                # --- Use session_id consistently, require frontend to send it ---
-                if session_id_to_use := session_id: # Python 3.8+ assignment expression
-                    logging.info(f"Upserting chat history for session: {session_id_to_use}")
-                    update_data = {
-                        "$push": {"messages": {"$each": [message_user, message_assistant]}},
-                        "$set": {"last_updated": now_utc},
-                        "$setOnInsert": {
-                             "session_id": session_id_to_use,
-                             "title": user_query[:75] + "..." if len(user_query) > 75 else user_query,
-                             "created_at": now_utc }}
-                    result = chat_collection.update_one({"session_id": session_id_to_use}, update_data, upsert=True)
-                    if result.matched_count > 0: logging.info(f"Appended to existing session: {session_id_to_use}")
-                    elif result.upserted_id is not None: logging.info(f"Created new session via upsert: {session_id_to_use}")
-                    else: logging.error(f"Chat history upsert failed unexpectedly: {session_id_to_use}")
-                    session_id_to_return = session_id_to_use # Ensure we return the ID used/created
-                else:
-                    # This case means frontend sent chat_id=null or empty string
-                    logging.error("No valid session_id received from frontend in /api/query. Cannot save history.")
-                    session_id_to_return = None # Indicate history wasn't saved persistently
-
-            except mongo_errors.PyMongoError as mongo_e:
-                logging.error(f"MongoDB error during chat history upsert: {mongo_e}")
-                session_id_to_return = session_id # Return ID frontend sent even if save failed
-            except Exception as hist_e:
-                 logging.exception(f"Unexpected error during chat history handling: {hist_e}")
-                 session_id_to_return = session_id
-        else:
-             logging.warning("MongoDB not connected. Chat history not saved.")
-             # If no DB and no ID from frontend, generate temp ID for response consistency
-             if not session_id_to_return: session_id_to_return = str(uuid.uuid4()) + "-tmp-nodb"
-
-        # 8. Return response
-        return jsonify({"answer": answer, "chat_id": session_id_to_return})
+        # 1-5. Cache lookup, retrieval, document search and prompt build
+        prepared = prepare_query(user_query, session_id, metadata_filter, timer)
+        answer = prepared["answer"]
+
+        # 6. Get LLM Response (unless the answer cache already had one)
+        if answer is None:
+            logging.info("Requesting LLM response...")
+            with timer.stage("llm"): answer = get_llm_response(prepared["prompt"])
+            logging.info(f"Received LLM response.")
+            record_answer(prepared, answer)
+
+        # 7. Store/Update chat history
+        with timer.stage("history"): session_id_to_return = save_chat_history(session_id, user_query, answer)
+
+        # 8. Return response, with the per-stage breakdown for browser dev tools / load tests
+        timer.finish("ok")
+        response = jsonify({"answer": answer, "chat_id": session_id_to_return})
+        response.headers["Server-Timing"] = timer.server_timing()
+        return response
 
     except Exception as e:
+        timer.finish("error")
         logging.exception(f"Critical error processing query '{user_query}': {e}")
         return jsonify({"error": "An internal error occurred."}), 500
 
 
+# Streaming Query Endpoint (same request body as /api/query; answer arrives as server-sent events)
+# Events: "token" {"text": ...} per LLM delta, then "done" {"chat_id": ..., "timings": {stage: ms}} or "error" {"error": ...}
+@app.route("/api/query/stream", methods=["POST"])
+def query_stream_endpoint():
+    user_query, session_id, metadata_filter, error_response = parse_query_request()
+    if error_response: return error_response
+
+    def generate():
+        timer = RequestTimer("query_stream")
+        try:
+            prepared = prepare_query(user_query, session_id, metadata_filter, timer)
+            if prepared["answer"] is not None:
+                answer = prepared["answer"]
+                yield sse_event("token", {"text": answer})
+            else:
+                logging.info("Streaming LLM response...")
+                answer_parts = []; llm_failed = False
+                # "llm" excludes the time spent writing tokens to the client; "llm_first_token" is time to first token
+                llm_started = time.perf_counter(); llm_seconds = 0.0
+                for delta in stream_llm_response(prepared["prompt"]):
+                    llm_seconds += time.perf_counter() - llm_started
+                    if not answer_parts: timer.record("llm_first_token", llm_seconds)
+                    if delta == LLM_EMPTY_RESPONSE: llm_failed = True
+                    answer_parts.append(delta)
+                    yield sse_event("token", {"text": delta})
+                    llm_started = time.perf_counter()
+                timer.record("llm", llm_seconds + time.perf_counter() - llm_started)
+                answer = "".join(answer_parts).strip()
+                logging.info(f"LLM stream completed ({len(answer)} chars).")
+                record_answer(prepared, answer, llm_failed=llm_failed)
+            # History is written once the whole answer is known
+            with timer.stage("history"): session_id_to_return = save_chat_history(session_id, user_query, answer)
+            timer.finish("ok")
+            yield sse_event("done", {"chat_id": session_id_to_return, "timings": timer.breakdown()})
+        except LLMStreamError:
+            # The client already has part of an answer; it is neither saved to history nor cached
+            timer.finish("error")
+            yield sse_event("error", {"error": LLM_ERROR_RESPONSE})
+        except Exception as e:
+            timer.finish("error")
+            logging.exception(f"Critical error streaming query '{user_query}': {e}")
+            yield sse_event("error", {"error": "An internal error occurred."})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Prometheus scrape endpoint: per-stage and end-to-end query latency histograms, request and cache counters
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
 # GET /api/chats - Unchanged
 @app.route("/api/chats", methods=["GET"])
 def get_chat_list():
@@ -343,12 +400,7 @@ def get_chat_messages(session_id):
     try:
         chat_data = chat_collection.find_one({"session_id": session_id},{"_id": 0})
         if chat_data:
-            if 'messages' in chat_data and isinstance(chat_data['messages'], list):
-                 for msg in chat_data['messages']:
-                      if isinstance(msg.get('timestamp'), datetime): msg['timestamp'] = msg['timestamp'].isoformat()
-            if isinstance(chat_data.get('created_at'), datetime): chat_data['created_at'] = chat_data['created_at'].isoformat()
-            if isinstance(chat_data.get('last_updated'), datetime): chat_data['last_updated'] = chat_data['last_updated'].isoformat()
-            return jsonify(chat_data)
+            return jsonify(serialize_chat(chat_data))
         else: return jsonify({"error": "Chat session not found."}), 404
     except Exception as e: logging.exception(f"Error fetching chat {session_id}: {e}"); return jsonify({"error": "Server error."}), 500
 
@@ -358,7 +410,9 @@ def save_update_chat():
     # ... (same as previous version) ...
     if chat_collection is None: return jsonify({"error": "Database unavailable."}), 503
     if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
-    data = request.get_json(); messages = data.get("messages"); chat_id = data.get("chat_id"); title = data.get("title")
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict): return jsonify({"error": "Invalid JSON body"}), 400
+    messages = data.get("messages"); chat_id = data.get("chat_id"); title = data.get("title")
     if not messages or not isinstance(messages, list): return jsonify({"error": "Invalid 'messages'."}), 400
     for msg in messages:
          if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg: return jsonify({"error": "Invalid message structure."}), 400
@@ -0,0 +1,422 @@
+# backend/asgi_app.py
+"""
+Async (ASGI) serving mode for the RagFin AI backend.
+
+Serves the same /api contract as app.py, but waits on Pinecone (httpx), Groq (AsyncGroq) and
+MongoDB (motor) without holding a worker, so one process keeps many queries in flight.
+CPU-bound work (embedding, file parsing) runs on a small bounded thread pool.
+
+Run with:  uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+      or:  gunicorn -k uvicorn.workers.UvicornWorker -w 2 -b 0.0.0.0:$PORT asgi_app:app
+"""
+
+# --- Core ASGI & Utils ---
+import asyncio
+import functools
+import logging
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from werkzeug.utils import secure_filename # For secure file handling
+
+# --- LLM, RAG, Embeddings ---
+from retriever import get_async_search, asearch
+from metadata_filters import build_metadata_filter, detect_query_filter
+from prompt_llm import build_prompt, aget_llm_response, astream_llm_response, LLMStreamError, LLM_EMPTY_RESPONSE, LLM_ERROR_RESPONSE
+from config import (EMBEDDING_MODEL, QUERY_CACHE_ENABLED, SESSION_STORE_BACKEND, ASYNC_CPU_WORKERS, ASYNC_CPU_QUEUE,
+                    RERANK_ENABLED, RERANK_CANDIDATES)
+from reranker import CrossEncoderReranker
+from embedding_service import get_embedding_model, embed_texts
+from session_store import create_session_store
+from upload_jobs import UploadJobQueue, UploadQueueFullError
+from query_cache import SemanticAnswerCache
+from context_packer import get_tokenizer
+from metrics import RequestTimer, ANSWER_CACHE_LOOKUPS, CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from query_pipeline import (MAX_FILE_SIZE_MB, TOP_K_RAG_CHUNKS, CORS_ORIGINS, allowed_file, format_rag_context,
+                            search_session_document, combine_contexts, chat_history_update, serialize_chat, sse_event)
+
+# --- Database ---
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, errors as mongo_errors
+from config import MONGODB_URI, MONGODB_DB, MONGODB_COLLECTION
+
+# --- Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+UPLOAD_READ_BYTES = 1024 * 1024
+
+# --- Shared State (initialised in lifespan) ---
+state = {
+    "db": None, "chat_collection": None, "vector_search": None, "embedding_model": None, "reranker": None,
+    "session_document_store": None, "upload_jobs": None, "answer_cache": SemanticAnswerCache() if QUERY_CACHE_ENABLED else None,
+}
+
+# --- Bounded CPU Executor ---
+# Embedding and parsing hold the GIL for long stretches; a few threads is all a process can use.
+# The semaphore bounds how many jobs may queue so bursts apply backpressure instead of piling up.
+cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="cpu")
+cpu_slots = asyncio.Semaphore(ASYNC_CPU_WORKERS + ASYNC_CPU_QUEUE)
+
+async def run_cpu(fn, *args):
+    """Runs a CPU-bound callable on the bounded executor."""
+    async with cpu_slots:
+        return await asyncio.get_running_loop().run_in_executor(cpu_executor, functools.partial(fn, *args))
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    # --- MongoDB Connection (motor) ---
+    try:
+        mongo_client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+        await mongo_client.admin.command('ismaster')
+        state["db"] = mongo_client[MONGODB_DB]
+        state["chat_collection"] = state["db"][MONGODB_COLLECTION]
+        logging.info(f"Successfully connected to MongoDB: {MONGODB_DB}/{MONGODB_COLLECTION}")
+    except Exception as e:
+        logging.error(f"Could not connect to MongoDB: {e}")
+
+    # --- Session Document Store ---
+    # The GridFS backend is synchronous; it gets its own pymongo client and is called via asyncio.to_thread
+    sync_db = None
+    if SESSION_STORE_BACKEND == "gridfs" and state["db"] is not None:
+        sync_db = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)[MONGODB_DB]
+    state["session_document_store"] = create_session_store(db=sync_db)
+    # Uploads are processed on their own bounded pool (upload_jobs.py), not on cpu_executor, so bursts cannot starve queries
+    state["upload_jobs"] = UploadJobQueue(state["session_document_store"])
+
+    # --- Async Vector Search (Pinecone or local index) ---
+    try:
+        state["vector_search"] = await asyncio.to_thread(get_async_search)
+    except Exception as e:
+        logging.error(f"CRITICAL: Failed to initialize async vector search: {e}")
+
+    # --- Embedding Model Initialization ---
+    try:
+        logging.info(f"Loading embedding model: {EMBEDDING_MODEL}...")
+        state["embedding_model"] = await run_cpu(get_embedding_model)
+        logging.info("Embedding model loaded successfully.")
+    except Exception as e:
+        logging.error(f"CRITICAL: Failed to load embedding model: {e}")
+    await run_cpu(get_tokenizer) # Prompt tokenizer for context packing (context_packer.py)
+
+    # --- Optional Cross-Encoder Reranker ---
+    if RERANK_ENABLED:
+        try:
+            state["reranker"] = await run_cpu(CrossEncoderReranker)
+        except Exception as e:
+            logging.error(f"Failed to load reranker, continuing without it: {e}")
+
+    yield
+
+    if state["vector_search"] is not None: await state["vector_search"].aclose()
+    state["upload_jobs"].shutdown()
+    cpu_executor.shutdown(wait=False)
+
+
+# --- ASGI App Initialization ---
+app = FastAPI(title="RagFin AI Backend", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"])
+
+def error(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+async def read_json_object(request: Request):
+    """Returns the parsed JSON body, or None if it is malformed or not an object (callers answer 400, like app.py)."""
+    try: data = await request.json()
+    except ValueError: return None # json.JSONDecodeError and UnicodeDecodeError are both ValueErrors
+    return data if isinstance(data, dict) else None
+
+
+# --- Routes ---
+
+# Health check
+@app.get("/")
+async def home():
+    ready = state["vector_search"] is not None and state["embedding_model"] is not None
+    try: session_store_stats = await asyncio.to_thread(state["session_document_store"].stats)
+    except Exception as e: logging.error(f"Error reading session store stats: {e}"); session_store_stats = {"error": str(e)}
+    answer_cache = state["answer_cache"]
+    status = {
+        "service": "RagFin AI Backend (async)",
+        "status": "Running" if ready else "Error",
+        "retriever_initialized": state["vector_search"] is not None,
+        "embedding_model_loaded": state["embedding_model"] is not None,
+        "mongodb_connected": state["db"] is not None,
+        "session_store": session_store_stats,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "upload_jobs": state["upload_jobs"].stats(),
+    }
+    return JSONResponse(status, status_code=200 if ready else 503)
+
+# File Upload Endpoint (Uses session_id from frontend); queues background processing like app.py
+@app.post("/api/upload")
+async def upload_document(file: UploadFile = File(None), session_id: str = Form(None)):
+    if file is None: return error("No file part.", 400)
+    if state["embedding_model"] is None: return error("Backend embedding model not available.", 503)
+    if not session_id:
+        logging.error("Missing session_id in upload request form data.")
+        return error("Session ID is required for upload.", 400)
+    if not file.filename: return error("No selected file.", 400)
+    if not allowed_file(file.filename): return error("File type not allowed.", 400)
+
+    filename = secure_filename(file.filename)
+    logging.info(f"Received upload for session {session_id}: {filename}")
+    fd, temp_filepath = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    try:
+        # Stream the upload to disk, enforcing the same size limit as Flask's MAX_CONTENT_LENGTH
+        size_bytes = 0
+        with os.fdopen(fd, "wb") as out:
+            while data := await file.read(UPLOAD_READ_BYTES):
+                size_bytes += len(data)
+                if size_bytes > MAX_FILE_SIZE_MB * 1024 * 1024: return error("File too large.", 413)
+                await asyncio.to_thread(out.write, data)
+        logging.info(f"Temp file: {temp_filepath}")
+        job = await asyncio.to_thread(state["upload_jobs"].submit, session_id, filename, temp_filepath)
+        temp_filepath = None # Owned (and deleted) by the job now
+        return JSONResponse({"message": f"Processing '{filename}'. Poll the job for status.", "filename": filename,
+                             "job_id": job["job_id"], "status": job["status"]}, status_code=202)
+    except UploadQueueFullError as e:
+        logging.warning(f"Upload rejected for session {session_id}: {e}")
+        return JSONResponse({"error": "Too many uploads in progress. Please retry shortly."}, status_code=429, headers={"Retry-After": "5"})
+    except Exception as e:
+        logging.exception(f"Error processing uploaded file {filename}: {e}")
+        return error("Error processing file.", 500)
+    finally:
+        if temp_filepath is not None:
+            try: os.remove(temp_filepath); logging.info(f"Removed temp file: {temp_filepath}")
+            except OSError as e: logging.error(f"Error removing temp file {temp_filepath}: {e}")
+
+# Upload Job Status (same response as app.py)
+@app.get("/api/upload/{job_id}")
+async def upload_status(job_id: str):
+    job = await asyncio.to_thread(state["upload_jobs"].status, job_id)
+    if job is None: return error("Upload job not found.", 404)
+    return JSONResponse({key: job[key] for key in ("job_id", "status", "filename", "chunks", "error")})
+
+
+# --- Query Pipeline (async counterparts of the helpers in app.py) ---
+async def parse_query_request(request: Request):
+    """Validates the JSON body of a query request. Returns (user_query, session_id, metadata_filter, error_response)."""
+    if state["vector_search"] is None or state["embedding_model"] is None:
+        logging.error("Retriever or Embedding Model not available."); return None, None, None, error("Backend service not fully ready.", 503)
+    if "application/json" not in request.headers.get("content-type", ""): return None, None, None, error("Request must be JSON", 415)
+    data = await read_json_object(request)
+    if data is None: return None, None, None, error("Invalid JSON body", 400)
+    user_query = (data.get("query") or "").strip()
+    session_id = data.get("chat_id") # Use chat_id consistently as session_id
+    if not user_query: return None, None, None, error("Query cannot be empty", 400)
+    try: metadata_filter = build_metadata_filter(data.get("filters"))
+    except ValueError as e: return None, None, None, error(f"Invalid filters: {e}", 400)
+    logging.info(f"Processing query: '{user_query}' (Session ID: {session_id or 'None Provided'}, filter: {metadata_filter})")
+    return user_query, session_id, metadata_filter, None
+
+async def retrieve_rag_context(user_query, query_embedding, metadata_filter=None, query_filter=None, timer=None):
+    timer = timer or RequestTimer("retrieval")
+    logging.info(f"Querying vector store for RAG context...")
+    reranker = state["reranker"]
+    k = RERANK_CANDIDATES if reranker is not None else TOP_K_RAG_CHUNKS
+    with timer.stage("retrieval"): rag_chunks_docs = await asearch(state["vector_search"], query_embedding, k, user_query, metadata_filter, query_filter)
+    if reranker is not None:
+        with timer.stage("rerank"): rag_chunks_docs = await run_cpu(reranker.rerank, user_query, rag_chunks_docs, TOP_K_RAG_CHUNKS)
+    logging.info(f"Retrieved {len(rag_chunks_docs)} RAG chunks.")
+    return format_rag_context(rag_chunks_docs)
+
+async def prepare_query(user_query, session_id, metadata_filter=None, timer=None):
+    """Async version of app.prepare_query: cache lookup, concurrent retrieval + document search, prompt build."""
+    answer_cache = state["answer_cache"]
+    timer = timer or RequestTimer("query")
+    # Stages that go through run_cpu include their wait for a CPU slot, which is part of the latency under load
+    with timer.stage("embed"): query_embedding = (await run_cpu(embed_texts, [user_query]))[0]
+    with timer.stage("session_load"): session_data = await asyncio.to_thread(state["session_document_store"].get, session_id) if session_id else None
+    prepared = {"query": user_query, "query_embedding": query_embedding, "answer": None, "prompt": None, "cacheable": False}
+    query_filter = detect_query_filter(user_query, metadata_filter)
+    filtered = bool(metadata_filter or query_filter) # Never served from / stored in the answer cache, as in app.py
+
+    cached = None
+    if answer_cache is not None and not session_data and not filtered:
+        with timer.stage("answer_cache"): cached = answer_cache.lookup(query_embedding)
+        ANSWER_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+    if cached:
+        logging.info(f"Answer cache hit (similarity {cached['similarity']:.3f} to '{cached['query']}'). Skipping retrieval and LLM.")
+        prepared["answer"] = cached["answer"]
+        return prepared
+
+    rag_task = asyncio.create_task(retrieve_rag_context(user_query, query_embedding, metadata_filter, query_filter, timer))
+    try:
+        with timer.stage("doc_search"): doc_context_parts, doc_filename_for_prompt = await run_cpu(search_session_document, session_id, session_data, query_embedding)
+    except BaseException:
+        rag_task.cancel()
+        raise
+    rag_context_parts = await rag_task
+
+    with timer.stage("prompt_build"):
+        combined_context = await run_cpu(combine_contexts, rag_context_parts, doc_context_parts, doc_filename_for_prompt) # Tokenizes
+        prepared["prompt"] = build_prompt(user_query, combined_context)
+    prepared["cacheable"] = bool(rag_context_parts) and not doc_context_parts and not filtered
+    return prepared
+
+def record_answer(prepared, answer, llm_failed=False):
+    answer_cache = state["answer_cache"]
+    if answer_cache is None or not prepared["cacheable"] or llm_failed: return
+    if answer in (LLM_EMPTY_RESPONSE, LLM_ERROR_RESPONSE): return
+    answer_cache.store(prepared["query"], prepared["query_embedding"], answer)
+
+async def save_chat_history(session_id, user_query, answer):
+    """Appends the user/assistant turn via motor. Returns the chat_id to send back."""
+    chat_collection = state["chat_collection"]
+    if chat_collection is None:
+        logging.warning("MongoDB not connected. Chat history not saved.")
+        return session_id or str(uuid.uuid4()) + "-tmp-nodb"
+    if not session_id:
+        logging.error("No valid session_id received from frontend in /api/query. Cannot save history.")
+        return None
+    try:
+        result = await chat_collection.update_one({"session_id": session_id}, chat_history_update(session_id, user_query, answer), upsert=True)
+        if result.matched_count > 0: logging.info(f"Appended to existing session: {session_id}")
+        elif result.upserted_id is not None: logging.info(f"Created new session via upsert: {session_id}")
+        else: logging.error(f"Chat history upsert failed unexpectedly: {session_id}")
+    except mongo_errors.PyMongoError as mongo_e:
+        logging.error(f"MongoDB error during chat history upsert: {mongo_e}")
+    except Exception as hist_e: # The answer is already generated; a history failure must not turn it into a 500
+        logging.exception(f"Unexpected error during chat history handling: {hist_e}")
+    return session_id
+
+
+# Query Endpoint
+@app.post("/api/query")
+async def query_endpoint(request: Request):
+    user_query, session_id, metadata_filter, error_response = await parse_query_request(request)
+    if error_response: return error_response
+    timer = RequestTimer("query")
+    try:
+        prepared = await prepare_query(user_query, session_id, metadata_filter, timer)
+        answer = prepared["answer"]
+        if answer is None:
+            logging.info("Requesting LLM response...")
+            with timer.stage("llm"): answer = await aget_llm_response(prepared["prompt"])
+            logging.info(f"Received LLM response.")
+            record_answer(prepared, answer)
+        with timer.stage("history"): session_id_to_return = await save_chat_history(session_id, user_query, answer)
+        timer.finish("ok")
+        return JSONResponse({"answer": answer, "chat_id": session_id_to_return}, headers={"Server-Timing": timer.server_timing()})
+    except Exception as e:
+        timer.finish("error")
+        logging.exception(f"Critical error processing query '{user_query}': {e}")
+        return error("An internal error occurred.", 500)
+
+# Streaming Query Endpoint (server-sent events, same events as app.py)
+@app.post("/api/query/stream")
+async def query_stream_endpoint(request: Request):
+    user_query, session_id, metadata_filter, error_response = await parse_query_request(request)
+    if error_response: return error_response
+
+    async def generate():
+        timer = RequestTimer("query_stream")
+        try:
+            prepared = await prepare_query(user_query, session_id, metadata_filter, timer)
+            if prepared["answer"] is not None:
+                answer = prepared["answer"]
+                yield sse_event("token", {"text": answer})
+            else:
+                logging.info("Streaming LLM response...")
+                answer_parts = []; llm_failed = False
+                llm_started = time.perf_counter(); llm_seconds = 0.0 # Excludes time spent writing tokens to the client
+                async for delta in astream_llm_response(prepared["prompt"]):
+                    llm_seconds += time.perf_counter() - llm_started
+                    if not answer_parts: timer.record("llm_first_token", llm_seconds)
+                    if delta == LLM_EMPTY_RESPONSE: llm_failed = True
+                    answer_parts.append(delta)
+                    yield sse_event("token", {"text": delta})
+                    llm_started = time.perf_counter()
+                timer.record("llm", llm_seconds + time.perf_counter() - llm_started)
+                answer = "".join(answer_parts).strip()
+                logging.info(f"LLM stream completed ({len(answer)} chars).")
+                record_answer(prepared, answer, llm_failed=llm_failed)
+            with timer.stage("history"): session_id_to_return = await save_chat_history(session_id, user_query, answer)
+            timer.finish("ok")
+            yield sse_event("done", {"chat_id": session_id_to_return, "timings": timer.breakdown()})
+        except LLMStreamError:
+            # The client already has part of an answer; it is neither saved to history nor cached
+            timer.finish("error")
+            yield sse_event("error", {"error": LLM_ERROR_RESPONSE})
+        except Exception as e:
+            timer.finish("error")
+            logging.exception(f"Critical error streaming query '{user_query}': {e}")
+            yield sse_event("error", {"error": "An internal error occurred."})
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Prometheus scrape endpoint (same series as app.py)
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(await asyncio.to_thread(render_metrics), media_type=METRICS_CONTENT_TYPE)
+
+
+# GET /api/chats
+@app.get("/api/chats")
+async def get_chat_list():
+    chat_collection = state["chat_collection"]
+    if chat_collection is None: return error("Database unavailable.", 503)
+    try:
+        cursor = chat_collection.find({}, {"_id": 0, "session_id": 1, "title": 1, "last_updated": 1}).sort("last_updated", -1).limit(100)
+        chat_summaries = await cursor.to_list(length=100)
+        for chat in chat_summaries:
+            if isinstance(chat.get('last_updated'), datetime): chat['last_updated'] = chat['last_updated'].isoformat()
+        return JSONResponse(chat_summaries)
+    except Exception as e: logging.exception(f"Error fetching chat list: {e}"); return error("Server error.", 500)
+
+# GET /api/chat/<session_id>
+@app.get("/api/chat/{session_id}")
+async def get_chat_messages(session_id: str):
+    chat_collection = state["chat_collection"]
+    if chat_collection is None: return error("Database unavailable.", 503)
+    try:
+        chat_data = await chat_collection.find_one({"session_id": session_id}, {"_id": 0})
+        if chat_data: return JSONResponse(serialize_chat(chat_data))
+        else: return error("Chat session not found.", 404)
+    except Exception as e: logging.exception(f"Error fetching chat {session_id}: {e}"); return error("Server error.", 500)
+
+# POST /api/chats
+@app.post("/api/chats")
+async def save_update_chat(request: Request):
+    chat_collection = state["chat_collection"]
+    if chat_collection is None: return error("Database unavailable.", 503)
+    if "application/json" not in request.headers.get("content-type", ""): return error("Request must be JSON", 415)
+    data = await read_json_object(request)
+    if data is None: return error("Invalid JSON body", 400)
+    messages = data.get("messages"); chat_id = data.get("chat_id"); title = data.get("title")
+    if not messages or not isinstance(messages, list): return error("Invalid 'messages'.", 400)
+    for msg in messages:
+         if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg: return error("Invalid message structure.", 400)
+    now_utc = datetime.now(timezone.utc); session_id_to_return = chat_id
+    try:
+        if chat_id:
+            update_data = {"messages": messages, "last_updated": now_utc}
+            if title: update_data["title"] = title
+            result = await chat_collection.find_one_and_update({"session_id": chat_id}, {"$set": update_data}, projection={"session_id": 1})
+            if result is None: chat_id = None; logging.warning(f"Chat ID '{data.get('chat_id')}' not found for explicit save.")
+            else: logging.info(f"Chat '{chat_id}' updated via explicit save."); session_id_to_return = chat_id
+        if not chat_id:
+            session_id_to_return = str(uuid.uuid4())
+            if not title: title = messages[0].get("content", "New Chat")[:75] + "..." if messages else "New Chat"
+            chat_document = {"session_id": session_id_to_return, "title": title, "messages": messages, "created_at": now_utc, "last_updated": now_utc}
+            await chat_collection.insert_one(chat_document)
+            logging.info(f"New chat '{session_id_to_return}' created via explicit save.")
+        return JSONResponse({"message": "Chat saved successfully.", "chat_id": session_id_to_return})
+    except Exception as e: logging.exception(f"Error during explicit chat save/update: {e}"); return error("Error saving chat.", 500)
+
+
+# --- Main Execution Guard ---
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5001)
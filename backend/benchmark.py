@@ -0,0 +1,367 @@
+# backend/benchmark.py
+"""
+Offline end-to-end benchmark for the indexing, upload and query paths.
+
+Nothing here calls Pinecone or Groq:
+    vector store   the embedded local index (local_vector_store.py) plus the BM25 index, built by index.py's
+                   run_pipeline from a synthetic corpus of RBI / Income Tax style notifications
+    LLM            a stand-in Groq client with a configurable time to first token and token rate
+    chat history   mongomock (pip install mongomock), or a real MongoDB via --mongodb-uri; history writes
+                   are skipped if neither is available
+The embedding model is the real EMBEDDING_MODEL, so its cost is part of every number.
+
+Each corpus size runs in its own process (config.py reads the environment at import, and caches must not
+carry over): index the corpus (a full build, then an unchanged re-run), then drive upload_document and
+query_endpoint through the Flask test client at every concurrency level (an upload's latency lasts until
+its background job is ready). Reports throughput and p50/p95/p99 latency, plus per-stage p95s from the
+Server-Timing header (metrics.py).
+
+    python benchmark.py --corpus-sizes 100,1000 --concurrency 1,4,16 --requests 100 --output bench.json
+    python benchmark.py ... --baseline bench.json   # exit status 1 if p95 latency regressed beyond --max-regression
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# --- Synthetic Corpus ---
+TOPICS = (
+    ("Section 80C", "deduction of up to Rs 1,50,000 for contributions to PPF, ELSS and life insurance premiums"),
+    ("Section 80D", "deduction for health insurance premiums paid for self, spouse, children and parents"),
+    ("TDS on salary", "the rates at which employers deduct tax at source and the due dates for depositing it"),
+    ("the new tax regime", "concessional slab rates without most exemptions, with a standard deduction of Rs 75,000"),
+    ("repo rate", "the policy repo rate under the liquidity adjustment facility and its transmission to lending rates"),
+    ("KYC norms", "customer due diligence, periodic updation of KYC and video-based identification"),
+    ("priority sector lending", "targets for lending to agriculture, micro enterprises and weaker sections"),
+    ("capital gains", "holding periods and tax rates for listed equity shares and equity-oriented mutual funds"),
+    ("advance tax", "instalment due dates and interest under sections 234B and 234C for shortfalls"),
+    ("digital lending", "disclosure of annual percentage rate, key fact statements and cooling-off periods"),
+)
+FILLER = ("All regulated entities shall ensure compliance with these directions with immediate effect. "
+          "The provisions shall apply to all accounts opened on or after the date of this notification. "
+          "Entities are advised to bring the contents of this circular to the notice of their constituents. ")
+QUESTIONS = (
+    "What does {topic} cover?", "Explain the latest rules on {topic}.", "How does notification {number} change {topic}?",
+    "Is there any recent circular about {topic}?", "What are the limits under {topic} for FY 2024-25?",
+)
+ANSWER_WORDS = "Based on the notification the applicable limit is revised and entities must comply from the effective date".split()
+
+DEFAULT_CORPUS_SIZES = "100,1000"
+DEFAULT_CONCURRENCY = "1,4,16"
+UPLOAD_POLL_SECONDS = 0.02
+
+
+def synthetic_record(rng, i):
+    """One data.jsonl record ({filename: {...}}) in the shape combine_json_file.py writes."""
+    topic, detail = TOPICS[i % len(TOPICS)]
+    source = "rbi" if i % 2 else "incometax"
+    number = f"RBI/2024-25/{i}" if source == "rbi" else f"{i % 150 + 1}/{2020 + i % 5}"
+    paragraphs = [f"Notification {number}. Subject: {topic}.", f"This notification sets out {detail}."]
+    for paragraph in range(rng.randint(3, 8)):
+        other_topic, other_detail = TOPICS[rng.randrange(len(TOPICS))]
+        paragraphs.append(f"{paragraph + 1}. In respect of {other_topic}, {other_detail}. " + FILLER * rng.randint(1, 4))
+    url = f"https://www.rbi.org.in/notification/{i}.pdf" if source == "rbi" else f"https://incometaxindia.gov.in/notification/{i}.pdf"
+    return {f"{source}_notification_{i}.pdf": {"url": url, "publish_date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+                                                "notification_number": number, "content": "\n\n".join(paragraphs)}}
+
+
+def synthetic_queries(rng, corpus_size, count):
+    queries = []
+    for _ in range(count):
+        i = rng.randrange(corpus_size)
+        number = f"RBI/2024-25/{i}" if i % 2 else f"{i % 150 + 1}/{2020 + i % 5}"
+        queries.append(rng.choice(QUESTIONS).format(topic=TOPICS[rng.randrange(len(TOPICS))][0], number=number))
+    return queries
+
+
+# --- Stand-in LLM ---
+class FakeGroqClient:
+    """Quacks like groq.Groq for prompt_llm.py: sleeps for the time to first token, then emits tokens at a fixed rate."""
+
+    def __init__(self, first_token_ms, tokens_per_second, answer_tokens):
+        self.first_token_seconds = first_token_ms / 1000
+        self.token_seconds = 1 / tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, model=None, messages=None, stream=False, **_kwargs):
+        tokens = [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(self.answer_tokens)]
+        if stream: return self._stream(tokens)
+        time.sleep(self.first_token_seconds + self.token_seconds * len(tokens))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content="".join(tokens)))])
+
+    def _stream(self, tokens):
+        time.sleep(self.first_token_seconds)
+        for token in tokens:
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=token))])
+            time.sleep(self.token_seconds)
+
+
+# --- Measurement ---
+def summarize(latencies, wall_seconds, errors, stage_timings=()):
+    """Throughput and latency percentiles (ms) for one phase; stage_timings are per-request {stage: ms} dicts."""
+    result = {"requests": len(latencies) + errors, "errors": errors, "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        result.update(p50_ms=round(float(p50), 1), p95_ms=round(float(p95), 1), p99_ms=round(float(p99), 1))
+    stages = {}
+    for timings in stage_timings:
+        for stage, ms in timings.items():
+            if stage != "total": stages.setdefault(stage, []).append(ms)
+    if stages: result["stage_p95_ms"] = {stage: round(float(np.percentile(values, 95)), 1) for stage, values in stages.items()}
+    return result
+
+
+def parse_server_timing(header):
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration: timings[name] = float(duration)
+    return timings
+
+
+def run_load(send, payloads, concurrency):
+    """Sends every payload with `concurrency` client threads. send(client, payload) returns (ok, server timings)."""
+    import app as backend_app
+    latencies, stage_timings, errors = [], [], 0
+    lock = threading.Lock()
+    clients = threading.local()
+
+    def one(payload):
+        nonlocal errors
+        client = getattr(clients, "client", None) or backend_app.app.test_client()
+        clients.client = client
+        started = time.perf_counter()
+        try:
+            ok, timings = send(client, payload)
+        except Exception as e:
+            logging.error(f"[benchmark.py] Request failed: {e}")
+            ok, timings = False, {}
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok: latencies.append(elapsed); stage_timings.append(timings)
+            else: errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-client") as pool:
+        list(pool.map(one, payloads))
+    return summarize(latencies, time.perf_counter() - started, errors, stage_timings)
+
+
+def send_query(client, payload):
+    response = client.post("/api/query", json=payload)
+    return response.status_code == 200, parse_server_timing(response.headers.get("Server-Timing"))
+
+
+def send_stream_query(client, payload):
+    response = client.post("/api/query/stream", json=payload)
+    body = response.get_data(as_text=True)
+    done = [line for line in body.splitlines() if line.startswith("data:") and '"timings"' in line]
+    return response.status_code == 200 and bool(done), json.loads(done[-1][len("data:"):])["timings"] if done else {}
+
+
+def send_upload(client, payload):
+    """Uploads a file and polls its job until it is processed; a 429 (upload queue full) counts as an error."""
+    session_id, text = payload
+    response = client.post("/api/upload", data={"session_id": session_id, "file": (io.BytesIO(text.encode("utf-8")), "benchmark_upload.txt")},
+                           content_type="multipart/form-data")
+    if response.status_code != 202: return False, {}
+    job_id = response.get_json()["job_id"]
+    while True:
+        job = client.get(f"/api/upload/{job_id}").get_json()
+        if job["status"] in ("ready", "failed"): return job["status"] == "ready", {}
+        time.sleep(UPLOAD_POLL_SECONDS)
+
+
+# --- One Corpus Size (child process) ---
+def benchmark_index(workdir, corpus_size, seed):
+    """Builds the local vector + lexical indexes for a synthetic corpus with index.py, timing a full and an unchanged run."""
+    from index import run_pipeline, iter_source_records, ChunkEmbedder
+    from index_manifest import IndexManifest
+    from lexical_index import LexicalIndex
+    from local_vector_store import LocalVectorIndex
+
+    rng = random.Random(seed)
+    data_path = os.path.join(workdir, "data.jsonl")
+    with open(data_path, "w", encoding="utf-8") as f:
+        for i in range(corpus_size): f.write(json.dumps(synthetic_record(rng, i), ensure_ascii=False) + "\n")
+
+    embedder = ChunkEmbedder()
+    results = {}
+    try:
+        for phase in ("index_full", "index_unchanged"):
+            index = LocalVectorIndex(os.environ["LOCAL_VECTOR_STORE_DIR"])
+            manifest = IndexManifest.load(os.path.join(workdir, "index_manifest.sqlite3"))
+            lexical = LexicalIndex(os.environ["LEXICAL_INDEX_PATH"])
+            started = time.perf_counter()
+            try:
+                stats = run_pipeline(index, iter_source_records(data_path), manifest, embedder, lexical=lexical)
+            finally:
+                lexical.close()
+            elapsed = time.perf_counter() - started
+            results[phase] = {"seconds": round(elapsed, 2), "docs": stats["docs_loaded"], "chunks_embedded": stats["chunks_embedded"],
+                              "chunks_per_second": round(stats["chunks_embedded"] / elapsed, 1) if elapsed else 0.0}
+            print(f"  {phase}: {results[phase]}", flush=True)
+    finally:
+        embedder.close()
+    return results
+
+
+def load_app(mongodb_uri):
+    """Imports app.py against the local indexes, with the stand-in LLM and an in-memory (or local) MongoDB."""
+    mongo_stand_in = None
+    if not mongodb_uri:
+        try:
+            import mongomock
+            import pymongo
+            mongo_stand_in = mongomock.MongoClient()
+            real_client, pymongo.MongoClient = pymongo.MongoClient, lambda *args, **kwargs: mongo_stand_in # Skips app.py's 5 s connect timeout
+        except ImportError:
+            logging.warning("[benchmark.py] mongomock is not installed and no --mongodb-uri given; chat history writes are skipped.")
+    try:
+        import app as backend_app
+    finally:
+        if mongo_stand_in is not None: pymongo.MongoClient = real_client
+    if mongo_stand_in is not None:
+        backend_app.db = mongo_stand_in[os.environ["MONGODB_DB"]]
+        backend_app.chat_collection = backend_app.db[os.environ["MONGODB_COLLECTION"]]
+    if backend_app.retriever is None or backend_app.embedding_model is None: raise RuntimeError("app.py failed to initialise; see the log above.")
+    return backend_app
+
+
+def run_corpus(args):
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=level)
+    results = {"corpus_size": args.corpus_size, "index": benchmark_index(args.workdir, args.corpus_size, args.seed), "upload": {}, "query": {}}
+
+    import prompt_llm
+    prompt_llm.client = FakeGroqClient(args.llm_first_token_ms, args.llm_tokens_per_second, args.llm_answer_tokens)
+    backend_app = load_app(args.mongodb_uri)
+    logging.getLogger().setLevel(level) # app.py configures INFO logging on import
+
+    rng = random.Random(args.seed)
+    upload_text = "\n\n".join(next(iter(synthetic_record(rng, i).values()))["content"] for i in range(args.upload_docs))
+    send = send_stream_query if args.stream else send_query
+    run_load(send, [{"query": q, "chat_id": f"bench-warmup-{i}"} for i, q in enumerate(synthetic_queries(rng, args.corpus_size, 4))], 1) # Warm-up
+    for concurrency in args.concurrency:
+        uploads = [(f"bench-upload-{concurrency}-{i}", upload_text) for i in range(max(concurrency, args.requests // 10))]
+        results["upload"][concurrency] = run_load(send_upload, uploads, concurrency)
+        queries = [{"query": q, "chat_id": f"bench-{concurrency}-{i}"} for i, q in enumerate(synthetic_queries(rng, args.corpus_size, args.requests))]
+        results["query"][concurrency] = run_load(send, queries, concurrency)
+        print(f"  concurrency {concurrency}: upload {results['upload'][concurrency]}, query {results['query'][concurrency]}", flush=True)
+
+    if args.mongodb_uri and backend_app.chat_collection is not None:
+        backend_app.chat_collection.delete_many({"session_id": {"$regex": "^bench-"}})
+    with open(args.result_file, "w", encoding="utf-8") as f: json.dump(results, f)
+
+
+# --- Orchestration (parent process) ---
+def corpus_environment(args, workdir):
+    env = dict(os.environ)
+    env.update({
+        "VECTOR_STORE_BACKEND": "local", "HYBRID_RETRIEVAL": "true",
+        "LOCAL_VECTOR_STORE_DIR": os.path.join(workdir, "local_vector_store"),
+        "LEXICAL_INDEX_PATH": os.path.join(workdir, "lexical_index.sqlite3"),
+        "INDEX_VERSION_FILE": os.path.join(workdir, "index_version.txt"),
+        "SESSION_STORE_BACKEND": "memory", "METRICS_DIR": "",
+        # Every benchmark query should take the full retrieval + LLM path unless the cache is what is being measured
+        "QUERY_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "GROQ_API_KEY": env.get("GROQ_API_KEY") or "benchmark", "GROQ_MODEL": env.get("GROQ_MODEL") or "llama-3.1-8b-instant",
+        "MONGODB_URI": args.mongodb_uri or "mongodb://localhost:27017", "MONGODB_DB": env.get("MONGODB_DB") or "ragfin_benchmark",
+        "MONGODB_COLLECTION": "benchmark_chats",
+    })
+    return env
+
+
+def print_report(all_results):
+    print(f"\n{'corpus':>7} {'phase':<16} {'conc':>5} {'reqs':>5} {'errs':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  slowest stages (p95 ms)")
+    for results in all_results:
+        corpus = results["corpus_size"]
+        for phase, index_result in results["index"].items():
+            print(f"{corpus:>7} {phase:<16} {'':>5} {index_result['docs']:>5} {'':>5} {'':>8} {'':>9} {'':>9} {'':>9}  "
+                  f"{index_result['chunks_embedded']} chunks in {index_result['seconds']} s ({index_result['chunks_per_second']} chunks/s)")
+        for phase in ("upload", "query"):
+            for concurrency, row in results[phase].items():
+                stages = sorted(row.get("stage_p95_ms", {}).items(), key=lambda item: item[1], reverse=True)[:4]
+                print(f"{corpus:>7} {phase:<16} {concurrency:>5} {row['requests']:>5} {row['errors']:>5} {row['throughput_rps']:>8} "
+                      f"{row.get('p50_ms', '-'):>9} {row.get('p95_ms', '-'):>9} {row.get('p99_ms', '-'):>9}  "
+                      + ", ".join(f"{stage} {ms}" for stage, ms in stages))
+
+
+def find_regressions(all_results, baseline_results, max_regression):
+    """Phases whose p95 latency grew by more than max_regression (a fraction) against the baseline run."""
+    baseline = {(r["corpus_size"], phase, str(c)): row for r in baseline_results for phase in ("upload", "query") for c, row in r[phase].items()}
+    regressions = []
+    for results in all_results:
+        for phase in ("upload", "query"):
+            for concurrency, row in results[phase].items():
+                before = baseline.get((results["corpus_size"], phase, str(concurrency)))
+                if not before or "p95_ms" not in before or "p95_ms" not in row: continue
+                if row["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                    regressions.append(f"corpus {results['corpus_size']} {phase} x{concurrency}: p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the RagFin indexing, upload and query paths.")
+    parser.add_argument("--corpus-sizes", default=DEFAULT_CORPUS_SIZES, help="Comma-separated numbers of source documents")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="Comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Queries per concurrency level")
+    parser.add_argument("--upload-docs", type=int, default=5, help="Synthetic notifications concatenated into the uploaded file")
+    parser.add_argument("--stream", action="store_true", help="Benchmark /api/query/stream instead of /api/query")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache on")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--llm-answer-tokens", type=int, default=150)
+    parser.add_argument("--mongodb-uri", help="Local MongoDB for chat history (default: mongomock)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the results as JSON (usable as a later --baseline)")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 growth over the baseline (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's INFO logging")
+    # Internal: one corpus size, run in a fresh process
+    parser.add_argument("--corpus-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in str(args.concurrency).split(",") if c.strip()]
+
+    if args.corpus_size is not None:
+        run_corpus(args)
+        return
+
+    all_results = []
+    for corpus_size in [int(size) for size in args.corpus_sizes.split(",") if size.strip()]:
+        with tempfile.TemporaryDirectory(prefix=f"ragfin_bench_{corpus_size}_") as workdir:
+            result_file = os.path.join(workdir, "result.json")
+            print(f"Benchmarking corpus of {corpus_size} documents in {workdir}...", flush=True)
+            subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--corpus-size", str(corpus_size), "--workdir", workdir, "--result-file", result_file],
+                           env=corpus_environment(args, workdir), cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+            with open(result_file, "r", encoding="utf-8") as f: all_results.append(json.load(f))
+
+    print_report(all_results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(all_results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f: regressions = find_regressions(all_results, json.load(f), args.max_regression)
+        for regression in regressions: print(f"REGRESSION {regression}")
+        if regressions: sys.exit(1)
+        print(f"\nNo p95 regression beyond {args.max_regression:.0%} against {args.baseline}.")
+
+
+# run_pipeline may start an embedding process pool, whose workers re-import this module
+if __name__ == "__main__":
+    main()
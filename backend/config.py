@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -8,6 +9,7 @@ load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT")
 INDEX_NAME = os.getenv("INDEX_NAME")
+PINECONE_INDEX_HOST = os.getenv("PINECONE_INDEX_HOST") # Optional; looked up from INDEX_NAME when unset
 
 # OpenAI configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -24,4 +26,68 @@ MONGODB_DB = os.getenv("MONGODB_DB")
 MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION")
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_MODEL = os.getenv("GROQ_MODEL")
\ No newline at end of file
+GROQ_MODEL = os.getenv("GROQ_MODEL")
+
+# Session document store (uploaded-document chunks + cached embeddings)
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+SESSION_STORE_TTL_SECONDS = int(os.getenv("SESSION_STORE_TTL_SECONDS", str(2 * 60 * 60)))
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "1000"))
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory") # memory | disk | gridfs
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", os.path.join(tempfile.gettempdir(), "ragfin_sessions"))
+
+# Semantic answer cache (knowledge-base questions without an uploaded document)
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.95")) # Cosine similarity needed for a hit
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2000"))
+# Written by index.py after upserts; answer caches clear themselves when it changes
+INDEX_VERSION_FILE = os.getenv("INDEX_VERSION_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_version.txt"))
+
+# Async (ASGI) serving mode: CPU-bound work (embedding, file parsing) runs on a bounded executor
+ASYNC_CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", "2"))
+ASYNC_CPU_QUEUE = int(os.getenv("ASYNC_CPU_QUEUE", "64")) # Max CPU jobs waiting; beyond this requests wait for a slot
+
+# Indexer (index.py): chunks are embedded in large batches, optionally across a process pool
+INDEX_EMBED_BATCH_SIZE = int(os.getenv("INDEX_EMBED_BATCH_SIZE", "256")) # Chunks per encode() call
+INDEX_EMBED_PROCESSES = int(os.getenv("INDEX_EMBED_PROCESSES", "0")) # 0 = encode in-process (torch still uses all cores)
+INDEX_UPSERT_CONCURRENCY = int(os.getenv("INDEX_UPSERT_CONCURRENCY", "4")) # Pinecone upsert requests in flight
+# Delete vectors of documents missing from data.jsonl. Off by default: scrapers may only emit recent notifications
+INDEX_PRUNE_MISSING_DOCS = os.getenv("INDEX_PRUNE_MISSING_DOCS", "false").lower() == "true"
+
+# Vector store: "pinecone" (hosted) or "local" (embedded file-backed index, see local_vector_store.py)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_vector_store"))
+
+# Hybrid retrieval: BM25 lexical index (built by index.py, see lexical_index.py) fused with dense search
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lexical_index.sqlite3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20")) # Results taken from each search before fusing down to k
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60")) # Reciprocal rank fusion constant: score = sum(1 / (HYBRID_RRF_K + rank))
+
+# Prompt context packing (see context_packer.py)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048")) # Tokens of retrieved context per prompt
+CONTEXT_DOC_SHARE = float(os.getenv("CONTEXT_DOC_SHARE", "0.4")) # Budget share reserved for the user's uploaded document
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER") # Hugging Face tokenizer repo; derived from GROQ_MODEL when unset
+
+# Optional cross-encoder rerank stage (see reranker.py)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20")) # Chunks fetched from the retriever and scored
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150")) # Target time for one rerank pass
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256")) # Query + chunk tokens seen by the cross-encoder
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096")) # Cached (query, chunk) scores
+
+# Query latency metrics (see metrics.py); /metrics sums the series every worker process writes to METRICS_DIR
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "ragfin_metrics")) # "" = per-process metrics only
+
+# Background upload processing (see upload_jobs.py)
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "1")) # Threads extracting/embedding uploads, per process
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "8")) # Uploads allowed to wait for a worker; beyond this /api/upload returns 429
+UPLOAD_EMBED_BATCH_SIZE = int(os.getenv("UPLOAD_EMBED_BATCH_SIZE", "32")) # Chunks per encode() call for uploads
+UPLOAD_JOB_DIR = os.getenv("UPLOAD_JOB_DIR", os.path.join(tempfile.gettempdir(), "ragfin_upload_jobs")) # Job status, shared by the workers of one host
+UPLOAD_JOB_TTL_SECONDS = int(os.getenv("UPLOAD_JOB_TTL_SECONDS", "3600")) # How long finished job statuses can be polled
+
+# PDF text extraction for uploads (see pdf_extract.py): with more than 1, large PDFs are extracted in page ranges
+# across this many spawned processes per web worker. In-process by default; uploads already run off the request path
+PDF_EXTRACT_PROCESSES = int(os.getenv("PDF_EXTRACT_PROCESSES", "1"))
@@ -0,0 +1,139 @@
+# backend/context_packer.py
+"""
+Packs retrieved chunks into the prompt's context within a token budget.
+
+Chunks arrive best-first (retriever / document-similarity order). Exact and near-exact duplicates are
+dropped, and the CHUNK_OVERLAP text that neighbouring chunks of one document share is merged away, so
+the same sentences are never paid for twice. Chunks are then added in rank order while they fit; a chunk
+that does not fit is cut at a sentence boundary (or skipped), never mid-sentence.
+
+Tokens are counted with the Hugging Face tokenizer of the GROQ_MODEL family (CONTEXT_TOKENIZER overrides
+it). If that tokenizer cannot be loaded, a conservative characters-per-token estimate is used instead.
+"""
+
+import logging
+import re
+import threading
+
+from config import GROQ_MODEL, CONTEXT_TOKEN_BUDGET, CONTEXT_DOC_SHARE, CONTEXT_TOKENIZER
+
+# Ungated Hugging Face repos whose tokenizer matches the Groq model family (first match wins)
+MODEL_TOKENIZERS = (
+    ("llama-3", "NousResearch/Meta-Llama-3-8B"),
+    ("llama3", "NousResearch/Meta-Llama-3-8B"),
+    ("mixtral", "mistralai/Mixtral-8x7B-Instruct-v0.1"),
+)
+CHARS_PER_TOKEN_ESTIMATE = 3.0 # Deliberately low (real English text is ~4) so the estimate stays within budget
+MIN_OVERLAP_CHARS = 20 # Shorter shared text between two chunks is treated as coincidence, not splitter overlap
+MIN_PARTIAL_TOKENS = 48 # Do not bother cutting a chunk down to fewer tokens than this
+SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+# --- Token Counting ---
+def get_tokenizer():
+    """Loads the tokenizer once per process; returns None (character estimate) if it is unavailable."""
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded: return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer_loaded: return _tokenizer
+        model_name = (GROQ_MODEL or "").lower()
+        repo = CONTEXT_TOKENIZER or next((repo for prefix, repo in MODEL_TOKENIZERS if prefix in model_name), None)
+        if repo:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(repo)
+                logging.info(f"[context_packer.py] Counting context tokens with the {repo} tokenizer.")
+            except Exception as e:
+                logging.warning(f"[context_packer.py] Could not load tokenizer {repo}: {e}. Estimating tokens from length.")
+        else:
+            logging.warning(f"[context_packer.py] No tokenizer known for GROQ_MODEL={GROQ_MODEL!r}; set CONTEXT_TOKENIZER. Estimating tokens from length.")
+        _tokenizer_loaded = True
+    return _tokenizer
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None: return int(len(text) / CHARS_PER_TOKEN_ESTIMATE) + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+# --- Deduplication ---
+def _normalize(text):
+    return " ".join(text.split()).lower()
+
+def _overlap(first, second):
+    """Length of the longest suffix of `first` that is a prefix of `second` (0 if shorter than MIN_OVERLAP_CHARS)."""
+    head = second[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS: return 0
+    start = first.find(head, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]): return len(first) - start
+        start = first.find(head, start + 1)
+    return 0
+
+
+def _find_merge(blocks, text):
+    """
+    Finds where text goes among the packed blocks. Returns (block index or None, new text, prepend), where
+    new text is the part not already packed (empty for duplicates) and prepend says it leads into the block.
+    """
+    normalized = _normalize(text)
+    for i, block in enumerate(blocks):
+        if normalized in _normalize(block): return i, "", False
+        if (overlap := _overlap(block, text)): return i, text[overlap:], False # text continues this block
+        if (overlap := _overlap(text, block)): return i, text[:len(text) - overlap], True # text leads into this block
+    return None, text, False
+
+
+# --- Packing ---
+def _fit_sentences(text, budget):
+    """The longest run of leading sentences of text that fits in budget tokens ('' if none)."""
+    sentences = SENTENCE_END.split(text)
+    fitted = ""
+    for sentence in sentences:
+        candidate = f"{fitted} {sentence}".strip() if fitted else sentence
+        if count_tokens(candidate) > budget: break
+        fitted = candidate
+    return fitted
+
+
+def pack_chunks(texts, budget):
+    """
+    Packs best-first chunk texts into at most `budget` tokens. Returns (blocks, tokens used); merged
+    neighbours come back as a single block, in the position of the better-ranked one.
+    """
+    blocks, used = [], 0
+    for text in texts:
+        text = text.strip()
+        if not text: continue
+        index, new_text, prepend = _find_merge(blocks, text)
+        if not new_text: continue
+        new_tokens = count_tokens(new_text)
+        if used + new_tokens > budget:
+            # Only a chunk's leading sentences can be kept, which does not work for text leading into a block
+            if budget - used < MIN_PARTIAL_TOKENS or prepend: continue
+            new_text = _fit_sentences(new_text, budget - used)
+            if not new_text: continue
+            new_tokens = count_tokens(new_text)
+        if index is None: blocks.append(new_text)
+        elif prepend: blocks[index] = new_text + blocks[index]
+        else: blocks[index] = blocks[index] + new_text
+        used += new_tokens
+    return blocks, used
+
+
+def pack_context(rag_context_parts, doc_context_parts, budget=CONTEXT_TOKEN_BUDGET, doc_share=CONTEXT_DOC_SHARE):
+    """
+    Packs knowledge-base and uploaded-document chunks into one token budget. The document gets up to
+    doc_share of the budget up front (so it is never crowded out); whatever either side leaves unused
+    goes to the other. Returns (rag blocks, doc blocks).
+    """
+    doc_reserve = min(int(budget * doc_share), sum(count_tokens(text) for text in doc_context_parts)) if doc_context_parts else 0
+    rag_blocks, rag_tokens = pack_chunks(rag_context_parts, budget - doc_reserve)
+    doc_blocks, doc_tokens = pack_chunks(doc_context_parts, budget - rag_tokens)
+    logging.info(f"[context_packer.py] Packed {len(rag_context_parts)} knowledge-base and {len(doc_context_parts)} document chunks "
+                 f"into {len(rag_blocks)} + {len(doc_blocks)} blocks, {rag_tokens + doc_tokens}/{budget} tokens.")
+    return rag_blocks, doc_blocks
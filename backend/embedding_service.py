@@ -0,0 +1,52 @@
+# backend/embedding_service.py
+"""
+Process-wide embedding service.
+
+Owns the single SentenceTransformer instance per process and serves it both to
+the upload/query code in app.py and (through a LangChain Embeddings adapter) to
+the Pinecone retriever, so the model weights are only loaded once per worker.
+"""
+
+import logging
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
+
+from config import EMBEDDING_MODEL
+
+ENCODE_BATCH_SIZE = 64
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_embedding_model() -> SentenceTransformer:
+    """Returns the shared SentenceTransformer, loading it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None: # Another thread may have loaded it while we waited
+                logging.info(f"[embedding_service] Loading embedding model: {EMBEDDING_MODEL}...")
+                _model = SentenceTransformer(EMBEDDING_MODEL)
+                logging.info("[embedding_service] Embedding model loaded.")
+    return _model
+
+
+def embed_texts(texts, normalize=True) -> np.ndarray:
+    """Encodes texts into a float32 matrix of shape (len(texts), dim), L2-normalised by default."""
+    embeddings = get_embedding_model().encode(
+        list(texts), batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=normalize
+    )
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+class SharedSentenceTransformerEmbeddings(Embeddings):
+    """LangChain Embeddings backed by the shared model (drop-in for HuggingFaceEmbeddings)."""
+
+    def embed_documents(self, texts):
+        return embed_texts(texts, normalize=False).tolist()
+
+    def embed_query(self, text):
+        return embed_texts([text], normalize=False)[0].tolist()
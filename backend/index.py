@@ -1,12 +1,21 @@
 import json
 import os
-from sentence_transformers import SentenceTransformer
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pinecone import Pinecone
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from config import PINECONE_API_KEY, INDEX_NAME, EMBEDDING_MODEL
+from config import (PINECONE_API_KEY, INDEX_NAME, EMBEDDING_MODEL, INDEX_EMBED_BATCH_SIZE, INDEX_EMBED_PROCESSES,
+                    INDEX_UPSERT_CONCURRENCY, INDEX_PRUNE_MISSING_DOCS, VECTOR_STORE_BACKEND, HYBRID_RETRIEVAL, LEXICAL_INDEX_PATH)
+from embedding_service import get_embedding_model, ENCODE_BATCH_SIZE
+from query_cache import bump_index_version
+from index_manifest import IndexManifest, content_hash
+from lexical_index import LexicalIndex
+from metadata_filters import filter_metadata
+from pdf_extract import page_for_offset
 import logging
 import time
-import hashlib
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,213 +24,421 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 150
 METADATA_SIZE_LIMIT_BYTES = 35 * 1024
+UPSERT_MAX_REQUEST_BYTES = int(2 * 1024 * 1024 * 0.9) # Pinecone caps upsert requests at 2 MB; keep headroom
+UPSERT_MAX_VECTORS = 1000 # Pinecone's per-request vector limit
+UPSERT_BYTES_PER_FLOAT = 20
+DELETE_BATCH_SIZE = 1000 # Pinecone's per-request delete limit
+PINECONE_MAX_ATTEMPTS = 6
+PINECONE_BACKOFF_BASE_SECONDS = 1.0
+PINECONE_BACKOFF_MAX_SECONDS = 30.0
+DATA_FILE_PATH = "../WebScraping/data.jsonl"
+LEGACY_DATA_FILE_PATH = "../WebScraping/data.json"
+MANIFEST_FILE = "index_manifest.sqlite3"
+LEGACY_MANIFEST_FILES = ("index_manifest.json", "processed_chunk_ids.json") # Imported into the manifest on first run
+
+# -------------------- Initialize Text Splitter --------------------
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    add_start_index=True,
+)
+
 
 # -------------------- Initialize Pinecone --------------------
-pc = None # Initialize pc to None
-index = None # Initialize index to None
-try:
-    logging.info(f"Initializing Pinecone client with API key ending in '...{PINECONE_API_KEY[-4:] if PINECONE_API_KEY else 'N/A'}'")
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-
-    # --- Robust Index Existence Check ---
-        
+def connect_index(backend=VECTOR_STORE_BACKEND):
+    """Connects to the Pinecone index (or opens the local one), exiting if it cannot be confirmed to exist."""
+    if backend == "local":
+        from local_vector_store import LocalVectorIndex
+        index = LocalVectorIndex()
+        logging.info(f"Opened local vector index at '{index.root_dir}'. Initial index stats: {index.describe_index_stats()}")
+        return index
+    try:
+        logging.info(f"Initializing Pinecone client with API key ending in '...{PINECONE_API_KEY[-4:] if PINECONE_API_KEY else 'N/A'}'")
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+
         # --- Robust Index Existence Check ---
-    logging.info("Fetching list of existing Pinecone indexes...")
-    index_list_response = pc.list_indexes() # Returns a specific Pinecone object
-
-    # Check if the response object has an 'indexes' attribute and if it's a list
-    if hasattr(index_list_response, 'indexes') and isinstance(index_list_response.indexes, list):
-        # Access the list of index details via the .indexes attribute
-        existing_indexes_details = index_list_response.indexes
-        # Extract the names from the list of index detail objects/dicts
-        # Use getattr for safe access to the 'name' attribute/key of each item in the list
-        existing_index_names = [getattr(idx_details, 'name', None) for idx_details in existing_indexes_details]
-        # Filter out None values in case some items didn't have 'name'
-        existing_index_names = [name for name in existing_index_names if name is not None]
-        logging.info(f"Found index names: {existing_index_names}")
-
-        # Check if your target index name is in the extracted list
-        if INDEX_NAME not in existing_index_names:
-            logging.error(f"Pinecone index '{INDEX_NAME}' does not exist in the list: {existing_index_names}. Please create it first.")
-            exit()
-        else:
+        logging.info("Fetching list of existing Pinecone indexes...")
+        index_list_response = pc.list_indexes() # Returns a specific Pinecone object
+
+        # Check if the response object has an 'indexes' attribute and if it's a list
+        if hasattr(index_list_response, 'indexes') and isinstance(index_list_response.indexes, list):
+            # Use getattr for safe access to the 'name' attribute/key of each item in the list
+            existing_index_names = [getattr(idx_details, 'name', None) for idx_details in index_list_response.indexes]
+            existing_index_names = [name for name in existing_index_names if name is not None]
+            logging.info(f"Found index names: {existing_index_names}")
+
+            if INDEX_NAME not in existing_index_names:
+                logging.error(f"Pinecone index '{INDEX_NAME}' does not exist in the list: {existing_index_names}. Please create it first.")
+                exit()
             logging.info(f"Index '{INDEX_NAME}' found.")
-            # Now connect to the specific index
-            index = pc.Index(INDEX_NAME)
+            index = pc.Index(INDEX_NAME, pool_threads=INDEX_UPSERT_CONCURRENCY) # One HTTP connection per upsert thread
             logging.info(f"Successfully connected to Pinecone index '{INDEX_NAME}'.")
             logging.info(f"Initial index stats: {index.describe_index_stats()}")
-    else:
+            return index
         # Handle unexpected response structure if 'indexes' attribute is missing or not a list
         logging.error(f"Could not verify index existence. Unexpected response object structure from pc.list_indexes(). Object type: {type(index_list_response)}, Value: {index_list_response}")
         logging.error("Please check Pinecone client library version, API key, network connection, and service status.")
         exit() # Exit because we cannot confirm the index exists
-except Exception as e:
-    logging.exception(f"FATAL: Error during Pinecone initialization or index check: {e}") # Log full traceback
-    exit() # Exit on any initialization error
-
-# -------------------- Load the Embedding Model --------------------
-# (Keep this section as it was before)
-try:
-    logging.info(f"Loading embedding model: {EMBEDDING_MODEL}...")
-    model = SentenceTransformer(EMBEDDING_MODEL)
-    logging.info("Embedding model loaded successfully.")
-except Exception as e:
-    logging.error(f"Error loading SentenceTransformer model '{EMBEDDING_MODEL}': {e}")
-    exit()
+    except Exception as e:
+        logging.exception(f"FATAL: Error during Pinecone initialization or index check: {e}") # Log full traceback
+        exit() # Exit on any initialization error
 
-# -------------------- Initialize Text Splitter --------------------
-# (Keep this section as it was before)
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP,
-    length_function=len,
-    add_start_index=True,
-)
-logging.info(f"Text splitter initialized with chunk_size={CHUNK_SIZE}, overlap={CHUNK_OVERLAP}")
 
-# -------------------- Load Processed Record IDs (Now tracks chunk IDs) --------------------
-# (Keep this section as it was before)
-processed_ids_file = "processed_chunk_ids.json"
-processed_chunk_ids = set()
-if os.path.exists(processed_ids_file):
-    try:
-        with open(processed_ids_file, "r", encoding='utf-8') as f:
-            processed_ids_list = json.load(f)
-            if isinstance(processed_ids_list, list):
-                 processed_chunk_ids = set(processed_ids_list)
-            else:
-                 logging.warning(f"Expected list in {processed_ids_file}, got {type(processed_ids_list)}. Starting fresh.")
-        logging.info(f"Loaded {len(processed_chunk_ids)} processed chunk IDs.")
-    except Exception as e:
-        logging.error(f"Error loading {processed_ids_file}: {e}. Starting fresh.")
-else:
-    logging.info("No processed chunk IDs file found. Starting fresh.")
-
-# -------------------- Load Source JSON Data --------------------
-# (Keep this section as it was before)
-data_file_path = "../WebScraping/data.json"
-if not os.path.exists(data_file_path):
-    logging.error(f"Error: Data file '{data_file_path}' not found.")
-    exit()
-try:
-    with open(data_file_path, "r", encoding='utf-8') as f:
-        source_records = json.load(f)
-    logging.info(f"Loaded {len(source_records)} source document records from {data_file_path}.")
-except Exception as e:
-    logging.error(f"Error reading/decoding {data_file_path}: {e}")
-    exit()
-if not isinstance(source_records, list):
-    logging.error(f"Error: Expected a list of records in {data_file_path}.")
-    exit()
-
-# -------------------- Process Documents, Chunk, Generate Embeddings --------------------
-# (Keep this section as it was before - no changes needed here for this specific error)
-new_vectors = []
-new_chunk_ids_batch = []
-batch_size = 100
-total_chunks_processed = 0
-total_source_docs_processed = 0
-total_skipped_docs = 0
-total_skipped_chunks = 0
-
-logging.info("Processing documents, chunking, and generating embeddings...")
-for i, item in enumerate(source_records):
-    # ... (rest of the loop for chunking, embedding, metadata check, batching) ...
-    # This part remains the same as the previous chunking version
-    if not isinstance(item, dict) or len(item) != 1:
-        logging.warning(f"Skipping invalid source record format at index {i}.")
-        total_skipped_docs += 1
-        continue
-    filename = list(item.keys())[0]
-    record_data = item[filename]
-    if not isinstance(record_data, dict):
-        logging.warning(f"Skipping source record {filename} at index {i}: Value is not a dictionary.")
-        total_skipped_docs += 1
-        continue
-    text_content = record_data.get("content", "")
-    if not text_content or not isinstance(text_content, str) or len(text_content.strip()) == 0:
-        logging.warning(f"Skipping source record {filename} due to missing or empty 'content'.")
-        total_skipped_docs += 1
-        continue
-    base_metadata = {
-        "source_filename": filename,
-        "url": record_data.get("url", record_data.get("pdf_url", "")),
-        "publish_date": record_data.get("publish_date", record_data.get("date", "")),
-        "notification_number": record_data.get("notification_number", "")
-    }
-    base_metadata = {k: v for k, v in base_metadata.items() if v is not None and v != ""}
+# -------------------- Content Hashes --------------------
+# Changing the chunking settings or the embedding model changes every hash, so everything is re-indexed
+def document_hash(text_content, base_metadata, page_offsets=None):
+    parts = {"content": text_content, "metadata": base_metadata, "chunking": [CHUNK_SIZE, CHUNK_OVERLAP], "model": EMBEDDING_MODEL}
+    if page_offsets: parts["page_offsets"] = page_offsets # Only when present, so older records keep their hashes
+    return content_hash(parts)
+
+def chunk_hash(chunk_metadata):
+    return content_hash({"metadata": chunk_metadata, "model": EMBEDDING_MODEL})
+
+
+# -------------------- Pinecone Calls With Retries --------------------
+def is_retryable(status):
+    # No HTTP status means a connection/timeout error; 429 is throttling
+    return status is None or status == 429 or status >= 500
+
+def call_with_retry(fn, description, on_retry=None):
+    """Calls fn(), retrying retryable failures with exponential backoff and jitter. Re-raises the final error."""
+    for attempt in range(1, PINECONE_MAX_ATTEMPTS + 1):
+        try:
+            return fn()
+        except Exception as e:
+            status = getattr(e, "status", None)
+            if not is_retryable(status) or attempt == PINECONE_MAX_ATTEMPTS: raise
+            delay = min(PINECONE_BACKOFF_MAX_SECONDS, PINECONE_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            logging.warning(f"{description} attempt {attempt} failed ({status or type(e).__name__}): {e}. Retrying in {delay:.1f}s...")
+            if on_retry: on_retry()
+            time.sleep(delay)
+
+def delete_vectors(index, chunk_ids, stats):
+    """Deletes vectors by ID in batches. Returns False if any batch could not be deleted."""
+    for start in range(0, len(chunk_ids), DELETE_BATCH_SIZE):
+        ids_batch = chunk_ids[start:start + DELETE_BATCH_SIZE]
+        try:
+            call_with_retry(lambda: index.delete(ids=ids_batch), f"Delete of {len(ids_batch)} vectors")
+        except Exception as e:
+            logging.error(f"Error deleting {len(ids_batch)} vectors from Pinecone (first: {ids_batch[0]}): {e}")
+            return False
+        stats["chunks_deleted"] += len(ids_batch)
+    return True
+
+
+# -------------------- Stream Source Records --------------------
+def iter_source_records(path=DATA_FILE_PATH):
+    """
+    Returns an iterator of {filename: record} dicts read one line at a time from the JSON Lines file written
+    by combine_json_file.py, so only one document's text is in memory at once. Falls back to a legacy data.json list.
+    """
+    if os.path.exists(path):
+        logging.info(f"Streaming source document records from {path}.")
+        return _iter_jsonl(path)
+    if not os.path.exists(LEGACY_DATA_FILE_PATH):
+        logging.error(f"Error: Data file '{path}' not found.")
+        exit()
+    logging.warning(f"{path} not found; loading legacy {LEGACY_DATA_FILE_PATH} into memory. Re-run combine_json_file.py to switch to JSON Lines.")
     try:
-        chunks = text_splitter.split_text(text_content)
-        # logging.info(f"Document '{filename}' split into {len(chunks)} chunks.") # Can make logs noisy
+        with open(LEGACY_DATA_FILE_PATH, "r", encoding='utf-8') as f:
+            source_records = json.load(f)
     except Exception as e:
-        logging.error(f"Error splitting text for document '{filename}': {e}. Skipping document.")
-        total_skipped_docs += 1
-        continue
-    total_source_docs_processed += 1
-    for chunk_index, chunk_text in enumerate(chunks):
-        chunk_id_str = f"{filename}_chunk_{chunk_index}"
-        if chunk_id_str in processed_chunk_ids:
-            total_skipped_chunks += 1
+        logging.error(f"Error reading/decoding {LEGACY_DATA_FILE_PATH}: {e}")
+        exit()
+    if not isinstance(source_records, list):
+        logging.error(f"Error: Expected a list of records in {LEGACY_DATA_FILE_PATH}.")
+        exit()
+    return iter(source_records)
+
+def _iter_jsonl(path):
+    with open(path, "r", encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip(): continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logging.warning(f"Malformed line {line_number} in {path}: {e}")
+                yield None # Counted as an invalid record by iter_chunks
+
+
+# -------------------- Pipeline Stage 1: Chunk Documents --------------------
+def iter_chunks(source_records, manifest, plan, stats, lexical=None):
+    """
+    Yields (chunk_id, chunk_text, chunk_metadata) for every new or changed chunk.
+    Unchanged documents (same document hash as the manifest) are not even re-chunked. For each changed
+    document, plan["pending"] records the chunk hashes it should end up with; finalize_documents() uses
+    that after the upserts to delete stale vectors. The lexical index tracks its own document hashes, so a
+    missing or deleted lexical index is rebuilt by re-chunking without re-embedding anything.
+    """
+    for i, item in enumerate(source_records):
+        stats["docs_loaded"] += 1
+        if not isinstance(item, dict) or len(item) != 1:
+            logging.warning(f"Skipping invalid source record format at index {i}.")
+            stats["skipped_docs"] += 1
+            continue
+        filename = list(item.keys())[0]
+        record_data = item[filename]
+        if not isinstance(record_data, dict):
+            logging.warning(f"Skipping source record {filename} at index {i}: Value is not a dictionary.")
+            stats["skipped_docs"] += 1
+            continue
+        text_content = record_data.get("content", "")
+        if not text_content or not isinstance(text_content, str) or len(text_content.strip()) == 0:
+            logging.warning(f"Skipping source record {filename} due to missing or empty 'content'.")
+            stats["skipped_docs"] += 1
             continue
-        chunk_metadata = base_metadata.copy()
-        chunk_metadata["chunk_index"] = chunk_index
-        chunk_metadata["chunk_text"] = chunk_text
-        metadata_json_string = json.dumps(chunk_metadata)
-        metadata_size = len(metadata_json_string.encode('utf-8'))
-        if metadata_size > METADATA_SIZE_LIMIT_BYTES:
-            logging.warning(f"Chunk {chunk_id_str} metadata size ({metadata_size} bytes) exceeds limit. Skipping chunk.")
-            total_skipped_chunks += 1
+        base_metadata = {
+            "source_filename": filename,
+            "url": record_data.get("url", record_data.get("pdf_url", "")),
+            "publish_date": record_data.get("publish_date", record_data.get("date", "")),
+            "notification_number": record_data.get("notification_number", "")
+        }
+        base_metadata = {k: v for k, v in base_metadata.items() if v is not None and v != ""}
+        base_metadata.update(filter_metadata(base_metadata.get("url"), base_metadata.get("publish_date"), base_metadata.get("notification_number"), text_content))
+        if filename in plan["seen"]:
+            logging.warning(f"Skipping duplicate source record {filename} at index {i}.")
+            stats["skipped_docs"] += 1
+            continue
+        plan["seen"].add(filename)
+        page_offsets = record_data.get("page_offsets") # Written by the scrapers' pdf_extract.extract_pdf_text
+        if not isinstance(page_offsets, list) or not page_offsets: page_offsets = None
+        doc_hash = document_hash(text_content, base_metadata, page_offsets)
+        vectors_current = doc_hash == manifest.doc_hash(filename)
+        lexical_current = lexical is None or doc_hash == lexical.doc_hash(filename)
+        if vectors_current and lexical_current:
+            stats["unchanged_docs"] += 1
             continue
         try:
-            chunk_embedding = model.encode(chunk_text).tolist()
+            chunks = text_splitter.split_text(text_content)
         except Exception as e:
-            logging.error(f"Error generating embedding for chunk {chunk_id_str}: {e}. Skipping chunk.")
-            total_skipped_chunks += 1
+            logging.error(f"Error splitting text for document '{filename}': {e}. Skipping document.")
+            stats["skipped_docs"] += 1
             continue
-        new_vectors.append((chunk_id_str, chunk_embedding, chunk_metadata))
-        new_chunk_ids_batch.append(chunk_id_str)
-        total_chunks_processed += 1
-        if len(new_vectors) >= batch_size:
+        doc_chunks = []
+        search_from = 0
+        for chunk_index, chunk_text in enumerate(chunks):
+            chunk_id_str = f"{filename}_chunk_{chunk_index}"
+            chunk_metadata = base_metadata.copy()
+            chunk_metadata["chunk_index"] = chunk_index
+            chunk_metadata["chunk_text"] = chunk_text
+            if page_offsets:
+                # Chunks come out in document order, so each is searched for from the previous one's start
+                start = text_content.find(chunk_text, search_from)
+                if start != -1:
+                    search_from = start
+                    chunk_metadata["page"] = page_for_offset(page_offsets, start)
+                    chunk_metadata["page_end"] = page_for_offset(page_offsets, start + len(chunk_text) - 1)
+            metadata_size = len(json.dumps(chunk_metadata).encode('utf-8'))
+            if metadata_size > METADATA_SIZE_LIMIT_BYTES:
+                logging.warning(f"Chunk {chunk_id_str} metadata size ({metadata_size} bytes) exceeds limit. Skipping chunk.")
+                stats["skipped_chunks"] += 1
+                continue
+            doc_chunks.append((chunk_id_str, chunk_text, chunk_metadata))
+        if not lexical_current:
             try:
-                logging.info(f"Upserting batch of {len(new_vectors)} chunk vectors...")
-                upsert_response = index.upsert(vectors=new_vectors)
-                logging.info(f"Batch upsert response: {upsert_response}")
-                processed_chunk_ids.update(new_chunk_ids_batch)
-                with open(processed_ids_file, "w", encoding='utf-8') as f:
-                    json.dump(list(processed_chunk_ids), f)
+                lexical.replace_document(filename, doc_hash, [chunk_metadata for _, _, chunk_metadata in doc_chunks])
+                stats["lexical_docs"] += 1
             except Exception as e:
-                logging.error(f"Error upserting batch to Pinecone: {e}")
-            new_vectors = []
-            new_chunk_ids_batch = []
-if new_vectors:
+                logging.error(f"Error updating lexical index for document '{filename}': {e}. It will be retried on the next run.")
+        if vectors_current:
+            stats["unchanged_docs"] += 1
+            continue
+        stats["docs_processed"] += 1
+        indexed_chunk_hashes = manifest.chunk_hashes(filename)
+        expected_chunk_hashes = {}
+        plan["pending"][filename] = {"doc_hash": doc_hash, "chunk_hashes": expected_chunk_hashes}
+        for chunk_id_str, chunk_text, chunk_metadata in doc_chunks:
+            expected_chunk_hashes[chunk_id_str] = chunk_hash(chunk_metadata)
+            if indexed_chunk_hashes.get(chunk_id_str) == expected_chunk_hashes[chunk_id_str]:
+                stats["unchanged_chunks"] += 1
+                continue
+            yield chunk_id_str, chunk_text, chunk_metadata
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# -------------------- Pipeline Stage 2: Embed In Batches --------------------
+class ChunkEmbedder:
+    """
+    Encodes chunk batches with the shared SentenceTransformer.
+    With processes > 0 each batch is split across a sentence-transformers multi-process pool.
+    """
+
+    def __init__(self, processes=INDEX_EMBED_PROCESSES, batch_size=INDEX_EMBED_BATCH_SIZE):
+        logging.info(f"Loading embedding model: {EMBEDDING_MODEL}...")
+        self.model = get_embedding_model()
+        self.batch_size = batch_size
+        self.pool = None
+        if processes > 0:
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * processes)
+            logging.info(f"Started embedding process pool with {processes} workers.")
+
+    def encode(self, texts):
+        # Not normalised: the retriever embeds queries the same way (see SharedSentenceTransformerEmbeddings)
+        if self.pool is not None:
+            chunk_size = -(-len(texts) // len(self.pool["processes"])) # One slice per worker
+            return self.model.encode_multi_process(texts, self.pool, batch_size=ENCODE_BATCH_SIZE, chunk_size=chunk_size)
+        return self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+# -------------------- Pipeline Stage 3: Upsert (concurrent, retrying) --------------------
+def estimate_vector_bytes(chunk_id, embedding, chunk_metadata):
+    """Rough size of one vector in an upsert request body (JSON floats are ~20 characters each)."""
+    return len(chunk_id) + len(embedding) * UPSERT_BYTES_PER_FLOAT + len(json.dumps(chunk_metadata).encode('utf-8')) + 64
+
+class UpsertBatcher:
+    """Packs vectors into upsert batches under Pinecone's request-size and vector-count limits."""
+
+    def __init__(self, max_bytes=UPSERT_MAX_REQUEST_BYTES, max_vectors=UPSERT_MAX_VECTORS):
+        self.max_bytes = max_bytes
+        self.max_vectors = max_vectors
+        self.vectors = []
+        self.size_bytes = 0
+
+    def add(self, vector):
+        """Adds a vector; returns the previous batch if this vector did not fit in it, else None."""
+        vector_bytes = estimate_vector_bytes(*vector)
+        full_batch = None
+        if self.vectors and (self.size_bytes + vector_bytes > self.max_bytes or len(self.vectors) >= self.max_vectors):
+            full_batch = self.flush()
+        self.vectors.append(vector)
+        self.size_bytes += vector_bytes
+        return full_batch
+
+    def flush(self):
+        batch, self.vectors, self.size_bytes = self.vectors, [], 0
+        return batch
+
+class Upserter:
+    """
+    Keeps up to `concurrency` upsert requests in flight on a thread pool.
+    Throttled (429), server (5xx) and connection errors are retried with exponential backoff and jitter;
+    a batch rejected as too large is split in half. Each upserted batch is recorded in the manifest as one transaction.
+    """
+
+    def __init__(self, index, manifest, stats, concurrency=INDEX_UPSERT_CONCURRENCY):
+        self.index = index
+        self.manifest = manifest
+        self.stats = stats
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pinecone-upsert")
+        self.in_flight = threading.BoundedSemaphore(concurrency * 2) # Bounds queued batches, pacing the embed stage
+        self.lock = threading.Lock()
+
+    def submit(self, vectors):
+        self.in_flight.acquire()
+        future = self.executor.submit(self._upsert_with_retry, vectors)
+        future.add_done_callback(lambda _: self.in_flight.release())
+
+    def finish(self):
+        self.executor.shutdown(wait=True)
+
+    def _upsert_with_retry(self, vectors):
+        try:
+            call_with_retry(lambda: self.index.upsert(vectors=vectors), f"Upsert of {len(vectors)} vectors", self._count_retry)
+        except Exception as e:
+            status = getattr(e, "status", None)
+            if status in (400, 413) and len(vectors) > 1 and "size" in str(e).lower():
+                logging.warning(f"Upsert of {len(vectors)} vectors rejected as too large. Splitting batch.")
+                half = len(vectors) // 2
+                self._upsert_with_retry(vectors[:half]); self._upsert_with_retry(vectors[half:])
+                return
+            logging.error(f"Error upserting batch of {len(vectors)} vectors to Pinecone: {e}. "
+                          f"First chunk: {vectors[0][0]}. These chunks will be retried on the next run.")
+            self._record(vectors, succeeded=False)
+            return
+        self._record(vectors, succeeded=True)
+
+    def _count_retry(self):
+        with self.lock: self.stats["pinecone_retries"] += 1
+
+    def _record(self, vectors, succeeded):
+        if not succeeded:
+            with self.lock: self.stats["failed_chunks"] += len(vectors)
+            return
+        entries = [(chunk_metadata["source_filename"], chunk_metadata["chunk_index"], chunk_hash(chunk_metadata)) for _, _, chunk_metadata in vectors]
+        try: self.manifest.mark_chunks(entries)
+        except Exception as e: logging.error(f"Error recording {len(vectors)} upserted chunks in the index manifest: {e}")
+        with self.lock: self.stats["chunks_upserted"] += len(vectors)
+
+
+def run_pipeline(index, source_records, manifest, embedder, prune=INDEX_PRUNE_MISSING_DOCS, lexical=None):
+    """Chunks -> batched embeddings -> concurrent upserts -> stale-vector deletes. Returns the run statistics."""
+    stats = {"docs_loaded": 0, "docs_processed": 0, "unchanged_docs": 0, "skipped_docs": 0, "unchanged_chunks": 0, "skipped_chunks": 0, "chunks_embedded": 0,
+             "chunks_upserted": 0, "failed_chunks": 0, "chunks_deleted": 0, "incomplete_docs": 0, "pruned_docs": 0, "pinecone_retries": 0, "lexical_docs": 0}
+    plan = {"seen": set(), "pending": {}}
+    upserter = Upserter(index, manifest, stats)
+    batcher = UpsertBatcher()
     try:
-        logging.info(f"Upserting final batch of {len(new_vectors)} chunk vectors...")
-        upsert_response = index.upsert(vectors=new_vectors)
-        logging.info(f"Final batch upsert response: {upsert_response}")
-        processed_chunk_ids.update(new_chunk_ids_batch)
-        with open(processed_ids_file, "w", encoding='utf-8') as f:
-            json.dump(list(processed_chunk_ids), f)
-    except Exception as e:
-        logging.error(f"Error upserting final batch to Pinecone: {e}")
+        for chunk_batch in batched(iter_chunks(source_records, manifest, plan, stats, lexical), embedder.batch_size):
+            chunk_texts = [chunk_text for _, chunk_text, _ in chunk_batch]
+            try:
+                started = time.perf_counter()
+                embeddings = embedder.encode(chunk_texts)
+                logging.info(f"Embedded {len(chunk_texts)} chunks in {time.perf_counter() - started:.2f}s.")
+            except Exception as e:
+                logging.error(f"Error generating embeddings for batch starting at chunk {chunk_batch[0][0]}: {e}. Skipping batch.")
+                stats["skipped_chunks"] += len(chunk_batch)
+                continue
+            stats["chunks_embedded"] += len(chunk_batch)
+            for (chunk_id, _, chunk_metadata), embedding in zip(chunk_batch, embeddings):
+                full_batch = batcher.add((chunk_id, embedding.tolist(), chunk_metadata))
+                if full_batch: upserter.submit(full_batch)
+        if final_batch := batcher.flush(): upserter.submit(final_batch)
+    finally:
+        upserter.finish()
+    finalize_documents(index, manifest, plan, stats, prune, lexical)
+    manifest.save()
+    if hasattr(index, "flush"): index.flush() # Local index: compact and rebuild the ANN graph once per run
+    return stats
+
 
-# -------------------- Indexing Summary --------------------
-# (Keep this section as it was before)
-logging.info(f"\n--- Indexing Summary ---")
-logging.info(f"Total source documents loaded: {len(source_records)}")
-logging.info(f"Source documents processed: {total_source_docs_processed}")
-logging.info(f"Source documents skipped (invalid format/content): {total_skipped_docs}")
-logging.info(f"Total chunks processed for upsert: {total_chunks_processed}")
-logging.info(f"Chunks skipped (already processed or metadata too large): {total_skipped_chunks}")
-logging.info(f"Total chunk IDs in {processed_ids_file}: {len(processed_chunk_ids)}")
+# -------------------- Pipeline Stage 4: Delete Stale Vectors --------------------
+def finalize_documents(index, manifest, plan, stats, prune, lexical=None):
+    """
+    For each changed document whose chunks were all upserted, deletes vectors for chunks it no longer has
+    and records its new hash. Documents with failed chunks keep their old hash so the next run retries them.
+    With prune, documents that disappeared from the source data are deleted from the index entirely.
+    """
+    for filename, pending in plan["pending"].items():
+        indexed_chunk_hashes = manifest.chunk_hashes(filename)
+        missing = [chunk_id for chunk_id, expected in pending["chunk_hashes"].items() if indexed_chunk_hashes.get(chunk_id) != expected]
+        if missing:
+            logging.warning(f"Document {filename} has {len(missing)} chunks that were not indexed. It will be retried on the next run.")
+            stats["incomplete_docs"] += 1
+            continue
+        stale_ids = [chunk_id for chunk_id in indexed_chunk_hashes if chunk_id not in pending["chunk_hashes"]]
+        if stale_ids:
+            logging.info(f"Deleting {len(stale_ids)} stale chunk vectors of {filename}...")
+            if not delete_vectors(index, stale_ids, stats): stats["incomplete_docs"] += 1; continue
+        manifest.complete_document(filename, pending["doc_hash"], set(pending["chunk_hashes"]))
+    if not prune: return
+    for filename in manifest.filenames() - plan["seen"]:
+        chunk_ids = list(manifest.chunk_hashes(filename))
+        logging.info(f"Pruning {filename} ({len(chunk_ids)} vectors): no longer in the source data.")
+        if delete_vectors(index, chunk_ids, stats):
+            manifest.remove_document(filename)
+            stats["pruned_docs"] += 1
+    if lexical is None: return
+    for filename in lexical.filenames() - plan["seen"]:
+        lexical.remove_document(filename)
+        stats["lexical_docs"] += 1
 
 
 # -------------------- Sample Query Demonstration --------------------
-# (Keep this section as it was before)
-try:
-    # Ensure index object is valid before using it
-    if index:
-        logging.info("Waiting a few seconds for Pinecone index to update stats...")
-        time.sleep(10)
+def run_sample_query(index, model, wait_seconds=10):
+    try:
+        if wait_seconds:
+            logging.info("Waiting a few seconds for Pinecone index to update stats...")
+            time.sleep(wait_seconds)
         logging.info("Checking index stats after delay...")
         index_stats = index.describe_index_stats()
         logging.info(f"Index stats after delay: {index_stats}")
@@ -252,7 +469,56 @@ try:
                 logging.info("No relevant chunks found for the sample query.")
         else:
             logging.warning("\nSample Query skipped. Pinecone index reports 0 vectors even after waiting.")
-    else:
-         logging.warning("\nSample Query skipped as Pinecone index object is not valid.")
-except Exception as e:
-    logging.error(f"Error during sample query or describing index stats: {e}")
\ No newline at end of file
+    except Exception as e:
+        logging.error(f"Error during sample query or describing index stats: {e}")
+
+
+def main():
+    index = connect_index()
+    try:
+        embedder = ChunkEmbedder()
+        logging.info("Embedding model loaded successfully.")
+    except Exception as e:
+        logging.error(f"Error loading SentenceTransformer model '{EMBEDDING_MODEL}': {e}")
+        exit()
+    logging.info(f"Text splitter initialized with chunk_size={CHUNK_SIZE}, overlap={CHUNK_OVERLAP}")
+
+    manifest = IndexManifest.load(MANIFEST_FILE, legacy_paths=LEGACY_MANIFEST_FILES)
+    lexical = LexicalIndex(LEXICAL_INDEX_PATH) if HYBRID_RETRIEVAL else None
+    source_records = iter_source_records()
+
+    logging.info(f"Processing documents: chunking, embedding in batches of {embedder.batch_size}, upserting with {INDEX_UPSERT_CONCURRENCY} concurrent requests...")
+    started = time.perf_counter()
+    try:
+        stats = run_pipeline(index, source_records, manifest, embedder, lexical=lexical)
+    finally:
+        embedder.close()
+        if lexical is not None: lexical.close()
+    elapsed = time.perf_counter() - started
+
+    # -------------------- Invalidate Cached Answers --------------------
+    # Answers cached by app.py were generated from the old chunks; publish a new index version so they are dropped
+    if stats["chunks_upserted"] > 0 or stats["chunks_deleted"] > 0 or stats["lexical_docs"] > 0:
+        try:
+            bump_index_version()
+        except Exception as e:
+            logging.error(f"Error publishing new index version for answer cache invalidation: {e}")
+
+    # -------------------- Indexing Summary --------------------
+    logging.info(f"\n--- Indexing Summary ---")
+    logging.info(f"Total source documents read: {stats['docs_loaded']}")
+    logging.info(f"Source documents new or changed: {stats['docs_processed']} (unchanged: {stats['unchanged_docs']})")
+    logging.info(f"Source documents skipped (invalid format/content/duplicate): {stats['skipped_docs']}")
+    logging.info(f"Chunks embedded: {stats['chunks_embedded']} in {elapsed:.1f}s ({stats['chunks_embedded'] / max(elapsed, 1e-9):.1f} chunks/s)")
+    logging.info(f"Chunks upserted: {stats['chunks_upserted']} (failed after retries: {stats['failed_chunks']}, retried requests: {stats['pinecone_retries']})")
+    logging.info(f"Chunks unchanged: {stats['unchanged_chunks']}; skipped (metadata too large or embedding failed): {stats['skipped_chunks']}")
+    logging.info(f"Stale chunk vectors deleted: {stats['chunks_deleted']}; documents pruned: {stats['pruned_docs']}; documents left for retry: {stats['incomplete_docs']}")
+    logging.info(f"Index manifest {MANIFEST_FILE}: {len(manifest.filenames())} documents, {manifest.chunk_count()} chunks")
+    if lexical is not None: logging.info(f"Lexical index {LEXICAL_INDEX_PATH}: {stats['lexical_docs']} documents updated")
+
+    run_sample_query(index, embedder.model, wait_seconds=0 if VECTOR_STORE_BACKEND == "local" else 10) # Local writes are visible immediately
+
+
+# The multi-process embedding pool spawns workers that re-import this module, so keep work behind the guard
+if __name__ == "__main__":
+    main()
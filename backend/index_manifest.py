@@ -0,0 +1,178 @@
+# backend/index_manifest.py
+"""
+Local manifest of what index.py has put into Pinecone.
+
+For every source document it records a hash of the document (text + metadata + chunking settings)
+and, for every chunk vector, a hash of the exact metadata that was upserted (which includes the
+chunk text). index.py compares these against the current data to skip unchanged documents, re-embed
+only changed chunks and delete vectors whose chunks no longer exist.
+
+Stored in SQLite (WAL mode). Filenames are stored once per document; a chunk row is just
+(doc_id, chunk_index, 16-byte hash), so the chunk ID strings are only built for the document being
+looked at and each upserted batch is a small crash-safe transaction.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+HASH_BYTES = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id   INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    doc_hash BLOB
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    doc_id      INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    chunk_hash  BLOB,
+    PRIMARY KEY (doc_id, chunk_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def content_hash(payload) -> bytes:
+    """Stable truncated SHA-256 of a JSON-serialisable payload."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).digest()[:HASH_BYTES]
+
+
+def chunk_id_for(filename, chunk_index):
+    return f"{filename}_chunk_{chunk_index}"
+
+
+def parse_chunk_id(chunk_id):
+    """Splits an f"{filename}_chunk_{i}" chunk ID into (filename, i); returns None for other IDs."""
+    filename, sep, chunk_index = chunk_id.rpartition("_chunk_")
+    return (filename, int(chunk_index)) if sep and chunk_index.isdigit() else None
+
+
+class IndexManifest:
+    """SQLite manifest of indexed documents and chunk hashes. Safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # Commits survive a process crash; a power loss may drop the last few, which are re-indexed
+        self._conn.executescript(SCHEMA)
+        self._doc_ids = dict(self._conn.execute("SELECT filename, doc_id FROM documents"))
+
+    @classmethod
+    def load(cls, path, legacy_paths=()):
+        """Opens the manifest, importing older JSON manifests/processed-ID lists the first time."""
+        manifest = cls(path)
+        if manifest._meta("migrated") is None:
+            for legacy_path in legacy_paths:
+                if os.path.exists(legacy_path):
+                    manifest.import_legacy(legacy_path)
+                    break
+            manifest._set_meta("migrated", "1")
+        logging.info(f"Opened index manifest {path}: {len(manifest._doc_ids)} documents, {manifest.chunk_count()} chunks.")
+        return manifest
+
+    def import_legacy(self, legacy_path):
+        """
+        Imports index_manifest.json ({"documents": {filename: {"doc_hash", "chunks"}}}) or a plain
+        processed_chunk_ids.json list. Chunks without a known hash are re-embedded once.
+        """
+        try:
+            with open(legacy_path, "r", encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for filename, document in data.get("documents", {}).items():
+                    self.mark_chunks((filename, parsed[1], bytes.fromhex(chunk_hash)[:HASH_BYTES] if chunk_hash else None)
+                                     for chunk_id, chunk_hash in document.get("chunks", {}).items() if (parsed := parse_chunk_id(chunk_id)))
+                    if document.get("doc_hash"): self._set_doc_hash(filename, bytes.fromhex(document["doc_hash"])[:HASH_BYTES])
+            else:
+                self.mark_chunks((parsed[0], parsed[1], None) for chunk_id in data if (parsed := parse_chunk_id(chunk_id)))
+            logging.info(f"Imported legacy index state from {legacy_path}: {len(self._doc_ids)} documents, {self.chunk_count()} chunks.")
+        except Exception as e:
+            logging.error(f"Error importing legacy index state from {legacy_path}: {e}")
+
+    # --- Queries ---
+    def filenames(self):
+        with self._lock: return set(self._doc_ids)
+
+    def doc_hash(self, filename):
+        with self._lock:
+            row = self._conn.execute("SELECT doc_hash FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def chunk_hashes(self, filename):
+        """Returns {chunk_id: chunk_hash} for the document's vectors currently in the index."""
+        with self._lock:
+            doc_id = self._doc_ids.get(filename)
+            if doc_id is None: return {}
+            rows = self._conn.execute("SELECT chunk_index, chunk_hash FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+        return {chunk_id_for(filename, chunk_index): chunk_hash for chunk_index, chunk_hash in rows}
+
+    def chunk_count(self):
+        with self._lock: return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    # --- Updates (each call is one transaction) ---
+    def mark_chunks(self, entries):
+        """Records successfully upserted chunks; entries are (filename, chunk_index, chunk_hash)."""
+        with self._lock, self._transaction():
+            rows = [(self._doc_id(filename), chunk_index, chunk_hash) for filename, chunk_index, chunk_hash in entries]
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (doc_id, chunk_index, chunk_hash) VALUES (?, ?, ?)", rows)
+
+    def complete_document(self, filename, doc_hash, chunk_ids):
+        """Marks a document fully indexed: sets its hash and forgets chunks outside chunk_ids (already deleted)."""
+        keep = {parsed[1] for chunk_id in chunk_ids if (parsed := parse_chunk_id(chunk_id))}
+        with self._lock, self._transaction():
+            doc_id = self._doc_id(filename)
+            existing = [row[0] for row in self._conn.execute("SELECT chunk_index FROM chunks WHERE doc_id = ?", (doc_id,))]
+            self._conn.executemany("DELETE FROM chunks WHERE doc_id = ? AND chunk_index = ?",
+                                   [(doc_id, chunk_index) for chunk_index in existing if chunk_index not in keep])
+            self._conn.execute("UPDATE documents SET doc_hash = ? WHERE doc_id = ?", (doc_hash, doc_id))
+
+    def remove_document(self, filename):
+        with self._lock, self._transaction():
+            doc_id = self._doc_ids.pop(filename, None)
+            if doc_id is None: return
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def save(self):
+        """Every update is already committed; this just folds the WAL back into the database file."""
+        with self._lock: self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+    # --- Internal helpers (caller holds self._lock) ---
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            self._doc_ids = dict(self._conn.execute("SELECT filename, doc_id FROM documents")) # Drop IDs of rolled-back inserts
+            raise
+        self._conn.execute("COMMIT")
+
+    def _doc_id(self, filename):
+        doc_id = self._doc_ids.get(filename)
+        if doc_id is None:
+            doc_id = self._conn.execute("INSERT INTO documents (filename) VALUES (?)", (filename,)).lastrowid
+            self._doc_ids[filename] = doc_id
+        return doc_id
+
+    def _set_doc_hash(self, filename, doc_hash):
+        with self._lock: self._conn.execute("UPDATE documents SET doc_hash = ? WHERE doc_id = ?", (doc_hash, self._doc_id(filename)))
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
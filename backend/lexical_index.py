@@ -0,0 +1,228 @@
+# backend/lexical_index.py
+"""
+BM25 lexical index over the knowledge-base chunks.
+
+Dense similarity search is good at paraphrases but routinely misses queries that hinge on exact tokens
+("Section 80C", notification "15/2024", "RBI/2024-25/12"). index.py keeps this inverted index in step
+with the vector index (same chunks and metadata) and retriever.py fuses its ranking with the dense one.
+
+Stored in SQLite (WAL mode) next to the backend: per-chunk token count and metadata, per-term document
+frequency, and (term, chunk) -> term frequency postings clustered by term, so a query only reads the
+postings of its own terms. Corpus totals are kept in the meta table so scoring never scans all chunks.
+"""
+
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from config import LEXICAL_INDEX_PATH
+from local_vector_store import matches_filter
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+FILTER_SCAN_BLOCK = 256 # Ranked chunks whose metadata is read per step when a metadata filter is applied
+
+# Words joined by "/", "-", "." (and digit groups joined by ",") stay one token, so "15/2024", "80c",
+# "rbi/2024-25/12" and "1,50,000" match exactly; their parts are indexed too so "2024" still matches.
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:(?:[/\-.]|(?<=\d),(?=\d))[^\W_]+)*")
+PART_PATTERN = re.compile(r"[^\W_]+")
+STOP_WORDS = frozenset("""
+a an and are as at be been by can do does for from has have how i if in into is it its may me my of on or our
+shall should so such than that the their then there these this those to under was we were what when where which
+who will with would you your
+""".split())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id   INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    doc_hash BLOB
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_key   INTEGER PRIMARY KEY,
+    doc_id      INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    metadata    TEXT NOT NULL,
+    UNIQUE (doc_id, chunk_index)
+);
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    term      TEXT NOT NULL,
+    chunk_key INTEGER NOT NULL,
+    tf        INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def tokenize(text):
+    """Lowercased tokens minus stop words; compound tokens are followed by their alphanumeric parts."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token not in STOP_WORDS: tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in PART_PATTERN.findall(token) if part not in STOP_WORDS)
+    return tokens
+
+
+def searchable_text(chunk_metadata):
+    """What gets indexed for a chunk: its text plus the notification number, which is often not in the text."""
+    return f"{chunk_metadata.get('notification_number', '')} {chunk_metadata.get('chunk_text', '')}"
+
+
+class LexicalIndex:
+    """
+    SQLite-backed BM25 index. index.py is the only writer; app workers search it concurrently
+    (one connection per thread, WAL readers never block on the writer).
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    @classmethod
+    def open_existing(cls, path=LEXICAL_INDEX_PATH):
+        """Opens the index for searching; returns None (dense-only retrieval) if index.py has not built it yet."""
+        if not os.path.exists(path):
+            logging.warning(f"[lexical_index.py] {path} not found; run index.py to build it. Using dense retrieval only.")
+            return None
+        index = cls(path)
+        logging.info(f"[lexical_index.py] Opened lexical index {path}: {index.chunk_count()} chunks.")
+        return index
+
+    # --- Queries ---
+    def search(self, query, top_k, metadata_filter=None):
+        """Returns up to top_k Pinecone-style matches ({"id", "score", "metadata"}) ranked by BM25, optionally metadata-filtered."""
+        conn = self._conn()
+        chunk_count, total_length = self._totals(conn)
+        terms = set(tokenize(query))
+        if not chunk_count or not terms: return []
+        average_length = total_length / chunk_count
+        scores = {}
+        for term in terms:
+            row = conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+            if not row: continue
+            idf = math.log(1 + (chunk_count - row[0] + 0.5) / (row[0] + 0.5))
+            postings = conn.execute("SELECT p.chunk_key, p.tf, c.length FROM postings p JOIN chunks c USING (chunk_key) WHERE p.term = ?", (term,))
+            for chunk_key, tf, length in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                scores[chunk_key] = scores.get(chunk_key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if not metadata_filter: return self._matches(conn, heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]))
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        matches = []
+        for start in range(0, len(ranked), FILTER_SCAN_BLOCK):
+            matches += [match for match in self._matches(conn, ranked[start:start + FILTER_SCAN_BLOCK]) if matches_filter(match["metadata"], metadata_filter)]
+            if len(matches) >= top_k: break
+        return matches[:top_k]
+
+    def filenames(self):
+        return {row[0] for row in self._conn().execute("SELECT filename FROM documents")}
+
+    def doc_hash(self, filename):
+        row = self._conn().execute("SELECT doc_hash FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def chunk_count(self):
+        return self._totals(self._conn())[0]
+
+    # --- Updates (index.py; each call is one transaction) ---
+    def replace_document(self, filename, doc_hash, chunk_metadatas):
+        """Replaces all of a document's chunks with chunk_metadatas (the metadata dicts upserted to the vector index)."""
+        conn = self._conn()
+        with self._transaction(conn):
+            row = conn.execute("SELECT doc_id FROM documents WHERE filename = ?", (filename,)).fetchone()
+            doc_id = row[0] if row else conn.execute("INSERT INTO documents (filename) VALUES (?)", (filename,)).lastrowid
+            self._delete_chunks(conn, doc_id)
+            added_length = 0
+            for chunk_metadata in chunk_metadatas:
+                term_counts = Counter(tokenize(searchable_text(chunk_metadata)))
+                length = sum(term_counts.values())
+                chunk_key = conn.execute("INSERT INTO chunks (doc_id, chunk_index, length, metadata) VALUES (?, ?, ?, ?)",
+                                         (doc_id, chunk_metadata["chunk_index"], length, json.dumps(chunk_metadata, ensure_ascii=False))).lastrowid
+                conn.executemany("INSERT INTO postings (term, chunk_key, tf) VALUES (?, ?, ?)", [(term, chunk_key, tf) for term, tf in term_counts.items()])
+                conn.executemany("INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT (term) DO UPDATE SET df = df + 1", [(term,) for term in term_counts])
+                added_length += length
+            self._add_totals(conn, len(chunk_metadatas), added_length)
+            conn.execute("UPDATE documents SET doc_hash = ? WHERE doc_id = ?", (doc_hash, doc_id))
+
+    def remove_document(self, filename):
+        conn = self._conn()
+        with self._transaction(conn):
+            row = conn.execute("SELECT doc_id FROM documents WHERE filename = ?", (filename,)).fetchone()
+            if not row: return
+            self._delete_chunks(conn, row[0])
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (row[0],))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            conn.close()
+            self._local.conn = None
+
+    # --- Internal helpers ---
+    @staticmethod
+    def _matches(conn, scored_keys):
+        if not scored_keys: return []
+        placeholders = ",".join("?" * len(scored_keys))
+        rows = dict(conn.execute(f"SELECT chunk_key, metadata FROM chunks WHERE chunk_key IN ({placeholders})", [key for key, _ in scored_keys]))
+        matches = []
+        for chunk_key, score in scored_keys:
+            metadata = json.loads(rows[chunk_key])
+            matches.append({"id": f"{metadata.get('source_filename')}_chunk_{metadata.get('chunk_index')}", "score": score, "metadata": metadata})
+        return matches
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Rebuilt from data.jsonl if a power loss drops the last commits
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _totals(conn):
+        totals = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('chunk_count', 'total_length')"))
+        return int(totals.get("chunk_count", 0)), int(totals.get("total_length", 0))
+
+    def _add_totals(self, conn, chunk_delta, length_delta):
+        chunk_count, total_length = self._totals(conn)
+        conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         [("chunk_count", str(chunk_count + chunk_delta)), ("total_length", str(total_length + length_delta))])
+
+    def _delete_chunks(self, conn, doc_id):
+        """Removes a document's chunks, re-tokenizing their stored text to find the postings to drop."""
+        rows = conn.execute("SELECT chunk_key, length, metadata FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+        for chunk_key, _, metadata in rows:
+            chunk_terms = set(tokenize(searchable_text(json.loads(metadata))))
+            conn.executemany("DELETE FROM postings WHERE term = ? AND chunk_key = ?", [(term, chunk_key) for term in chunk_terms])
+            terms = [(term,) for term in chunk_terms]
+            conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", terms)
+            conn.executemany("DELETE FROM terms WHERE term = ? AND df <= 0", terms)
+        if rows:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._add_totals(conn, -len(rows), -sum(row[1] for row in rows))
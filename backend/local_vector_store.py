@@ -0,0 +1,433 @@
+# backend/local_vector_store.py
+"""
+Embedded, file-backed vector index used instead of Pinecone when VECTOR_STORE_BACKEND=local.
+
+LocalVectorIndex mimics the subset of the Pinecone Index API the project uses (upsert, delete,
+query with metadata filters, describe_index_stats), so index.py writes to it unchanged and
+retrieval works offline with no network round-trip. LocalVectorStore wraps it as a LangChain
+VectorStore for get_retriever().
+
+On-disk layout (LOCAL_VECTOR_STORE_DIR):
+- vectors.f32    append-only float32 rows (L2-normalised; scores are cosine similarity), memory-mapped
+- rows.jsonl     append-only {"id", "metadata"} per row; read lazily by byte offset for matches only
+- offsets.i64    byte offset of each row in rows.jsonl
+- deleted.u8     tombstone per row (upserting an existing id tombstones the old row)
+- state.json     committed row count + version, replaced atomically after every write
+- hnsw.bin       optional HNSW graph over the first `hnsw_rows` rows (needs hnswlib), built on flush()
+
+One process writes at a time (index.py); any number of readers may share the directory.
+Readers (app workers) re-open the memory maps when state.json changes, so a running app sees
+vectors written by index.py in another process. Rows beyond the HNSW graph (and all rows when
+hnswlib is missing) are scored by brute force with NumPy. A filtered query first turns the filter into a
+row mask over per-field metadata columns (value -> rows, built once per snapshot for the fields filters
+use), then scores only the selected rows; metadata is read from rows.jsonl for the top_k matches only.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import hnswlib # Optional ANN index; brute-force NumPy search is used without it
+except ImportError:
+    hnswlib = None
+
+from config import LOCAL_VECTOR_STORE_DIR
+
+HNSW_MIN_ROWS = 20000 # Below this brute force is already a few milliseconds
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+COMPACT_DELETED_FRACTION = 0.3 # flush() rewrites the files once this share of rows is tombstoned
+COMPACT_BLOCK_ROWS = 65536
+
+
+# --- Pinecone-style metadata filters ---
+def matches_filter(metadata, metadata_filter):
+    """Evaluates a Pinecone metadata filter ($eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$exists/$and/$or)."""
+    if not metadata_filter: return True
+    for key, condition in metadata_filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition): return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition): return False
+        elif isinstance(condition, dict):
+            if not all(_match_operator(metadata.get(key), op, operand, key in metadata) for op, operand in condition.items()): return False
+        elif not _match_operator(metadata.get(key), "$eq", condition, key in metadata):
+            return False
+    return True
+
+def _match_operator(value, op, operand, present):
+    if op == "$exists": return present == bool(operand)
+    if not present: return op in ("$ne", "$nin")
+    values = value if isinstance(value, list) else [value] # List fields match if any element matches, as in Pinecone
+    if op == "$eq": return operand in values
+    if op == "$ne": return operand not in values
+    if op == "$in": return any(v in operand for v in values)
+    if op == "$nin": return not any(v in operand for v in values)
+    try:
+        if op == "$gt": return any(v > operand for v in values)
+        if op == "$gte": return any(v >= operand for v in values)
+        if op == "$lt": return any(v < operand for v in values)
+        if op == "$lte": return any(v <= operand for v in values)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# --- Search over a committed snapshot ---
+def _ranked_candidates(snap, query, top_k):
+    """Yields (rows, scores) blocks, best first: HNSW hits merged with brute force over the rows it does not cover."""
+    hnsw_rows = snap.hnsw_rows if snap.hnsw is not None else 0
+    deleted_in_graph = int(snap.deleted[:hnsw_rows].sum()) if hnsw_rows else 0
+    if hnsw_rows - deleted_in_graph <= 0:
+        yield from _ranked_brute_force(snap, query, top_k)
+        return
+    k = min(hnsw_rows, top_k + deleted_in_graph)
+    labels, distances = snap.hnsw.knn_query(query, k=k)
+    rows = labels[0].astype(np.int64); scores = 1.0 - distances[0] # hnswlib "ip" distance is 1 - dot
+    if snap.rows > hnsw_rows:
+        tail_scores = np.asarray(snap.vectors[hnsw_rows:snap.rows]) @ query
+        rows = np.concatenate([rows, np.arange(hnsw_rows, snap.rows)]); scores = np.concatenate([scores, tail_scores])
+    keep = snap.deleted[rows] == 0
+    yield _top_k(rows[keep], scores[keep], top_k)
+
+def _ranked_brute_force(snap, query, top_k):
+    """Scores every live row; only the best top_k are sorted."""
+    rows = np.flatnonzero(snap.deleted[:snap.rows] == 0)
+    yield _top_k(rows, (np.asarray(snap.vectors[:snap.rows]) @ query)[rows], top_k)
+
+def _ranked_filtered(snap, query, top_k, metadata_filter):
+    """Scores only the live rows the filter selects; only the best top_k are sorted."""
+    rows = np.flatnonzero(_filter_mask(snap, metadata_filter) & (snap.deleted[:snap.rows] == 0))
+    yield _top_k(rows, np.asarray(snap.vectors[rows]) @ query if len(rows) else np.zeros(0, dtype=np.float32), top_k)
+
+def _top_k(rows, scores, top_k):
+    """(rows, scores) of the best top_k rows, best first."""
+    order = np.argpartition(-scores, top_k - 1)[:top_k] if 0 < top_k < len(rows) else np.arange(len(rows))
+    order = order[np.argsort(-scores[order])]
+    return rows[order], scores[order]
+
+# --- Metadata columns for filtered queries ---
+def _filter_mask(snap, metadata_filter):
+    """Row mask for a Pinecone metadata filter, with the semantics of matches_filter()."""
+    mask = np.ones(snap.rows, dtype=bool)
+    for key, condition in metadata_filter.items():
+        if key == "$and":
+            for sub_filter in condition: mask &= _filter_mask(snap, sub_filter)
+        elif key == "$or":
+            any_mask = np.zeros(snap.rows, dtype=bool)
+            for sub_filter in condition: any_mask |= _filter_mask(snap, sub_filter)
+            mask &= any_mask
+        else:
+            for op, operand in (condition.items() if isinstance(condition, dict) else [("$eq", condition)]):
+                mask &= _operator_mask(snap, key, op, operand)
+    return mask
+
+def _operator_mask(snap, key, op, operand):
+    present, rows_by_value = _field_column(snap, key)
+    if op == "$exists": return present.copy() if operand else ~present
+    if op in ("$eq", "$ne", "$in", "$nin"):
+        wanted = [operand] if op in ("$eq", "$ne") else operand
+        values = [v for v in rows_by_value if v in wanted]
+    elif op in ("$gt", "$gte", "$lt", "$lte"):
+        values = [v for v in rows_by_value if _compare(v, op, operand)]
+    else:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    mask = np.zeros(snap.rows, dtype=bool)
+    for value in values: mask[rows_by_value[value]] = True
+    return ~mask if op in ("$ne", "$nin") else mask # Rows without the field match $ne/$nin, as in matches_filter()
+
+def _compare(value, op, operand):
+    try:
+        if op == "$gt": return value > operand
+        if op == "$gte": return value >= operand
+        if op == "$lt": return value < operand
+        return value <= operand
+    except TypeError:
+        return False
+
+def _field_column(snap, field):
+    """(present mask, {value: rows}) for one metadata field; list fields index every element. Built once per snapshot."""
+    with snap.columns_lock:
+        column = snap.columns.get(field)
+        if column is not None: return column
+        present = np.zeros(snap.rows, dtype=bool)
+        rows_by_value = {}
+        with snap.read_lock:
+            snap.rows_file.seek(0)
+            for row in range(snap.rows):
+                metadata = json.loads(snap.rows_file.readline())["metadata"]
+                if field not in metadata: continue
+                present[row] = True
+                value = metadata[field]
+                for v in (value if isinstance(value, list) else [value]):
+                    try: rows_by_value.setdefault(v, []).append(row)
+                    except TypeError: pass # Unhashable (nested) values cannot be filtered on
+        column = snap.columns[field] = (present, {v: np.asarray(rows, dtype=np.int64) for v, rows in rows_by_value.items()})
+        return column
+
+def _read_row(snap, row):
+    start = int(snap.offsets[row])
+    end = int(snap.offsets[row + 1]) if row + 1 < snap.rows else snap.rows_bytes
+    if hasattr(os, "pread"): line = os.pread(snap.rows_file.fileno(), end - start, start)
+    else:
+        with snap.read_lock: snap.rows_file.seek(start); line = snap.rows_file.read(end - start)
+    return json.loads(line)
+
+
+class LocalVectorIndex:
+    """Pinecone-compatible (upsert/delete/query/describe_index_stats) vector index persisted under root_dir."""
+
+    def __init__(self, root_dir=LOCAL_VECTOR_STORE_DIR):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._paths = {name: os.path.join(root_dir, name) for name in
+                       ("vectors.f32", "rows.jsonl", "offsets.i64", "deleted.u8", "state.json", "hnsw.bin")}
+        self._state_mtime = None
+        self._state = {"dim": None, "rows": 0, "rows_bytes": 0, "hnsw_rows": 0, "version": None}
+        self._snapshot = None
+        self._id_rows = None # id -> row, built only when the index is written to
+        self._refresh(force=True)
+
+    # --- Pinecone-compatible API ---
+    def upsert(self, vectors, **_kwargs):
+        """Adds or replaces (id, values, metadata) vectors. Durable when this returns."""
+        vectors = [tuple(v) if not isinstance(v, dict) else (v["id"], v["values"], v.get("metadata", {})) for v in vectors]
+        if not vectors: return {"upserted_count": 0}
+        with self._lock:
+            self._prepare_write()
+            values = _normalize([v[1] for v in vectors])
+            if self._state["dim"] is None: self._state["dim"] = int(values.shape[1])
+            elif values.shape[1] != self._state["dim"]:
+                raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self._state['dim']}.")
+            start_row = self._state["rows"]
+            deleted = self._load_deleted_for_write(start_row + len(vectors))
+            offsets = []
+            with open(self._paths["rows.jsonl"], "ab") as rows_file:
+                offset = rows_file.tell()
+                for row, (vector_id, _, metadata) in enumerate(vectors, start_row):
+                    previous_row = self._id_rows.get(vector_id)
+                    if previous_row is not None: deleted[previous_row] = 1
+                    self._id_rows[vector_id] = row
+                    line = (json.dumps({"id": vector_id, "metadata": metadata or {}}, ensure_ascii=False) + "\n").encode("utf-8")
+                    rows_file.write(line); offsets.append(offset); offset += len(line)
+            with open(self._paths["vectors.f32"], "ab") as f: f.write(values.tobytes())
+            with open(self._paths["offsets.i64"], "ab") as f: f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+            self._write_deleted(deleted)
+            self._commit(rows=start_row + len(vectors), rows_bytes=offset)
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, delete_all=False, **_kwargs):
+        with self._lock:
+            self._prepare_write()
+            if delete_all:
+                self._reset_files()
+                return {}
+            deleted = self._load_deleted_for_write(self._state["rows"])
+            for vector_id in ids or []:
+                row = self._id_rows.pop(vector_id, None)
+                if row is not None: deleted[row] = 1
+            self._write_deleted(deleted)
+            self._commit(rows=self._state["rows"])
+        return {}
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None, **_kwargs):
+        """Returns {"matches": [{"id", "score", "metadata"}]} ordered by cosine similarity."""
+        with self._lock:
+            self._refresh()
+            snap = self._snapshot # Searched without the lock; a concurrent commit swaps in a new snapshot
+        if not snap.rows: return {"matches": []}
+        query = _normalize(vector)
+        ranked = _ranked_filtered(snap, query, top_k, filter) if filter else _ranked_candidates(snap, query, top_k)
+        matches = []
+        for rows, scores in ranked:
+            for row, score in zip(rows, scores):
+                record = _read_row(snap, row)
+                match = {"id": record["id"], "score": float(score)}
+                if include_metadata: match["metadata"] = record["metadata"]
+                matches.append(match)
+                if len(matches) >= top_k: return {"matches": matches}
+        return {"matches": matches}
+
+    def describe_index_stats(self, **_kwargs):
+        with self._lock:
+            self._refresh()
+            alive = self._state["rows"] - int(self._snapshot.deleted.sum())
+            return SimpleNamespace(total_vector_count=alive, dimension=self._state["dim"], rows=self._state["rows"],
+                                   hnsw_rows=self._state["hnsw_rows"], version=self._state["version"])
+
+    def flush(self):
+        """Compacts away tombstones when they pile up and (re)builds the HNSW graph if hnswlib is available."""
+        with self._lock:
+            self._refresh(force=True)
+            rows = self._state["rows"]
+            if not rows: return
+            deleted_count = int(self._snapshot.deleted.sum())
+            if deleted_count / rows >= COMPACT_DELETED_FRACTION: self._compact(); rows = self._state["rows"]
+            if hnswlib is None or rows < HNSW_MIN_ROWS or rows == self._state["hnsw_rows"]: return
+            started = time.perf_counter()
+            graph = hnswlib.Index(space="ip", dim=self._state["dim"])
+            graph.init_index(max_elements=rows, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            graph.add_items(np.asarray(self._snapshot.vectors[:rows]), np.arange(rows))
+            tmp_path = self._paths["hnsw.bin"] + ".tmp"
+            graph.save_index(tmp_path)
+            os.replace(tmp_path, self._paths["hnsw.bin"])
+            self._commit(rows=rows, hnsw_rows=rows)
+            logging.info(f"[local_vector_store] Built HNSW graph over {rows} rows in {time.perf_counter() - started:.1f}s.")
+
+    # --- Persistence helpers (caller holds self._lock) ---
+    def _refresh(self, force=False):
+        """Re-opens the memory maps if another process (or this one) committed since the last look."""
+        try: mtime = os.stat(self._paths["state.json"]).st_mtime_ns
+        except FileNotFoundError: mtime = None
+        if not force and mtime == self._state_mtime: return
+        self._state_mtime = mtime
+        if mtime is not None:
+            with open(self._paths["state.json"], "r", encoding="utf-8") as f: self._state = json.load(f)
+        rows, dim = self._state["rows"], self._state["dim"]
+        snap = SimpleNamespace(rows=rows, hnsw_rows=0, rows_bytes=self._state.get("rows_bytes", 0), hnsw=None, rows_file=None,
+                               read_lock=threading.Lock(), columns={}, columns_lock=threading.Lock(), vectors=np.zeros((0, dim or 0), dtype=np.float32),
+                               offsets=np.zeros(0, dtype=np.int64), deleted=np.zeros(0, dtype=np.uint8))
+        if rows:
+            snap.vectors = np.memmap(self._paths["vectors.f32"], dtype=np.float32, mode="r", shape=(rows, dim))
+            snap.offsets = np.memmap(self._paths["offsets.i64"], dtype=np.int64, mode="r", shape=(rows,))
+            snap.deleted = np.fromfile(self._paths["deleted.u8"], dtype=np.uint8, count=rows)
+            snap.rows_file = open(self._paths["rows.jsonl"], "rb") # Closed when the snapshot is garbage collected
+            if hnswlib is not None and self._state["hnsw_rows"] and os.path.exists(self._paths["hnsw.bin"]):
+                try:
+                    snap.hnsw = hnswlib.Index(space="ip", dim=dim)
+                    snap.hnsw.load_index(self._paths["hnsw.bin"], max_elements=self._state["hnsw_rows"])
+                    snap.hnsw.set_ef(HNSW_EF_SEARCH)
+                    snap.hnsw_rows = self._state["hnsw_rows"]
+                except Exception as e:
+                    logging.error(f"[local_vector_store] Could not load HNSW graph, using brute force: {e}")
+                    snap.hnsw = None
+        self._snapshot = snap
+
+    def _prepare_write(self):
+        self._refresh()
+        if self._id_rows is not None: return
+        # Drop anything appended after the last commit (e.g. a crash mid-upsert), then index the live ids
+        rows, dim = self._state["rows"], self._state["dim"]
+        for name, size in (("vectors.f32", rows * (dim or 0) * 4), ("offsets.i64", rows * 8), ("deleted.u8", rows)):
+            if os.path.exists(self._paths[name]) and os.path.getsize(self._paths[name]) > size: os.truncate(self._paths[name], size)
+        rows_bytes = self._state.get("rows_bytes", 0)
+        if os.path.exists(self._paths["rows.jsonl"]) and os.path.getsize(self._paths["rows.jsonl"]) > rows_bytes:
+            os.truncate(self._paths["rows.jsonl"], rows_bytes)
+        self._id_rows = {}
+        if rows:
+            with open(self._paths["rows.jsonl"], "rb") as rows_file:
+                for row, line in enumerate(rows_file):
+                    if not self._snapshot.deleted[row]: self._id_rows[json.loads(line)["id"]] = row
+
+    def _load_deleted_for_write(self, rows):
+        deleted = np.zeros(rows, dtype=np.uint8)
+        deleted[:len(self._snapshot.deleted)] = self._snapshot.deleted
+        return deleted
+
+    def _write_deleted(self, deleted):
+        tmp_path = self._paths["deleted.u8"] + ".tmp"
+        deleted.tofile(tmp_path)
+        os.replace(tmp_path, self._paths["deleted.u8"])
+
+    def _commit(self, rows, hnsw_rows=None, rows_bytes=None):
+        state = dict(self._state, rows=rows, version=uuid.uuid4().hex[:12])
+        if hnsw_rows is not None: state["hnsw_rows"] = hnsw_rows
+        if rows_bytes is not None: state["rows_bytes"] = rows_bytes
+        tmp_path = self._paths["state.json"] + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: json.dump(state, f)
+        os.replace(tmp_path, self._paths["state.json"])
+        self._refresh(force=True)
+
+    def _reset_files(self):
+        for name in ("vectors.f32", "rows.jsonl", "offsets.i64", "deleted.u8", "hnsw.bin"):
+            if os.path.exists(self._paths[name]): os.remove(self._paths[name])
+        self._id_rows = {}
+        self._commit(rows=0, hnsw_rows=0, rows_bytes=0)
+
+    def _compact(self):
+        """Rewrites the files without tombstoned rows (new files are swapped in, so open readers keep the old ones)."""
+        rows = self._state["rows"]
+        alive_rows = np.flatnonzero(self._snapshot.deleted[:rows] == 0)
+        tmp = {name: self._paths[name] + ".compact" for name in ("vectors.f32", "rows.jsonl", "offsets.i64", "deleted.u8")}
+        self._id_rows = {}
+        with open(self._paths["rows.jsonl"], "rb") as src, open(tmp["rows.jsonl"], "wb") as rows_out, \
+             open(tmp["vectors.f32"], "wb") as vectors_out:
+            offsets = []
+            for new_row, row in enumerate(alive_rows):
+                src.seek(int(self._snapshot.offsets[row])); line = src.readline()
+                offsets.append(rows_out.tell()); rows_out.write(line)
+                self._id_rows[json.loads(line)["id"]] = new_row
+            rows_bytes = rows_out.tell()
+            for start in range(0, len(alive_rows), COMPACT_BLOCK_ROWS):
+                vectors_out.write(np.asarray(self._snapshot.vectors[alive_rows[start:start + COMPACT_BLOCK_ROWS]]).tobytes())
+        np.asarray(offsets, dtype=np.int64).tofile(tmp["offsets.i64"])
+        np.zeros(len(alive_rows), dtype=np.uint8).tofile(tmp["deleted.u8"])
+        for name, path in tmp.items(): os.replace(path, self._paths[name])
+        if os.path.exists(self._paths["hnsw.bin"]): os.remove(self._paths["hnsw.bin"])
+        self._commit(rows=len(alive_rows), hnsw_rows=0, rows_bytes=rows_bytes)
+        logging.info(f"[local_vector_store] Compacted {rows} rows to {len(alive_rows)}.")
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain VectorStore over a LocalVectorIndex; Documents use metadata[text_key] as page_content, like LangchainPinecone."""
+
+    def __init__(self, index, embedding, text_key="chunk_text"):
+        self.index = index
+        self.embedding = embedding
+        self.text_key = text_key
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = self.embedding.embed_documents(texts)
+        self.index.upsert([(vector_id, vector, {**metadata, self.text_key: text})
+                           for vector_id, vector, metadata, text in zip(ids, vectors, metadatas, texts)])
+        return ids
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        results = []
+        for match in self.index.query(vector=embedding, top_k=k, include_metadata=True, filter=filter)["matches"]:
+            metadata = dict(match["metadata"])
+            text = metadata.pop(self.text_key, "")
+            results.append((Document(page_content=text, metadata=metadata), match["score"]))
+        return results
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _score in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _score in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0 # Cosine similarity -> [0, 1]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, root_dir=LOCAL_VECTOR_STORE_DIR, **kwargs):
+        store = cls(LocalVectorIndex(root_dir), embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
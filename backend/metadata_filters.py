@@ -0,0 +1,130 @@
+# backend/metadata_filters.py
+"""
+Filterable chunk metadata and the query-time filters built on it.
+
+index.py stores these normalised fields next to the scraped ones so filters can be pushed down into the
+vector store query (Pinecone filter syntax, which local_vector_store.py and lexical_index.py also understand):
+    source            "rbi" | "incometax" | "other", from the document URL
+    publish_day       publish date as a YYYYMMDD integer (Pinecone range operators only work on numbers)
+    notification_ids  canonical notification/circular numbers, e.g. ["15/2024", "rbi/2024-25/12"]
+
+Vectors indexed before these fields existed do not have them, and filtered queries cannot match such vectors.
+index.py hashes each document together with its filter_metadata(). Adding a field or changing how one is derived
+therefore changes every document hash, so the next index.py run re-embeds and re-upserts the whole corpus,
+including the lexical index. No manual full re-index is needed, but expect that run to take as long as a first run.
+"""
+
+import logging
+import re
+from datetime import datetime
+
+SOURCES = ("rbi", "incometax", "other")
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y")
+# RBI circular references ("RBI/2024-25/12") and Income Tax notification numbers ("15/2024"). In free text
+# (queries, document headers) the latter only count after a "Notification"/"No." prefix, so year ranges such as
+# "2023/2024" and dates such as 12/03/2024 are not taken for notification numbers.
+RBI_REFERENCE = r"\brbi/\d{4}-\d{2}/\d+\b"
+NOTIFICATION_NUMBER = r"\d{1,3}/(?:19|20)\d{2}(?![\w/-])" # At most 3 digits before the slash: never a year
+NOTIFICATION_PATTERN = re.compile(rf"{RBI_REFERENCE}|\b(?:notification|notfn|no)\b\.?\s*(?:no\b\.?\s*)?[:-]?\s*({NOTIFICATION_NUMBER})", re.IGNORECASE)
+# A field that holds nothing but a notification number (the scraped notification_number, request filters)
+BARE_NOTIFICATION_PATTERN = re.compile(rf"{RBI_REFERENCE}|(?<![\w/.-]){NOTIFICATION_NUMBER}", re.IGNORECASE)
+NOTIFICATION_HEADER_CHARS = 500 # A circular's own reference number is printed at the top of its first page
+
+
+# --- Index time ---
+def parse_publish_day(date_text):
+    """Returns the date as a YYYYMMDD integer, or None if it is empty or in an unknown format."""
+    date_text = str(date_text or "").strip()
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(date_text, date_format)
+        except ValueError:
+            continue
+        return parsed.year * 10000 + parsed.month * 100 + parsed.day
+    return None
+
+
+def detect_source(url):
+    url = (url or "").lower()
+    if "rbi.org.in" in url: return "rbi"
+    if "incometax" in url: return "incometax"
+    return "other"
+
+
+def extract_notification_ids(text, bare=False):
+    """
+    Canonical (lowercased, de-duplicated, in order of appearance) notification numbers found in text.
+    bare=True also accepts unprefixed "15/2024" numbers, for fields that only hold notification numbers.
+    """
+    pattern = BARE_NOTIFICATION_PATTERN if bare else NOTIFICATION_PATTERN
+    return list(dict.fromkeys(match.group(match.lastindex or 0).lower() for match in pattern.finditer(text or "")))
+
+
+def filter_metadata(url, publish_date, notification_number, content):
+    """The filterable fields for one source document; empty ones are left out (Pinecone rejects null metadata)."""
+    notification_number = str(notification_number or "")
+    notification_ids = extract_notification_ids(notification_number, bare=True) or ([notification_number.strip().lower()] if notification_number.strip() else [])
+    notification_ids += [i for i in extract_notification_ids(content[:NOTIFICATION_HEADER_CHARS])[:1] if i not in notification_ids]
+    metadata = {"source": detect_source(url), "publish_day": parse_publish_day(publish_date), "notification_ids": notification_ids}
+    return {key: value for key, value in metadata.items() if value}
+
+
+# --- Query time ---
+def build_metadata_filter(filters):
+    """
+    Turns the "filters" object of a query request into a vector store filter (None when empty):
+        {"date_from": "2024-01-01", "date_to": "2024-12-31", "source": "rbi" | [...], "notification_number": "15/2024" | [...]}
+    Raises ValueError for unknown keys or values, which the endpoints report as 400.
+    """
+    if not filters: return None
+    if not isinstance(filters, dict): raise ValueError("filters must be an object")
+    unknown = set(filters) - {"date_from", "date_to", "source", "notification_number"}
+    if unknown: raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+    clauses = []
+    day_range = {}
+    for key, op in (("date_from", "$gte"), ("date_to", "$lte")):
+        if filters.get(key):
+            day = parse_publish_day(str(filters[key]))
+            if day is None: raise ValueError(f"{key} must be a date such as 2024-03-31")
+            day_range[op] = day
+    if day_range: clauses.append({"publish_day": day_range})
+    if filters.get("source"):
+        sources = [str(s).lower() for s in _as_list(filters["source"])]
+        if not set(sources) <= set(SOURCES): raise ValueError(f"source must be one of: {', '.join(SOURCES)}")
+        clauses.append({"source": {"$in": sources}})
+    if filters.get("notification_number"):
+        notification_ids = []
+        for number in _as_list(filters["notification_number"]):
+            notification_ids += extract_notification_ids(str(number), bare=True) or [str(number).strip().lower()]
+        clauses.append({"notification_ids": {"$in": notification_ids}})
+    return combine_filters(*clauses)
+
+
+def detect_query_filter(query, metadata_filter=None):
+    """A notification_ids filter for notification numbers mentioned in the query, unless the request already filters on them."""
+    if "notification_ids" in _filter_fields(metadata_filter): return None
+    notification_ids = extract_notification_ids(query)
+    if not notification_ids: return None
+    logging.info(f"[metadata_filters.py] Query mentions notification(s) {notification_ids}; filtering retrieval to them.")
+    return {"notification_ids": {"$in": notification_ids}}
+
+
+def combine_filters(*filters):
+    filters = [f for f in filters if f]
+    if not filters: return None
+    return filters[0] if len(filters) == 1 else {"$and": filters}
+
+
+def _filter_fields(metadata_filter):
+    """Metadata field names a filter tests, including inside $and/$or."""
+    fields = set()
+    for key, value in (metadata_filter or {}).items():
+        if key in ("$and", "$or"):
+            for sub_filter in value: fields |= _filter_fields(sub_filter)
+        else:
+            fields.add(key)
+    return fields
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
@@ -0,0 +1,280 @@
+# backend/metrics.py
+"""
+Per-stage latency metrics for the query pipeline, served in the Prometheus text format on /metrics.
+
+Each query gets a RequestTimer. `with timer.stage("retrieval"):` blocks feed the ragfin_stage_seconds
+histogram and the request's own breakdown, which the endpoints return as a Server-Timing header (or in
+the SSE "done" event) and log as one line. No client library: a histogram is a fixed bucket array per
+label set behind one lock.
+
+gunicorn runs several workers and a scrape reaches only one of them, so every process also writes its
+series to METRICS_DIR and /metrics sums the files of all live workers. A background thread writes the
+snapshot within METRICS_FLUSH_SECONDS of any new observation (so an idle worker's last requests are not
+lost), and again at exit. Set METRICS_DIR="" to report per process only.
+
+Snapshot files are named after the worker's PID and, where /proc exists, its start time. A file left by a
+dead worker is deleted at the next merge even if a new process has since been given the same PID.
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_DIR
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_FLUSH_SECONDS = 1.0
+
+REGISTRY = []
+_lock = threading.Lock()
+_flush_lock = threading.Lock() # Serialises snapshot writes so an older snapshot never overwrites a newer one
+_dirty = False # Observations not yet written to METRICS_DIR (guarded by _lock)
+_flusher_pid = None # Process whose flush thread is running (threads do not survive a fork)
+_snapshot_name = (None, None) # (pid, snapshot file name) of this process, recomputed after a fork
+# Checking other workers' PIDs with os.kill(pid, 0) is only safe on POSIX (signal 0 is CTRL_C_EVENT on Windows)
+_shared_dir = METRICS_DIR if METRICS_DIR and os.name == "posix" else None
+
+
+# --- Metric Types ---
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.values = {} # label values tuple -> float
+        REGISTRY.append(self)
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock: self.values[key] = self.values.get(key, 0.0) + amount
+        _mark_dirty()
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def lines(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {value:g}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, tuple(labelnames), tuple(buckets)
+        self.values = {} # label values tuple -> [count per bucket (non-cumulative)..., count above last bucket, sum]
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            state = self.values.get(key)
+            if state is None: state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+        _mark_dirty()
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def lines(self, values):
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {state[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+def _labels(names, values):
+    if not names: return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+# --- Query Pipeline Metrics ---
+REQUEST_SECONDS = Histogram("ragfin_request_seconds", "End-to-end query handling time.", ("endpoint", "status"))
+REQUESTS_TOTAL = Counter("ragfin_requests_total", "Queries handled.", ("endpoint", "status"))
+STAGE_SECONDS = Histogram("ragfin_stage_seconds", "Time spent in each query pipeline stage.", ("stage",))
+ANSWER_CACHE_LOOKUPS = Counter("ragfin_answer_cache_lookups_total", "Semantic answer cache lookups.", ("result",))
+
+
+class RequestTimer:
+    """Times the stages of one query. Stages may run concurrently (retrieval and document search do)."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.stages = {} # stage -> seconds, in the order stages first finished
+        self.total = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock: self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+    def finish(self, status="ok"):
+        self.total = time.perf_counter() - self._started
+        REQUEST_SECONDS.observe(self.total, endpoint=self.endpoint, status=status)
+        REQUESTS_TOTAL.inc(endpoint=self.endpoint, status=status)
+        logging.info(f"[metrics] {self.endpoint} {status} in {self.total * 1000:.0f} ms: {self.breakdown()}")
+
+    def breakdown(self):
+        """{stage: milliseconds} plus the total once finished."""
+        with self._lock: timings = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        if self.total is not None: timings["total"] = round(self.total * 1000, 1)
+        return timings
+
+    def server_timing(self):
+        """Server-Timing header value, e.g. 'embed;dur=12.3, retrieval;dur=85.0, total;dur=910.2'."""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.breakdown().items())
+
+
+# --- Exposition ---
+def render_metrics():
+    """All metrics in the Prometheus text format, summed over the live worker processes."""
+    merged = _write_snapshot() if _shared_dir else _snapshot()
+    if _shared_dir:
+        for pid, snapshot in _other_worker_snapshots():
+            for metric in REGISTRY:
+                values = merged[metric.name]
+                for key, value in snapshot.get(metric.name, []):
+                    key = tuple(key)
+                    values[key] = metric.merge(values[key], value) if key in values else value
+    lines = []
+    for metric in REGISTRY:
+        lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+        lines += metric.lines(merged[metric.name])
+    return "\n".join(lines) + "\n"
+
+
+def _snapshot():
+    with _lock: return _snapshot_locked()
+
+
+def _snapshot_locked():
+    return {metric.name: {key: (list(value) if isinstance(value, list) else value) for key, value in metric.values.items()} for metric in REGISTRY}
+
+
+def _mark_dirty():
+    """Notes a new observation and starts this process's flush thread on first use."""
+    global _dirty, _flusher_pid
+    if not _shared_dir: return
+    with _lock:
+        _dirty = True
+        start_flusher = _flusher_pid != os.getpid()
+        if start_flusher: _flusher_pid = os.getpid()
+    if start_flusher: threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        _flush_if_dirty()
+
+
+def _flush_if_dirty():
+    if _dirty: _write_snapshot()
+
+
+def _write_snapshot():
+    """Writes this process's current series to METRICS_DIR and returns them."""
+    global _dirty
+    with _flush_lock:
+        with _lock:
+            _dirty = False
+            snapshot = _snapshot_locked()
+        _flush(snapshot)
+    return snapshot
+
+
+atexit.register(_flush_if_dirty)
+
+
+def _flush(snapshot):
+    try:
+        os.makedirs(_shared_dir, exist_ok=True)
+        path = os.path.join(_shared_dir, _own_snapshot_name())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({name: [[list(key), value] for key, value in values.items()] for name, values in snapshot.items()}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"[metrics] Could not write metrics snapshot to {_shared_dir}: {e}")
+
+
+def _process_start_time(pid):
+    """Start time of a process in clock ticks since boot (Linux /proc), or None where it cannot be read."""
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as f: stat = f.read()
+        return int(stat.rsplit(")", 1)[1].split()[19]) # Field 22; the command name in parentheses may contain spaces
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _snapshot_filename(pid, start_time):
+    return f"metrics-{pid}.json" if start_time is None else f"metrics-{pid}-{start_time}.json"
+
+
+def _parse_snapshot_filename(filename):
+    """(pid, start time or None) for a snapshot file name, or None for other files."""
+    if not (filename.startswith("metrics-") and filename.endswith(".json")): return None
+    pid, _, start_time = filename[len("metrics-"):-len(".json")].partition("-")
+    try: return int(pid), int(start_time) if start_time else None
+    except ValueError: return None
+
+
+def _own_snapshot_name():
+    global _snapshot_name
+    pid = os.getpid()
+    if _snapshot_name[0] != pid: _snapshot_name = (pid, _snapshot_filename(pid, _process_start_time(pid)))
+    return _snapshot_name[1]
+
+
+def _other_worker_snapshots():
+    """Yields (pid, snapshot) for the other live workers, deleting the files of exited ones."""
+    own_name = _own_snapshot_name()
+    for filename in os.listdir(_shared_dir):
+        parsed = _parse_snapshot_filename(filename)
+        if parsed is None or filename == own_name: continue
+        pid, start_time = parsed
+        path = os.path.join(_shared_dir, filename)
+        if not _is_running(pid, start_time):
+            try: os.remove(path)
+            except OSError: pass
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                yield pid, json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"[metrics] Skipping unreadable metrics snapshot {path}: {e}")
+
+
+def _is_running(pid, start_time):
+    """Whether the worker that wrote a snapshot still runs: its PID exists and, if recorded, has the same start time."""
+    if pid == os.getpid(): return False # An earlier process that had this PID
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Alive, owned by another user
+    return start_time is None or _process_start_time(pid) in (None, start_time)
@@ -1,10 +1,19 @@
-from groq import Groq
+from groq import Groq, AsyncGroq
 from langchain.prompts import PromptTemplate
 from config import GROQ_API_KEY, GROQ_MODEL
 
+# Fallback answers returned instead of raising; callers compare against these to avoid caching them
+LLM_EMPTY_RESPONSE = "I apologize, but I encountered an issue generating a response. Please try again."
+LLM_ERROR_RESPONSE = "I'm sorry, but I encountered an error while processing your request. Please check the server logs or try again later."
+
+
+class LLMStreamError(RuntimeError):
+    """Raised by the streaming variants when the Groq call fails, possibly after some tokens were already yielded."""
+
 # Instantiate the Groq client using the API key from config
 try:
     client = Groq(api_key=GROQ_API_KEY)
+    async_client = AsyncGroq(api_key=GROQ_API_KEY) # Used by the ASGI app (asgi_app.py)
     print("Groq client initialized successfully.")
 except Exception as e:
     print(f"Error initializing Groq client: {e}")
@@ -41,11 +50,21 @@ User Query: {query}
 
 """
     prompt = PromptTemplate(input_variables=["query", "context"], template=prompt_template)
-    # Ensure context is not overly long for the prompt template limit
-    # (This might need more sophisticated truncation based on model limits)
-    formatted_prompt = prompt.format(query=query, context=context[:15000]) # Truncate context if too long
+    # The context is already packed into CONTEXT_TOKEN_BUDGET tokens by combine_contexts (context_packer.py)
+    formatted_prompt = prompt.format(query=query, context=context)
     return formatted_prompt
 
+def build_messages(prompt: str) -> list:
+    """
+    Wraps the prompt in the chat messages sent to Groq.
+    """
+    return [
+        # System message defines the AI's core persona and constraints
+        {"role": "system", "content": "You are RagFin AI, an expert financial assistant providing informative guidance based on recent Indian financial regulations and data. Focus on accuracy and clarity, citing context where possible. Do not give speculative or definitive investment advice."},
+        # User message contains the detailed instructions and context
+        {"role": "user", "content": prompt}
+    ]
+
 def get_llm_response(prompt: str) -> str:
     """
     Sends the prompt to the Groq LLM and returns the response.
@@ -53,12 +72,7 @@ def get_llm_response(prompt: str) -> str:
     try:
         response = client.chat.completions.create(
             model=GROQ_MODEL, # Ensure this model is available via your Groq API key
-            messages=[
-                # System message defines the AI's core persona and constraints
-                {"role": "system", "content": "You are RagFin AI, an expert financial assistant providing informative guidance based on recent Indian financial regulations and data. Focus on accuracy and clarity, citing context where possible. Do not give speculative or definitive investment advice."},
-                # User message contains the detailed instructions and context
-                {"role": "user", "content": prompt}
-            ],
+            messages=build_messages(prompt),
             temperature=0.3, # Lower temperature for more factual, less creative responses
             # Consider adding max_tokens if needed to control response length
             # max_tokens=1024,
@@ -69,12 +83,85 @@ def get_llm_response(prompt: str) -> str:
              return response.choices[0].message.content.strip()
         else:
              print("Warning: LLM response structure unexpected or empty.")
-             return "I apologize, but I encountered an issue generating a response. Please try again."
+             return LLM_EMPTY_RESPONSE
 
     except Exception as e:
         print(f"Error calling Groq API: {e}")
         # Provide a user-friendly error message
-        return "I'm sorry, but I encountered an error while processing your request. Please check the server logs or try again later."
+        return LLM_ERROR_RESPONSE
+
+def stream_llm_response(prompt: str):
+    """
+    Streams the Groq completion for the prompt, yielding text deltas as they are generated.
+    Yields LLM_EMPTY_RESPONSE if the model produced nothing. Raises LLMStreamError on failure: unlike
+    get_llm_response, a partial answer cannot be replaced by the error text, so callers must not keep it.
+    """
+    try:
+        stream = client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=build_messages(prompt),
+            temperature=0.3,
+            stream=True,
+        )
+        produced_text = False
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta else None
+            if delta:
+                produced_text = True
+                yield delta
+        if not produced_text:
+            print("Warning: LLM stream finished without any content.")
+            yield LLM_EMPTY_RESPONSE
+
+    except Exception as e:
+        print(f"Error streaming from Groq API: {e}")
+        raise LLMStreamError(str(e)) from e
+
+
+async def aget_llm_response(prompt: str) -> str:
+    """
+    Async variant of get_llm_response using the AsyncGroq client.
+    """
+    try:
+        response = await async_client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=build_messages(prompt),
+            temperature=0.3,
+        )
+        if response.choices and response.choices[0].message and response.choices[0].message.content:
+             return response.choices[0].message.content.strip()
+        else:
+             print("Warning: LLM response structure unexpected or empty.")
+             return LLM_EMPTY_RESPONSE
+
+    except Exception as e:
+        print(f"Error calling Groq API: {e}")
+        return LLM_ERROR_RESPONSE
+
+async def astream_llm_response(prompt: str):
+    """
+    Async variant of stream_llm_response; an async generator of text deltas (raises LLMStreamError on failure).
+    """
+    try:
+        stream = await async_client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=build_messages(prompt),
+            temperature=0.3,
+            stream=True,
+        )
+        produced_text = False
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta else None
+            if delta:
+                produced_text = True
+                yield delta
+        if not produced_text:
+            print("Warning: LLM stream finished without any content.")
+            yield LLM_EMPTY_RESPONSE
+
+    except Exception as e:
+        print(f"Error streaming from Groq API: {e}")
+        raise LLMStreamError(str(e)) from e
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+# backend/query_cache.py
+"""
+Semantic answer cache for knowledge-base questions.
+
+Answers are keyed by the (L2-normalised) query embedding. A new question reuses a cached answer
+when its cosine similarity to a cached question is at least the threshold, skipping both the
+Pinecone retrieval and the Groq completion. Entries expire after a TTL, the cache holds at most
+max_entries (least recently used evicted first), and everything is dropped when index.py
+publishes a new index version after upserting chunks.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (QUERY_CACHE_SIMILARITY, QUERY_CACHE_TTL_SECONDS, QUERY_CACHE_MAX_ENTRIES,
+                    INDEX_VERSION_FILE)
+
+VERSION_CHECK_INTERVAL_SECONDS = 5
+
+
+def read_index_version(path=INDEX_VERSION_FILE):
+    """Returns the current index version token, or None if index.py has not published one."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def bump_index_version(path=INDEX_VERSION_FILE):
+    """Publishes a new index version (called by index.py after upserts) so answer caches drop stale entries."""
+    token = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+    logging.info(f"[query_cache] Published index version {token}.")
+    return token
+
+
+class SemanticAnswerCache:
+    """Thread-safe, size-bounded, TTL-expiring answer cache matched by embedding similarity."""
+
+    def __init__(self, threshold=QUERY_CACHE_SIMILARITY, ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+                 max_entries=QUERY_CACHE_MAX_ENTRIES, version_file=INDEX_VERSION_FILE, clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version_file = version_file
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Fixed-capacity embedding matrix; row i belongs to self._slots[i] (None when free)
+        self._matrix = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._created = np.zeros(max_entries, dtype=np.float64) # Clock time each slot was stored
+        self._slots = [None] * max_entries
+        self._lru = OrderedDict() # slot -> None, least recently used first
+        self._index_version = read_index_version(version_file)
+        self._next_version_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, query_embedding):
+        """Returns {"answer", "query", "similarity"} for the closest fresh entry above the threshold, or None."""
+        with self._lock:
+            now = self._clock()
+            self._check_index_version(now)
+            # Expired entries go before the argmax, so a stale near-duplicate cannot hide a fresh match
+            self._evict_expired(now)
+            if not self._lru:
+                self.misses += 1
+                return None
+            similarities = self._matrix @ query_embedding
+            similarities[~self._valid] = -np.inf
+            slot = int(np.argmax(similarities))
+            similarity = float(similarities[slot])
+            entry = self._slots[slot]
+            if similarity < self.threshold or entry is None:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(slot)
+            self.hits += 1
+            return {"answer": entry["answer"], "query": entry["query"], "similarity": similarity}
+
+    def store(self, query, query_embedding, answer):
+        """Caches an answer for the query, replacing a near-duplicate entry if one exists."""
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        with self._lock:
+            now = self._clock()
+            self._check_index_version(now)
+            self._evict_expired(now) # Frees their slots before any live entry is evicted
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, query_embedding.shape[0]), dtype=np.float32)
+            slot = None
+            if self._lru:
+                similarities = self._matrix @ query_embedding
+                similarities[~self._valid] = -np.inf
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold: slot = best
+            if slot is None:
+                free_slots = np.flatnonzero(~self._valid)
+                if len(free_slots): slot = int(free_slots[0])
+                else:
+                    slot, _ = self._lru.popitem(last=False)
+                    self.evictions += 1
+            self._matrix[slot] = query_embedding
+            self._valid[slot] = True
+            self._created[slot] = now
+            self._slots[slot] = {"query": query, "answer": answer}
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def invalidate(self):
+        """Drops every cached answer."""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._lru), "max_entries": self.max_entries, "index_version": self._index_version,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations,
+            }
+
+    # --- Internal helpers (caller holds self._lock) ---
+    def _free(self, slot):
+        self._valid[slot] = False
+        self._slots[slot] = None
+        self._lru.pop(slot, None)
+
+    def _evict_expired(self, now):
+        for slot in np.flatnonzero(self._valid & (now - self._created > self.ttl_seconds)):
+            self._free(int(slot))
+
+    def _clear(self):
+        self._valid[:] = False
+        self._slots = [None] * self.max_entries
+        self._lru.clear()
+        self.invalidations += 1
+
+    def _check_index_version(self, now):
+        # Re-read the version file at most every few seconds; it is a tiny file but still a syscall
+        if now < self._next_version_check:
+            return
+        self._next_version_check = now + VERSION_CHECK_INTERVAL_SECONDS
+        version = read_index_version(self.version_file)
+        if version != self._index_version:
+            logging.info(f"[query_cache] Index version changed ({self._index_version} -> {version}). Clearing answer cache.")
+            self._index_version = version
+            self._clear()
@@ -0,0 +1,208 @@
+# backend/query_pipeline.py
+"""
+Framework-independent pieces of the upload and query pipeline.
+
+Shared by the Flask app (app.py) and the async ASGI app (asgi_app.py) so both serve the same
+contract: text extraction, chunking/embedding, context assembly and chat-history updates.
+Nothing here does network I/O; callers decide whether to run it inline or in an executor.
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# --- File Parsing ---
+import pandas as pd
+import magic # python-magic or python-magic-bin
+
+from embedding_service import embed_texts
+from context_packer import pack_context
+from pdf_extract import iter_pdf_pages, extract_pdf_text
+from config import PDF_EXTRACT_PROCESSES
+
+# --- Constants ---
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+STREAM_SPLIT_WINDOW_CHARS = CHUNK_SIZE * 16 # Text held at once when chunking a stream of pages
+MAX_FILE_SIZE_MB = 10 # Limit upload size
+ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'csv', 'txt'}
+TOP_K_RAG_CHUNKS = 3 # How many chunks to get from Pinecone
+TOP_M_DOC_CHUNKS = 2 # How many chunks to get from user document
+CORS_ORIGINS = ["http://localhost:3000", "YOUR_PRODUCTION_FRONTEND_URL_HERE"] # Adjust origins for production
+
+# --- Text Splitter Initialization ---
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+)
+
+# --- File Helpers ---
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def extract_text_from_pdf(filepath):
+    try: return extract_pdf_text(filepath, PDF_EXTRACT_PROCESSES)[0]
+    except Exception as e: logging.error(f"Error extracting PDF text {filepath}: {e}"); return None
+
+def iter_pdf_text(filepath):
+    """Page texts of a PDF as they are extracted (pdf_extract.py); errors surface while iterating."""
+    for _, text in iter_pdf_pages(filepath, PDF_EXTRACT_PROCESSES): yield text
+
+def extract_text_from_excel(filepath):
+    try:
+        excel_data = pd.read_excel(filepath, sheet_name=None)
+        text = ""
+        for sheet_name, df in excel_data.items():
+            text += f"--- Sheet: {sheet_name} ---\n"
+            try: text += df.to_markdown(index=False) + "\n\n"
+            except ImportError: text += df.to_string(index=False) + "\n\n"
+        return text
+    except Exception as e: logging.error(f"Error extracting Excel text {filepath}: {e}"); return None
+
+def extract_text_from_csv(filepath):
+    try:
+        df = pd.read_csv(filepath)
+        text = "--- CSV Data ---\n"
+        try: text += df.to_markdown(index=False) + "\n\n"
+        except ImportError: text += df.to_string(index=False) + "\n\n"
+        return text
+    except Exception as e: logging.error(f"Error extracting CSV text {filepath}: {e}"); return None
+
+def extract_text_from_txt(filepath):
+    try:
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f: return f.read()
+    except Exception as e: logging.error(f"Error extracting TXT {filepath}: {e}"); return None
+
+def extract_uploaded_text(filepath, filename, stream=False):
+    """
+    Detects the file type and extracts its text.
+    Returns (extracted_text, mime_type, supported); extracted_text is None if extraction failed.
+    With stream=True a PDF's text is an iterator of page texts instead, so chunking can start before
+    the last page is extracted (chunk_and_embed accepts either).
+    """
+    mime_type = magic.from_file(filepath, mime=True); logging.info(f"MIME: {mime_type}")
+    if 'pdf' in mime_type: return (iter_pdf_text(filepath) if stream else extract_text_from_pdf(filepath)), mime_type, True
+    elif 'excel' in mime_type or 'spreadsheetml' in mime_type or filename.endswith('.xlsx'): return extract_text_from_excel(filepath), mime_type, True
+    elif 'csv' in mime_type or filename.endswith('.csv'): return extract_text_from_csv(filepath), mime_type, True
+    elif 'text' in mime_type or filename.endswith('.txt'): return extract_text_from_txt(filepath), mime_type, True
+    return None, mime_type, False
+
+def iter_split_text(pieces, window_chars=STREAM_SPLIT_WINDOW_CHARS):
+    """
+    Chunks a stream of text pieces (e.g. PDF pages) like text_splitter.split_text, holding only about
+    window_chars of text: each window is split, and its last chunk is carried into the next window.
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) < window_chars: continue
+        chunks = text_splitter.split_text(buffer)
+        if len(chunks) < 2: continue
+        yield from chunks[:-1]
+        buffer = buffer[buffer.rfind(chunks[-1]):] # Keep the text after it too (split_text strips whitespace)
+    if buffer: yield from text_splitter.split_text(buffer)
+
+def chunk_and_embed(extracted_text, filename, batch_size=None):
+    """
+    Splits extracted text (a string, or an iterator of page texts) into chunks and embeds them once.
+    Returns (chunks, float32 embedding matrix); no chunks gives ([], None).
+    With batch_size the chunks are encoded in slices of that many as soon as they are split, so concurrent
+    query embeddings get the model in between instead of waiting behind one long encode call.
+    """
+    logging.info(f"Chunking text for {filename}...")
+    chunk_iter = text_splitter.split_text(extracted_text) if isinstance(extracted_text, str) else iter_split_text(extracted_text)
+    text_chunks, embedding_batches = [], []
+    for chunk in chunk_iter:
+        text_chunks.append(chunk)
+        if batch_size and len(text_chunks) % batch_size == 0: embedding_batches.append(embed_texts(text_chunks[-batch_size:]))
+    logging.info(f"Created {len(text_chunks)} chunks.")
+    if not text_chunks: return [], None
+    # Embed all chunks once here so follow-up queries only need to embed the question
+    embedded = sum(len(batch) for batch in embedding_batches)
+    if embedded < len(text_chunks): embedding_batches.append(embed_texts(text_chunks[embedded:]))
+    chunk_embeddings = embedding_batches[0] if len(embedding_batches) == 1 else np.vstack(embedding_batches)
+    logging.info(f"Embedded {len(text_chunks)} chunks (matrix {chunk_embeddings.shape}).")
+    return text_chunks, chunk_embeddings
+
+# --- Context Assembly ---
+def format_rag_context(rag_chunks_docs):
+    """Extracts the chunk texts from retrieved knowledge-base documents."""
+    rag_context_parts = []; rag_source_info = []
+    for i, doc in enumerate(rag_chunks_docs):
+        text = doc.page_content if hasattr(doc, 'page_content') and doc.page_content else doc.metadata.get('chunk_text')
+        if text:
+            rag_context_parts.append(text)
+            filename = doc.metadata.get('source_filename', '?'); chunk_idx = doc.metadata.get('chunk_index', '?')
+            rag_source_info.append(f"{filename}({chunk_idx})")
+        else: logging.warning(f"RAG chunk {i} has no text.")
+    logging.info(f"RAG Context from: {', '.join(rag_source_info) if rag_source_info else 'None'}")
+    return rag_context_parts
+
+def search_session_document(session_id, session_data, query_embedding):
+    """Scores the session's uploaded-document chunks against the query. Returns (top chunk texts, document name)."""
+    doc_context_parts = []; doc_source_info = []
+    doc_filename_for_prompt = "Uploaded Document"
+    if session_data:
+        doc_filename_for_prompt = session_data.get("filename", doc_filename_for_prompt)
+        doc_text_chunks = session_data.get("chunks", [])
+        doc_chunk_embeddings = session_data.get("embeddings")
+        logging.info(f"Found {len(doc_text_chunks)} doc chunks for session {session_id} ({doc_filename_for_prompt}). Searching...")
+        if doc_text_chunks and doc_chunk_embeddings is not None and len(doc_chunk_embeddings) == len(doc_text_chunks):
+            try:
+                similarities = doc_chunk_embeddings @ query_embedding
+                top_m = min(TOP_M_DOC_CHUNKS, len(similarities))
+                top_m_indices = np.argpartition(-similarities, top_m - 1)[:top_m]
+                top_m_indices = top_m_indices[np.argsort(-similarities[top_m_indices])]
+                for idx in top_m_indices:
+                     # Maybe add similarity threshold later: if similarities[idx] > 0.X:
+                     doc_context_parts.append(doc_text_chunks[idx])
+                     doc_source_info.append(f"chunk {idx} (score {similarities[idx]:.3f})")
+                logging.info(f"Doc Context from {doc_filename_for_prompt}: {', '.join(doc_source_info) if doc_source_info else 'None relevant'}")
+            except Exception as emb_e: logging.exception(f"Error comparing doc chunks: {emb_e}")
+        elif doc_text_chunks: logging.warning(f"Doc chunks for session {session_id} have no matching embeddings. Skipping.")
+        else: logging.info(f"No text chunks in store for session {session_id}.")
+    else: logging.info(f"No doc context in store for session {session_id}.")
+    return doc_context_parts, doc_filename_for_prompt
+
+def combine_contexts(rag_context_parts, doc_context_parts, doc_filename_for_prompt):
+    """Packs knowledge-base and uploaded-document chunks into the token budget and joins them into the block passed to build_prompt."""
+    rag_context_parts, doc_context_parts = pack_context(rag_context_parts, doc_context_parts)
+    rag_context = "\n\n".join(rag_context_parts)
+    doc_context = "\n\n".join(doc_context_parts)
+    combined_context = ""
+    if rag_context_parts: combined_context += "Context from Recent Notifications:\n---\n" + rag_context + "\n---\n\n"
+    if doc_context_parts: combined_context += f"Context from User's Document ({doc_filename_for_prompt}):\n---\n" + doc_context + "\n---"
+    if not combined_context: combined_context = "No relevant context found."; logging.warning("No context constructed.")
+    return combined_context
+
+# --- Chat History ---
+def chat_history_update(session_id, user_query, answer):
+    """Returns the MongoDB update (for update_one with upsert=True) appending one user/assistant turn."""
+    now_utc = datetime.now(timezone.utc)
+    message_user = {"role": "user", "content": user_query, "timestamp": now_utc.isoformat()}
+    message_assistant = {"role": "assistant", "content": answer, "timestamp": now_utc.isoformat()}
+    return {
+        "$push": {"messages": {"$each": [message_user, message_assistant]}},
+        "$set": {"last_updated": now_utc},
+        "$setOnInsert": {
+             "session_id": session_id,
+             "title": user_query[:75] + "..." if len(user_query) > 75 else user_query,
+             "created_at": now_utc }}
+
+def serialize_chat(chat_data):
+    """Converts datetime fields of a stored chat document to ISO strings for JSON responses."""
+    if 'messages' in chat_data and isinstance(chat_data['messages'], list):
+         for msg in chat_data['messages']:
+              if isinstance(msg.get('timestamp'), datetime): msg['timestamp'] = msg['timestamp'].isoformat()
+    if isinstance(chat_data.get('created_at'), datetime): chat_data['created_at'] = chat_data['created_at'].isoformat()
+    if isinstance(chat_data.get('last_updated'), datetime): chat_data['last_updated'] = chat_data['last_updated'].isoformat()
+    return chat_data
+
+def sse_event(event, payload):
+    """Formats one server-sent event; payload is JSON so newlines in tokens survive framing."""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
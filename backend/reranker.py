@@ -0,0 +1,97 @@
+# backend/reranker.py
+"""
+Optional cross-encoder rerank stage.
+
+The retriever fetches RERANK_CANDIDATES chunks; a small cross-encoder scores every (query, chunk) pair
+in one batched CPU pass and only the best TOP_K_RAG_CHUNKS go into the prompt. Cross-encoders read the
+query and the chunk together, so they order chunks far better than embedding similarity, which lets the
+prompt stay short without losing the relevant chunk.
+
+Latency is bounded by RERANK_BUDGET_MS: the stage keeps a running per-pair cost estimate and only scores
+as many uncached candidates (best retrieval ranks first) as fit in the budget; the rest keep their
+retrieval order below the scored ones. Scores are cached per (query, chunk text), so repeated and
+follow-up questions over the same chunks cost nothing.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import (RERANK_MODEL, RERANK_BUDGET_MS, RERANK_BATCH_SIZE, RERANK_MAX_LENGTH, RERANK_CACHE_SIZE)
+
+MIN_SCORED_CANDIDATES = 4 # Always score at least this many, even when the cost estimate says otherwise
+INITIAL_PAIR_COST_MS = 5.0 # Per-pair estimate before the first measurement (MiniLM-L6, 256 tokens, one core)
+COST_SMOOTHING = 0.3 # Weight of the newest measurement in the running per-pair cost
+
+
+class CrossEncoderReranker:
+    """Thread-safe reranker around one sentence-transformers CrossEncoder per process."""
+
+    def __init__(self, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE,
+                 max_length=RERANK_MAX_LENGTH, cache_size=RERANK_CACHE_SIZE):
+        from sentence_transformers import CrossEncoder
+        logging.info(f"[reranker] Loading cross-encoder: {model_name}...")
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._pair_cost_ms = INITIAL_PAIR_COST_MS
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._model_lock = threading.Lock() # One pass at a time; concurrent torch passes just fight over the cores
+        logging.info("[reranker] Cross-encoder loaded.")
+
+    def rerank(self, query, documents, top_k):
+        """Returns the top_k documents by cross-encoder score. Falls back to retrieval order on errors."""
+        if len(documents) <= 1: return documents[:top_k]
+        started = time.perf_counter()
+        query_key = " ".join(query.lower().split())
+        keys = [(query_key, _text_key(doc.page_content)) for doc in documents]
+        scores = self._cached_scores(keys)
+        uncached = [i for i, score in enumerate(scores) if score is None]
+        affordable = max(MIN_SCORED_CANDIDATES, int(self.budget_ms / self._pair_cost_ms))
+        to_score = uncached[:affordable]
+        if to_score:
+            try:
+                new_scores = self._predict([(query, documents[i].page_content) for i in to_score])
+            except Exception as e:
+                logging.error(f"[reranker] Cross-encoder scoring failed, keeping retrieval order: {e}")
+                return documents[:top_k]
+            for i, score in zip(to_score, new_scores): scores[i] = score
+            self._store_scores([(keys[i], scores[i]) for i in to_score])
+        # Scored candidates by score, then unscored ones in retrieval order
+        order = sorted((i for i, score in enumerate(scores) if score is not None), key=lambda i: scores[i], reverse=True)
+        order += [i for i, score in enumerate(scores) if score is None]
+        logging.info(f"[reranker] Reranked {len(documents)} candidates ({len(to_score)} scored, {len(documents) - len(uncached)} cached, "
+                     f"{len(uncached) - len(to_score)} over budget) in {(time.perf_counter() - started) * 1000:.0f} ms.")
+        return [documents[i] for i in order[:top_k]]
+
+    def _predict(self, pairs):
+        with self._model_lock:
+            started = time.perf_counter()
+            scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False, convert_to_numpy=True)
+            pair_cost_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+            self._pair_cost_ms += COST_SMOOTHING * (pair_cost_ms - self._pair_cost_ms)
+        return [float(score) for score in scores]
+
+    def _cached_scores(self, keys):
+        with self._cache_lock:
+            scores = []
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None: self._cache.move_to_end(key)
+                scores.append(score)
+            return scores
+
+    def _store_scores(self, entries):
+        with self._cache_lock:
+            for key, score in entries:
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+
+
+def _text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).digest()
@@ -1,41 +1,61 @@
 import os
-from config import INDEX_NAME, PINECONE_API_KEY, EMBEDDING_MODEL
+import asyncio
+from typing import Any
+from config import (INDEX_NAME, PINECONE_API_KEY, EMBEDDING_MODEL, PINECONE_INDEX_HOST, VECTOR_STORE_BACKEND,
+                    HYBRID_RETRIEVAL, HYBRID_CANDIDATES, HYBRID_RRF_K)
 from langchain_community.vectorstores import Pinecone as LangchainPinecone
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from lexical_index import LexicalIndex
+from metadata_filters import combine_filters
+from embedding_service import get_embedding_model, SharedSentenceTransformerEmbeddings
 from pinecone import Pinecone as BasePinecone
 import logging
 import json # Needed for test block
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_retriever(k_results=5):
-    """Initializes and returns a Langchain retriever for the Pinecone index."""
-    logging.info(f"[retriever.py] Initializing retriever for index '{INDEX_NAME}'...")
+def get_retriever(k_results=5, backend=VECTOR_STORE_BACKEND, hybrid=HYBRID_RETRIEVAL):
+    """
+    Initializes and returns a Langchain retriever for the Pinecone index (or the local index when backend='local').
+    With hybrid retrieval and a lexical index built by index.py, it is a HybridRetriever that fuses BM25 results in.
+    """
+    logging.info(f"[retriever.py] Initializing retriever for {'local index' if backend == 'local' else f'index {INDEX_NAME!r}'}...")
 
-    # --- Initialize Embeddings ---
+    # --- Initialize Embeddings (shared model instance, see embedding_service.py) ---
     try:
-        logging.info(f"[retriever.py] Loading embedding model: {EMBEDDING_MODEL}")
-        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-        logging.info("[retriever.py] Embedding model loaded.")
+        logging.info(f"[retriever.py] Using shared embedding model: {EMBEDDING_MODEL}")
+        get_embedding_model() # Load eagerly so failures surface here, as before
+        embeddings = SharedSentenceTransformerEmbeddings()
+        logging.info("[retriever.py] Embedding model ready.")
     except Exception as e:
         logging.error(f"[retriever.py] Failed to load embedding model: {e}")
         raise
 
-    # --- Initialize Langchain Pinecone Vector Store ---
+    # --- Initialize Langchain Vector Store ---
     try:
-        logging.info(f"[retriever.py] Connecting to Langchain Pinecone vector store for index: {INDEX_NAME}")
-        # Explicitly tell Langchain to use 'chunk_text' from metadata as the Document's page_content
-        vector_store = LangchainPinecone.from_existing_index(
-            index_name=INDEX_NAME,
-            embedding=embeddings,
-            text_key='chunk_text' # <--- IMPORTANT: Use the key where chunk text is stored
-        )
-        logging.info("[retriever.py] Langchain Pinecone vector store connected.")
+        if backend == "local":
+            from local_vector_store import LocalVectorIndex, LocalVectorStore
+            vector_store = LocalVectorStore(LocalVectorIndex(), embeddings, text_key='chunk_text')
+            logging.info(f"[retriever.py] Local vector store opened ({vector_store.index.describe_index_stats().total_vector_count} vectors).")
+        else:
+            logging.info(f"[retriever.py] Connecting to Langchain Pinecone vector store for index: {INDEX_NAME}")
+            # Explicitly tell Langchain to use 'chunk_text' from metadata as the Document's page_content
+            vector_store = LangchainPinecone.from_existing_index(
+                index_name=INDEX_NAME,
+                embedding=embeddings,
+                text_key='chunk_text' # <--- IMPORTANT: Use the key where chunk text is stored
+            )
+            logging.info("[retriever.py] Langchain Pinecone vector store connected.")
     except Exception as e:
-        logging.error(f"[retriever.py] Failed to initialize Langchain Pinecone vector store: {e}")
+        logging.error(f"[retriever.py] Failed to initialize {backend} vector store: {e}")
         raise
 
     # --- Create Retriever ---
+    lexical_index = LexicalIndex.open_existing() if hybrid else None
+    if lexical_index is not None:
+        logging.info(f"[retriever.py] Hybrid retriever created with k={k_results} ({HYBRID_CANDIDATES} dense + {HYBRID_CANDIDATES} BM25 candidates).")
+        return HybridRetriever(vectorstore=vector_store, lexical_index=lexical_index, search_kwargs={"k": k_results})
     try:
         # You might adjust search_type later (e.g., 'mmr' for diversity)
         retriever = vector_store.as_retriever(
@@ -49,6 +69,195 @@ def get_retriever(k_results=5):
         raise
 
 
+def search_by_vector(retriever, query_embedding, query=None, metadata_filter=None, query_filter=None):
+    """
+    Runs the retriever's similarity search with an already computed query embedding, so callers that
+    embedded the query for other purposes do not pay for a second encode. Falls back to retriever.invoke(query)
+    for vector stores without a by-vector search. A HybridRetriever's BM25 results are fused in.
+    metadata_filter (from the request) is pushed down into the search; query_filter (detected in the query
+    text, see metadata_filters.detect_query_filter) narrows it further but is dropped if nothing matches it.
+    """
+    if query_filter:
+        documents = _search_by_vector(retriever, query_embedding, query, combine_filters(metadata_filter, query_filter))
+        if documents: return documents
+        logging.info("[retriever.py] No chunks match the notification numbers in the query; searching without them.")
+    return _search_by_vector(retriever, query_embedding, query, metadata_filter)
+
+
+def _search_by_vector(retriever, query_embedding, query, metadata_filter):
+    k = getattr(retriever, "search_kwargs", {}).get("k", 4)
+    lexical_index = getattr(retriever, "lexical_index", None)
+    if lexical_index is None:
+        return _dense_search_by_vector(retriever, query_embedding, query, k, metadata_filter)
+    n = max(k, retriever.candidates)
+    dense_docs = _dense_search_by_vector(retriever, query_embedding, query, n, metadata_filter)
+    return reciprocal_rank_fusion([dense_docs, lexical_search(lexical_index, query, n, metadata_filter)], k)
+
+
+def _dense_search_by_vector(retriever, query_embedding, query, k, metadata_filter=None):
+    vector_store = getattr(retriever, "vectorstore", None)
+    embedding = query_embedding.tolist() if hasattr(query_embedding, "tolist") else list(query_embedding)
+    if vector_store is not None and hasattr(vector_store, "similarity_search_by_vector_with_score"):
+        return [doc for doc, _score in vector_store.similarity_search_by_vector_with_score(embedding, k=k, filter=metadata_filter)]
+    if vector_store is not None and hasattr(vector_store, "similarity_search_by_vector"):
+        try:
+            return vector_store.similarity_search_by_vector(embedding, k=k, filter=metadata_filter)
+        except NotImplementedError:
+            pass
+    if metadata_filter: logging.warning("[retriever.py] Vector store has no by-vector search; metadata filter not applied.")
+    return retriever.invoke(query)
+
+
+async def asearch(vector_search, query_embedding, k, query=None, metadata_filter=None, query_filter=None):
+    """Async search_by_vector for the ASGI search clients, with the same query_filter fallback."""
+    if query_filter:
+        documents = await vector_search.search(query_embedding, k, combine_filters(metadata_filter, query_filter), query=query)
+        if documents: return documents
+        logging.info("[retriever.py] No chunks match the notification numbers in the query; searching without them.")
+    return await vector_search.search(query_embedding, k, metadata_filter, query=query)
+
+
+# --- Hybrid (BM25 + dense) Retrieval ---
+def matches_to_documents(matches):
+    """Pinecone-style query matches -> LangChain Documents (page_content = metadata['chunk_text'])."""
+    documents = []
+    for match in matches:
+        metadata = dict(match.get("metadata") or {})
+        text = metadata.pop("chunk_text", "")
+        documents.append(Document(page_content=text, metadata=metadata))
+    return documents
+
+
+def lexical_search(lexical_index, query, k, metadata_filter=None):
+    """BM25 search; a failure only costs the lexical half of hybrid retrieval."""
+    if not query: return []
+    try:
+        return matches_to_documents(lexical_index.search(query, k, metadata_filter))
+    except Exception as e:
+        logging.error(f"[retriever.py] Lexical search failed, using dense results only: {e}")
+        return []
+
+
+def _chunk_key(doc):
+    # Pinecone returns numeric metadata as floats, so normalise chunk_index before comparing
+    filename, chunk_index = doc.metadata.get("source_filename"), doc.metadata.get("chunk_index")
+    return (filename, int(chunk_index)) if filename is not None and chunk_index is not None else doc.page_content
+
+
+def reciprocal_rank_fusion(ranked_lists, k, rrf_k=HYBRID_RRF_K):
+    """
+    Merges ranked Document lists by reciprocal rank fusion: each chunk scores sum(1 / (rrf_k + rank)) over the
+    lists it appears in. Rank-based, so BM25 and cosine scores never have to be put on the same scale.
+    """
+    scores, documents = {}, {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, 1):
+            key = _chunk_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Drop-in for the vector store retriever: dense similarity search and BM25 lexical search, each for
+    `candidates` results, fused down to search_kwargs["k"]. Catches exact tokens such as "80C" or "15/2024"
+    that embeddings miss, without raising k (and with it the prompt size).
+    """
+
+    vectorstore: Any
+    lexical_index: Any
+    search_kwargs: dict = {}
+    candidates: int = HYBRID_CANDIDATES
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        k, metadata_filter = self.search_kwargs.get("k", 4), self.search_kwargs.get("filter")
+        dense_docs = self.vectorstore.similarity_search(query, k=max(k, self.candidates), filter=metadata_filter)
+        return reciprocal_rank_fusion([dense_docs, lexical_search(self.lexical_index, query, max(k, self.candidates), metadata_filter)], k)
+
+
+class AsyncPineconeSearch:
+    """
+    Non-blocking Pinecone similarity search for the ASGI app.
+
+    Calls the index's REST data plane (POST /query) through one pooled httpx.AsyncClient, so many
+    queries can wait on Pinecone concurrently without holding a thread each. Results are LangChain
+    Documents shaped like the ones LangchainPinecone returns (page_content = metadata['chunk_text']).
+    """
+
+    API_VERSION = "2024-07"
+
+    def __init__(self, index_host=PINECONE_INDEX_HOST, api_key=PINECONE_API_KEY, timeout_seconds=10.0, max_connections=100):
+        import httpx
+        if not index_host:
+            # One blocking control-plane call at startup to find the index's data-plane host
+            index_host = BasePinecone(api_key=api_key).describe_index(INDEX_NAME).host
+        self._query_url = (index_host if index_host.startswith("http") else f"https://{index_host}") + "/query"
+        self._client = httpx.AsyncClient(
+            timeout=timeout_seconds,
+            headers={"Api-Key": api_key or "", "X-Pinecone-API-Version": self.API_VERSION},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 5 or 1),
+        )
+        logging.info(f"[retriever.py] Async Pinecone search ready ({self._query_url}).")
+
+    async def search(self, query_embedding, k, metadata_filter=None, query=None):
+        payload = {
+            "vector": query_embedding.tolist() if hasattr(query_embedding, "tolist") else list(query_embedding),
+            "topK": k,
+            "includeMetadata": True,
+        }
+        if metadata_filter: payload["filter"] = metadata_filter
+        response = await self._client.post(self._query_url, json=payload)
+        response.raise_for_status()
+        return matches_to_documents(response.json().get("matches", []))
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class AsyncLocalSearch:
+    """AsyncPineconeSearch counterpart for VECTOR_STORE_BACKEND=local; searches the embedded index on a worker thread."""
+
+    def __init__(self):
+        from local_vector_store import LocalVectorIndex
+        self._index = LocalVectorIndex()
+        logging.info(f"[retriever.py] Async local search ready ({self._index.describe_index_stats().total_vector_count} vectors).")
+
+    async def search(self, query_embedding, k, metadata_filter=None, query=None):
+        response = await asyncio.to_thread(self._index.query, vector=query_embedding, top_k=k, include_metadata=True, filter=metadata_filter)
+        return matches_to_documents(response["matches"])
+
+    async def aclose(self):
+        pass
+
+
+class AsyncHybridSearch:
+    """Async HybridRetriever: the dense search and the BM25 search (on a worker thread) run concurrently, then are fused."""
+
+    def __init__(self, dense_search, lexical_index, candidates=HYBRID_CANDIDATES):
+        self._dense_search = dense_search
+        self._lexical_index = lexical_index
+        self._candidates = candidates
+
+    async def search(self, query_embedding, k, metadata_filter=None, query=None):
+        n = max(k, self._candidates)
+        dense_docs, lexical_docs = await asyncio.gather(self._dense_search.search(query_embedding, n, metadata_filter),
+                                                        asyncio.to_thread(lexical_search, self._lexical_index, query, n, metadata_filter))
+        return reciprocal_rank_fusion([dense_docs, lexical_docs], k)
+
+    async def aclose(self):
+        await self._dense_search.aclose()
+
+
+def get_async_search(backend=VECTOR_STORE_BACKEND, hybrid=HYBRID_RETRIEVAL):
+    """Returns the async search client for the configured vector store backend (hybrid when a lexical index exists)."""
+    dense_search = AsyncLocalSearch() if backend == "local" else AsyncPineconeSearch()
+    lexical_index = LexicalIndex.open_existing() if hybrid else None
+    return AsyncHybridSearch(dense_search, lexical_index) if lexical_index is not None else dense_search
+
+
 # --- Test Block (Updated for Chunks) ---
 if __name__ == "__main__":
     print("\n--- Testing retriever.py Standalone (Chunking Aware) ---")
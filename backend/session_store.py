@@ -0,0 +1,418 @@
+# backend/session_store.py
+"""
+Bounded store for uploaded-document chunks and their cached embeddings, keyed by session_id.
+
+Entries are evicted least-recently-used first when the total byte budget (text + embeddings)
+or the session cap is exceeded, and dropped once they have been idle longer than the TTL.
+
+Backends (SESSION_STORE_BACKEND):
+- "memory": per-process dict (default; not shared between gunicorn workers)
+- "disk":   one .json/.npy pair per session under SESSION_STORE_DIR, embeddings memory-mapped;
+            shared by every worker on the same host
+- "gridfs": one GridFS file per session in the existing MongoDB database; shared by all hosts
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+try:
+    import fcntl # POSIX only; on Windows the disk store falls back to per-process locking
+except ImportError:
+    fcntl = None
+
+from config import (SESSION_STORE_MAX_BYTES, SESSION_STORE_TTL_SECONDS, SESSION_STORE_MAX_SESSIONS,
+                    SESSION_STORE_BACKEND, SESSION_STORE_DIR)
+
+
+class SessionTooLargeError(ValueError):
+    """Raised when a single document does not fit in the store's byte budget."""
+
+
+def estimate_entry_bytes(chunks, embeddings) -> int:
+    """Approximate resident size of one entry: the chunk strings plus the embedding matrix."""
+    text_bytes = sum(sys.getsizeof(chunk) for chunk in chunks)
+    embedding_bytes = embeddings.nbytes if embeddings is not None else 0
+    return text_bytes + embedding_bytes
+
+
+class SessionDocumentStore:
+    """Thread-safe in-process LRU store with idle-TTL expiry and a total byte budget."""
+
+    def __init__(self, max_bytes=SESSION_STORE_MAX_BYTES, ttl_seconds=SESSION_STORE_TTL_SECONDS,
+                 max_sessions=SESSION_STORE_MAX_SESSIONS, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._lock = threading.Lock()
+        # session_id -> {"filename", "chunks", "embeddings", "size_bytes", "last_access"}; oldest first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0 # Removed to stay within max_bytes / max_sessions
+        self.expirations = 0 # Removed after ttl_seconds idle
+
+    def put(self, session_id, filename, chunks, embeddings):
+        """Stores (or replaces) the document for a session, evicting older sessions as needed."""
+        size_bytes = estimate_entry_bytes(chunks, embeddings)
+        if size_bytes > self.max_bytes:
+            raise SessionTooLargeError(f"Document needs {size_bytes} bytes; session store budget is {self.max_bytes} bytes.")
+        with self._lock:
+            now = self._clock()
+            self._remove(session_id)
+            self._expire(now)
+            while self._entries and (self._total_bytes + size_bytes > self.max_bytes or len(self._entries) >= self.max_sessions):
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted["size_bytes"]
+                self.evictions += 1
+                logging.info(f"[session_store] Evicted session {evicted_id} (LRU, budget).")
+            self._entries[session_id] = {
+                "filename": filename, "chunks": chunks, "embeddings": embeddings,
+                "size_bytes": size_bytes, "last_access": now,
+            }
+            self._total_bytes += size_bytes
+
+    def get(self, session_id):
+        """Returns {"filename", "chunks", "embeddings"} for the session, or None if absent/expired."""
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(session_id)
+            if entry is not None and now - entry["last_access"] > self.ttl_seconds:
+                self._remove(session_id)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["last_access"] = now
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return {"filename": entry["filename"], "chunks": entry["chunks"], "embeddings": entry["embeddings"]}
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory", "sessions": len(self._entries), "total_bytes": self._total_bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations,
+            }
+
+    # --- Internal helpers (caller holds self._lock) ---
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._total_bytes -= entry["size_bytes"]
+
+    def _expire(self, now):
+        # Entries are kept in access order, so expired ones are all at the front
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if now - oldest["last_access"] <= self.ttl_seconds:
+                break
+            self._remove(oldest_id)
+            self.expirations += 1
+
+
+def _session_key(session_id) -> str:
+    """Filesystem/GridFS-safe fixed-width key for an arbitrary session_id string."""
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+
+
+class DiskSessionDocumentStore:
+    """
+    Store shared by all worker processes on one host.
+
+    Each session is a <key>.json (filename + chunks) and a <key>.npy (embeddings) under root_dir.
+    Embeddings are opened with mmap_mode='r', so workers share the OS page cache instead of each
+    holding a copy. File mtimes carry the last access time used for TTL and LRU eviction.
+    The .json records the inode of its .npy, so a reader that catches a replacement between the two
+    renames reports a miss instead of pairing old chunks with new embeddings.
+    """
+
+    def __init__(self, root_dir=SESSION_STORE_DIR, max_bytes=SESSION_STORE_MAX_BYTES,
+                 ttl_seconds=SESSION_STORE_TTL_SECONDS, max_sessions=SESSION_STORE_MAX_SESSIONS):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock_path = os.path.join(root_dir, ".lock")
+        self._thread_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def put(self, session_id, filename, chunks, embeddings):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        json_path, npy_path = self._paths(session_id)
+        tmp_suffix = f".{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        try:
+            # Write both files under temporary names, then rename them over the old pair, so the session
+            # stays readable throughout. The .npy goes first so a reader that finds the new .json also finds its embeddings.
+            with open(npy_path + tmp_suffix, "wb") as f: np.save(f, embeddings)
+            payload = {"session_id": session_id, "filename": filename, "chunks": chunks, "npy_inode": os.stat(npy_path + tmp_suffix).st_ino}
+            with open(json_path + tmp_suffix, "w", encoding="utf-8") as f: json.dump(payload, f, ensure_ascii=False)
+            size_bytes = os.path.getsize(json_path + tmp_suffix) + os.path.getsize(npy_path + tmp_suffix) # As _scan() counts it
+            if size_bytes > self.max_bytes:
+                raise SessionTooLargeError(f"Document needs {size_bytes} bytes; session store budget is {self.max_bytes} bytes.")
+            with self._locked():
+                self._evict_for(size_bytes, replacing=_session_key(session_id))
+                os.replace(npy_path + tmp_suffix, npy_path)
+                os.replace(json_path + tmp_suffix, json_path)
+        finally:
+            for path in (npy_path + tmp_suffix, json_path + tmp_suffix):
+                try: os.remove(path)
+                except FileNotFoundError: pass
+
+    def get(self, session_id):
+        json_path, npy_path = self._paths(session_id)
+        try:
+            mtime = os.path.getmtime(json_path)
+            if time.time() - mtime > self.ttl_seconds:
+                with self._locked():
+                    self._remove(session_id)
+                    self.expirations += 1
+                    self.misses += 1
+                return None
+            with open(json_path, "r", encoding="utf-8") as f: data = json.load(f)
+            embeddings = np.load(npy_path, mmap_mode="r")
+            npy_inode = os.stat(npy_path).st_ino
+        except (FileNotFoundError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError): logging.warning(f"[session_store] Unreadable entry for session {session_id}: {e}")
+            with self._thread_lock: self.misses += 1
+            return None
+        # Concurrent replace in progress: the .npy was already swapped, the .json read was the old one
+        if data.get("npy_inode", npy_inode) != npy_inode or len(embeddings) != len(data.get("chunks", [])):
+            with self._thread_lock: self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(json_path, (now, now)); os.utime(npy_path, (now, now))
+        except OSError:
+            pass
+        with self._thread_lock: self.hits += 1
+        return {"filename": data.get("filename"), "chunks": data.get("chunks", []), "embeddings": embeddings}
+
+    def delete(self, session_id):
+        with self._locked():
+            self._remove(session_id)
+
+    def stats(self) -> dict:
+        entries = self._scan()
+        return {
+            "backend": "disk", "sessions": len(entries), "total_bytes": sum(size for _, _, size in entries),
+            "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "expirations": self.expirations,
+        }
+
+    # --- Internal helpers ---
+    def _paths(self, session_id):
+        base = os.path.join(self.root_dir, _session_key(session_id))
+        return base + ".json", base + ".npy"
+
+    def _locked(self):
+        return _FileLock(self._lock_path, self._thread_lock)
+
+    def _remove(self, session_id):
+        for path in self._paths(session_id):
+            try: os.remove(path)
+            except FileNotFoundError: pass
+
+    def _scan(self):
+        """Returns [(key, mtime, size_bytes)] for every stored session."""
+        entries = []
+        for name in os.listdir(self.root_dir):
+            if not name.endswith(".json"): continue
+            key = name[:-5]
+            try:
+                json_stat = os.stat(os.path.join(self.root_dir, name))
+                npy_size = os.path.getsize(os.path.join(self.root_dir, key + ".npy"))
+            except FileNotFoundError:
+                continue
+            entries.append((key, json_stat.st_mtime, json_stat.st_size + npy_size))
+        return entries
+
+    def _evict_for(self, incoming_bytes, replacing=None):
+        """
+        Drops expired sessions, then least recently used ones until the new entry fits (caller holds lock).
+        The session being replaced (key `replacing`) is neither counted nor evicted.
+        """
+        now = time.time()
+        entries = sorted((entry for entry in self._scan() if entry[0] != replacing), key=lambda entry: entry[1]) # Oldest access first
+        total_bytes = sum(size for _, _, size in entries)
+        remaining = len(entries)
+        for key, mtime, size in entries:
+            expired = now - mtime > self.ttl_seconds
+            over_budget = total_bytes + incoming_bytes > self.max_bytes or remaining >= self.max_sessions
+            if not expired and not over_budget:
+                break
+            for ext in (".json", ".npy"):
+                try: os.remove(os.path.join(self.root_dir, key + ext))
+                except FileNotFoundError: pass
+            total_bytes -= size
+            remaining -= 1
+            if expired: self.expirations += 1
+            else: self.evictions += 1
+
+
+class _FileLock:
+    """Cross-process exclusive lock on a lock file (flock), plus a thread lock within the process."""
+
+    def __init__(self, path, thread_lock):
+        self._path = path
+        self._thread_lock = thread_lock
+        self._fh = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            self._fh = open(self._path, "a")
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self._thread_lock.release()
+
+
+class GridFSSessionDocumentStore:
+    """
+    Store shared by every worker and host through the existing MongoDB database.
+
+    Each session is one GridFS file named by its session key. The file body is the UTF-8 JSON list
+    of chunks followed by the raw float32 embedding bytes; offsets and shape live in the file
+    metadata. A small in-process cache, validated against the GridFS file id on every read, avoids
+    re-downloading the document for follow-up questions on the same worker.
+    """
+
+    BUCKET_NAME = "session_documents"
+
+    def __init__(self, db, max_bytes=SESSION_STORE_MAX_BYTES, ttl_seconds=SESSION_STORE_TTL_SECONDS,
+                 max_sessions=SESSION_STORE_MAX_SESSIONS, local_cache_bytes=64 * 1024 * 1024):
+        import gridfs # Ships with pymongo
+        self._bucket = gridfs.GridFSBucket(db, bucket_name=self.BUCKET_NAME)
+        self._files = db[f"{self.BUCKET_NAME}.files"]
+        self._files.create_index("filename")
+        self._files.create_index("metadata.last_access")
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._local_cache = SessionDocumentStore(max_bytes=local_cache_bytes, ttl_seconds=ttl_seconds, max_sessions=max_sessions)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def put(self, session_id, filename, chunks, embeddings):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        text_blob = json.dumps(chunks, ensure_ascii=False).encode("utf-8")
+        size_bytes = len(text_blob) + embeddings.nbytes
+        if size_bytes > self.max_bytes:
+            raise SessionTooLargeError(f"Document needs {size_bytes} bytes; session store budget is {self.max_bytes} bytes.")
+        key = _session_key(session_id)
+        self._evict_for(size_bytes)
+        metadata = {
+            "session_id": session_id, "doc_filename": filename, "text_bytes": len(text_blob),
+            "n_chunks": len(chunks), "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "last_access": datetime.now(timezone.utc),
+        }
+        new_id = self._bucket.upload_from_stream(key, text_blob + embeddings.tobytes(), metadata=metadata)
+        # Drop older revisions only after the new one is visible, so readers always find a complete file
+        for old in self._files.find({"filename": key, "_id": {"$ne": new_id}}, {"_id": 1}):
+            self._delete_file(old["_id"])
+
+    def get(self, session_id):
+        key = _session_key(session_id)
+        now = datetime.now(timezone.utc)
+        file_doc = self._files.find_one_and_update(
+            {"filename": key, "metadata.last_access": {"$gte": now - timedelta(seconds=self.ttl_seconds)}},
+            {"$set": {"metadata.last_access": now}},
+            sort=[("uploadDate", -1)],
+        )
+        if file_doc is None:
+            self.misses += 1
+            return None
+        cache_key = f"{key}:{file_doc['_id']}"
+        cached = self._local_cache.get(cache_key)
+        if cached is None:
+            meta = file_doc["metadata"]
+            blob = self._bucket.open_download_stream(file_doc["_id"]).read()
+            chunks = json.loads(blob[:meta["text_bytes"]].decode("utf-8"))
+            embeddings = np.frombuffer(blob[meta["text_bytes"]:], dtype=np.float32).reshape(meta["n_chunks"], meta["dim"])
+            cached = {"filename": meta.get("doc_filename"), "chunks": chunks, "embeddings": embeddings}
+            try: self._local_cache.put(cache_key, cached["filename"], chunks, embeddings)
+            except SessionTooLargeError: pass # Still served, just not cached locally
+        self.hits += 1
+        return cached
+
+    def delete(self, session_id):
+        for file_doc in self._files.find({"filename": _session_key(session_id)}, {"_id": 1}):
+            self._delete_file(file_doc["_id"])
+
+    def stats(self) -> dict:
+        totals = list(self._files.aggregate([{"$group": {"_id": None, "sessions": {"$sum": 1}, "total_bytes": {"$sum": "$length"}}}]))
+        totals = totals[0] if totals else {"sessions": 0, "total_bytes": 0}
+        return {
+            "backend": "gridfs", "sessions": totals["sessions"], "total_bytes": totals["total_bytes"],
+            "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "expirations": self.expirations,
+        }
+
+    # --- Internal helpers ---
+    def _delete_file(self, file_id):
+        import gridfs
+        try: self._bucket.delete(file_id)
+        except gridfs.errors.NoFile: pass # Removed concurrently by another worker
+
+    def _evict_for(self, incoming_bytes):
+        """Drops expired sessions, then least recently used ones until the new entry fits."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        for file_doc in self._files.find({"metadata.last_access": {"$lt": cutoff}}, {"_id": 1}):
+            self._delete_file(file_doc["_id"])
+            self.expirations += 1
+        entries = list(self._files.find({}, {"_id": 1, "length": 1}).sort("metadata.last_access", 1))
+        total_bytes = sum(entry.get("length", 0) for entry in entries)
+        remaining = len(entries)
+        for entry in entries:
+            if total_bytes + incoming_bytes <= self.max_bytes and remaining < self.max_sessions:
+                break
+            self._delete_file(entry["_id"])
+            total_bytes -= entry.get("length", 0)
+            remaining -= 1
+            self.evictions += 1
+
+
+def create_session_store(backend=SESSION_STORE_BACKEND, db=None):
+    """Builds the configured session store, falling back to the in-memory one if it cannot be used."""
+    backend = (backend or "memory").lower()
+    try:
+        if backend == "disk":
+            return DiskSessionDocumentStore()
+        if backend == "gridfs":
+            if db is None: raise RuntimeError("MongoDB is not connected")
+            return GridFSSessionDocumentStore(db)
+        if backend != "memory":
+            logging.error(f"[session_store] Unknown SESSION_STORE_BACKEND '{backend}'.")
+    except Exception as e:
+        logging.error(f"[session_store] Could not initialise '{backend}' session store: {e}")
+    logging.info("[session_store] Using in-process memory session store (not shared between workers).")
+    return SessionDocumentStore()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend modules are plain scripts in backend/, imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# prompt_llm.py creates its Groq client at import time and exits without an API key; tests never call Groq
+os.environ.setdefault("GROQ_API_KEY", "test-key")
@@ -0,0 +1,35 @@
+import pytest
+
+for dependency in ("dotenv", "fastapi", "httpx", "motor", "groq", "langchain_community", "pinecone", "sentence_transformers", "fitz", "magic", "pandas"):
+    pytest.importorskip(dependency)
+
+from fastapi.testclient import TestClient
+
+import asgi_app
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Not entering the client as a context manager skips the lifespan (no Pinecone/MongoDB connections)
+    monkeypatch.setitem(asgi_app.state, "vector_search", object())
+    monkeypatch.setitem(asgi_app.state, "embedding_model", object())
+    monkeypatch.setitem(asgi_app.state, "chat_collection", object())
+    return TestClient(asgi_app.app)
+
+
+@pytest.mark.parametrize("path", ["/api/query", "/api/query/stream", "/api/chats"])
+@pytest.mark.parametrize("body", [b"{not json", b"[1, 2]", b"\xff\xfe"])
+def test_malformed_json_body_is_a_400(client, path, body):
+    response = client.post(path, content=body, headers=JSON_HEADERS)
+
+    assert response.status_code == 400
+    assert response.json() == {"error": "Invalid JSON body"}
+
+
+def test_empty_query_is_still_reported(client):
+    response = client.post("/api/query", json={"query": "  "})
+
+    assert response.status_code == 400
+    assert response.json() == {"error": "Query cannot be empty"}
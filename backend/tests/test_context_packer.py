@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("dotenv")
+
+import context_packer
+from context_packer import count_tokens, pack_chunks, pack_context
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    """Counts tokens with the characters-per-token estimate, so budgets do not depend on a downloaded tokenizer."""
+    monkeypatch.setattr(context_packer, "_tokenizer", None)
+    monkeypatch.setattr(context_packer, "_tokenizer_loaded", True)
+
+
+def sentences(prefix, count):
+    return " ".join(f"{prefix} sentence number {i} talks about deductions under section 80C." for i in range(count))
+
+
+def test_pack_chunks_stays_within_budget():
+    texts = [sentences(f"Chunk {i}", 5) for i in range(10)]
+    blocks, used = pack_chunks(texts, 300)
+    assert used <= 300
+    assert sum(count_tokens(block) for block in blocks) <= 300
+    assert blocks[0] == texts[0] # Best-ranked chunks go in first and whole
+
+
+def test_pack_chunks_drops_duplicates():
+    text = sentences("Same", 3)
+    blocks, used = pack_chunks([text, "  " + text.upper() + "\n", text[20:120]], 1000)
+    assert blocks == [text]
+    assert used == count_tokens(text)
+
+
+def test_pack_chunks_merges_splitter_overlap():
+    document = sentences("Doc", 8)
+    first, second = document[:300], document[250:]
+    assert pack_chunks([first, second], 1000)[0] == [document]
+    assert pack_chunks([second, first], 1000)[0] == [document] # The lower-ranked chunk leads into the packed one
+
+
+def test_pack_chunks_cuts_at_a_sentence_boundary():
+    first, second = sentences("First", 4), sentences("Second", 10)
+    budget = count_tokens(first) + context_packer.MIN_PARTIAL_TOKENS + 20
+    blocks, used = pack_chunks([first, second], budget)
+    assert used <= budget
+    assert len(blocks) == 2 and second.startswith(blocks[1]) and len(blocks[1]) < len(second)
+    assert blocks[1].endswith(".")
+
+
+def test_pack_chunks_skips_chunks_when_too_little_budget_is_left():
+    first, second = sentences("First", 4), sentences("Second", 10)
+    budget = count_tokens(first) + context_packer.MIN_PARTIAL_TOKENS - 1
+    assert pack_chunks([first, second], budget) == ([first], count_tokens(first))
+
+
+def test_pack_context_reserves_a_share_for_the_document():
+    rag_parts = [sentences(f"Rag {i}", 5) for i in range(20)]
+    doc_parts = [sentences("Upload", 3)]
+    rag_blocks, doc_blocks = pack_context(rag_parts, doc_parts, budget=1000, doc_share=0.4)
+    assert doc_blocks == doc_parts
+    assert sum(count_tokens(block) for block in rag_blocks + doc_blocks) <= 1000
+
+
+def test_pack_context_gives_an_unused_share_to_the_knowledge_base():
+    rag_parts = [sentences(f"Rag {i}", 5) for i in range(20)]
+    with_share, _ = pack_context(rag_parts, [], budget=1000, doc_share=0.4)
+    assert sum(count_tokens(block) for block in with_share) > 600
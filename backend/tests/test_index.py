@@ -0,0 +1,242 @@
+import numpy as np
+import pytest
+
+for dependency in ("dotenv", "pinecone", "langchain", "sentence_transformers", "fitz"):
+    pytest.importorskip(dependency)
+
+import index
+from index_manifest import IndexManifest
+
+
+def record(filename, paragraphs):
+    """One source record whose content splits into one chunk per paragraph (each just under CHUNK_SIZE)."""
+    content = "\n\n".join(f"{filename} paragraph {i} " + "x" * (index.CHUNK_SIZE - 40) for i in range(paragraphs))
+    return {filename: {"content": content, "url": f"https://example.com/{filename}"}}
+
+
+class FakeEmbedder:
+    def __init__(self, batch_size, fail_on_call=None):
+        self.batch_size = batch_size
+        self.fail_on_call = fail_on_call
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        if len(self.batches) == self.fail_on_call: raise RuntimeError("model crashed")
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class FakeIndex:
+    """Records upserts and deletes; `failures` is a list of exceptions raised by the next upsert calls."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.upsert_calls = []
+        self.upserted = []
+        self.upserted_metadata = {}
+        self.deleted = []
+
+    def upsert(self, vectors):
+        self.upsert_calls.append(len(vectors))
+        if self.failures: raise self.failures.pop(0)
+        self.upserted += [chunk_id for chunk_id, _, _ in vectors]
+        self.upserted_metadata.update((chunk_id, chunk_metadata) for chunk_id, _, chunk_metadata in vectors)
+
+    def delete(self, ids=None, **_kwargs):
+        self.deleted += ids
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = IndexManifest(str(tmp_path / "manifest.sqlite3"))
+    yield manifest
+    manifest.close()
+
+
+def test_run_pipeline_embeds_chunks_in_fixed_size_batches(manifest):
+    embedder = FakeEmbedder(batch_size=4)
+    vector_index = FakeIndex()
+
+    stats = index.run_pipeline(vector_index, [record("a.pdf", 6), record("b.pdf", 5)], manifest, embedder, prune=False)
+
+    # Batches span document boundaries; only the last one is short
+    assert [len(batch) for batch in embedder.batches] == [4, 4, 3]
+    assert len(set(sum(embedder.batches, []))) == 11 and stats["chunks_embedded"] == 11
+    assert sorted(vector_index.upserted) == sorted([f"a.pdf_chunk_{i}" for i in range(6)] + [f"b.pdf_chunk_{i}" for i in range(5)])
+    assert stats["chunks_upserted"] == 11 and manifest.filenames() == {"a.pdf", "b.pdf"}
+
+
+def test_run_pipeline_skips_a_failed_embedding_batch_and_retries_the_document_next_run(manifest):
+    records = [record("a.pdf", 3), record("b.pdf", 3)]
+    embedder = FakeEmbedder(batch_size=3, fail_on_call=1) # a.pdf's batch
+
+    stats = index.run_pipeline(FakeIndex(), records, manifest, embedder, prune=False)
+
+    assert stats["skipped_chunks"] == 3 and stats["chunks_upserted"] == 3 and stats["incomplete_docs"] == 1
+    assert manifest.doc_hash("a.pdf") is None and manifest.doc_hash("b.pdf") is not None
+
+    rerun = FakeEmbedder(batch_size=3)
+    stats = index.run_pipeline(FakeIndex(), records, manifest, rerun, prune=False)
+    assert [len(batch) for batch in rerun.batches] == [3] and stats["unchanged_docs"] == 1
+
+
+class StatusError(Exception):
+    def __init__(self, status, message="error"):
+        super().__init__(message)
+        self.status = status
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(index.time, "sleep", delays.append)
+    monkeypatch.setattr(index.random, "uniform", lambda low, high: high)
+    return delays
+
+
+def vector(chunk_id, dimensions=4):
+    return (chunk_id, [0.5] * dimensions, {"source_filename": chunk_id.rsplit("_chunk_", 1)[0], "chunk_index": int(chunk_id.rsplit("_", 1)[1])})
+
+
+def test_upsert_batcher_respects_vector_and_byte_limits():
+    by_count = index.UpsertBatcher(max_bytes=10 ** 9, max_vectors=3)
+    full = [batch for batch in (by_count.add(vector(f"a.pdf_chunk_{i}")) for i in range(7)) if batch]
+    assert [len(batch) for batch in full + [by_count.flush()]] == [3, 3, 1]
+
+    one_vector_bytes = index.estimate_vector_bytes(*vector("a.pdf_chunk_0"))
+    by_size = index.UpsertBatcher(max_bytes=one_vector_bytes * 2 + 1, max_vectors=1000)
+    full = [batch for batch in (by_size.add(vector(f"a.pdf_chunk_{i}")) for i in range(5)) if batch]
+    assert [len(batch) for batch in full + [by_size.flush()]] == [2, 2, 1]
+    assert by_size.flush() == []
+
+
+def test_upsert_batcher_never_returns_an_empty_batch_for_an_oversized_vector():
+    batcher = index.UpsertBatcher(max_bytes=10, max_vectors=1000)
+    assert batcher.add(vector("a.pdf_chunk_0")) is None
+    assert [chunk_id for chunk_id, _, _ in batcher.add(vector("a.pdf_chunk_1"))] == ["a.pdf_chunk_0"]
+
+
+def test_call_with_retry_backs_off_exponentially_on_retryable_errors(no_sleep):
+    failures = [StatusError(429), StatusError(503), StatusError(None)]
+    retries = []
+
+    def flaky():
+        if failures: raise failures.pop(0)
+        return "ok"
+
+    assert index.call_with_retry(flaky, "Upsert", on_retry=lambda: retries.append(1)) == "ok"
+    assert no_sleep == [1.0, 2.0, 4.0] and len(retries) == 3
+
+
+def test_call_with_retry_gives_up_after_max_attempts_and_on_client_errors(no_sleep):
+    calls = []
+
+    def always_throttled():
+        calls.append(1); raise StatusError(429)
+
+    with pytest.raises(StatusError):
+        index.call_with_retry(always_throttled, "Upsert")
+    assert len(calls) == index.PINECONE_MAX_ATTEMPTS
+    assert max(no_sleep) <= index.PINECONE_BACKOFF_MAX_SECONDS
+
+    calls.clear(); no_sleep.clear()
+
+    def bad_request():
+        calls.append(1); raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        index.call_with_retry(bad_request, "Upsert")
+    assert len(calls) == 1 and no_sleep == []
+
+
+def upsert_stats():
+    return {"chunks_upserted": 0, "failed_chunks": 0, "pinecone_retries": 0}
+
+
+def test_upserter_retries_a_throttled_batch(manifest, no_sleep):
+    vector_index = FakeIndex(failures=[StatusError(429)])
+    stats = upsert_stats()
+    upserter = index.Upserter(vector_index, manifest, stats, concurrency=2)
+
+    upserter.submit([vector(f"a.pdf_chunk_{i}") for i in range(3)])
+    upserter.finish()
+
+    assert vector_index.upsert_calls == [3, 3]
+    assert stats == {"chunks_upserted": 3, "failed_chunks": 0, "pinecone_retries": 1}
+    assert set(manifest.chunk_hashes("a.pdf")) == {f"a.pdf_chunk_{i}" for i in range(3)}
+
+
+def test_upserter_splits_a_batch_rejected_as_too_large(manifest, no_sleep):
+    too_large = StatusError(413, "Request size exceeds the maximum")
+    vector_index = FakeIndex(failures=[too_large, too_large]) # The full batch and its first half
+    stats = upsert_stats()
+    upserter = index.Upserter(vector_index, manifest, stats, concurrency=1)
+
+    upserter.submit([vector(f"a.pdf_chunk_{i}") for i in range(8)])
+    upserter.finish()
+
+    assert vector_index.upsert_calls == [8, 4, 2, 2, 4]
+    assert sorted(vector_index.upserted) == sorted(f"a.pdf_chunk_{i}" for i in range(8))
+    assert stats == {"chunks_upserted": 8, "failed_chunks": 0, "pinecone_retries": 0}
+
+
+def test_upserter_records_failed_batches_without_marking_them(manifest, no_sleep):
+    vector_index = FakeIndex(failures=[StatusError(400, "invalid vector")])
+    stats = upsert_stats()
+    upserter = index.Upserter(vector_index, manifest, stats, concurrency=1)
+
+    upserter.submit([vector(f"a.pdf_chunk_{i}") for i in range(2)])
+    upserter.finish()
+
+    assert vector_index.upsert_calls == [2]
+    assert stats == {"chunks_upserted": 0, "failed_chunks": 2, "pinecone_retries": 0}
+    assert manifest.chunk_hashes("a.pdf") == {}
+
+
+def test_finalize_documents_deletes_stale_chunks_and_prunes(manifest):
+    manifest.mark_chunks([("a.pdf", i, bytes([i]) * 16) for i in range(3)] + [("b.pdf", 0, b"b" * 16), ("c.pdf", 0, b"c" * 16)])
+    plan = {"seen": {"a.pdf", "b.pdf"}, "pending": {
+        "a.pdf": {"doc_hash": b"a" * 16, "chunk_hashes": {"a.pdf_chunk_0": b"\0" * 16, "a.pdf_chunk_1": b"\1" * 16}}, # Shrunk to 2 chunks
+        "b.pdf": {"doc_hash": b"n" * 16, "chunk_hashes": {"b.pdf_chunk_0": b"new" * 5 + b"!"}}, # Changed chunk failed to upsert
+    }}
+    stats = {"chunks_deleted": 0, "incomplete_docs": 0, "pruned_docs": 0}
+    vector_index = FakeIndex()
+    index.finalize_documents(vector_index, manifest, plan, stats, prune=True)
+
+    assert sorted(vector_index.deleted) == ["a.pdf_chunk_2", "c.pdf_chunk_0"]
+    assert stats == {"chunks_deleted": 2, "incomplete_docs": 1, "pruned_docs": 1}
+    assert manifest.doc_hash("a.pdf") == b"a" * 16 and set(manifest.chunk_hashes("a.pdf")) == {"a.pdf_chunk_0", "a.pdf_chunk_1"}
+    assert manifest.doc_hash("b.pdf") is None # Keeps its old hash, so the next run retries it
+    assert manifest.filenames() == {"a.pdf", "b.pdf"}
+
+
+def test_rerun_reembeds_only_changed_chunks_and_deletes_dropped_ones(manifest):
+    def run_pipeline(records, embedder, vector_index):
+        return index.run_pipeline(vector_index, records, manifest, embedder, prune=False)
+
+    run_pipeline([record("a.pdf", 4), record("b.pdf", 2)], FakeEmbedder(batch_size=8), FakeIndex())
+
+    unchanged = FakeEmbedder(batch_size=8)
+    stats = run_pipeline([record("a.pdf", 4), record("b.pdf", 2)], unchanged, FakeIndex())
+    assert unchanged.batches == [] and stats["unchanged_docs"] == 2
+
+    shrunk = FakeEmbedder(batch_size=8)
+    vector_index = FakeIndex()
+    stats = run_pipeline([record("a.pdf", 2), record("b.pdf", 2)], shrunk, vector_index)
+    assert shrunk.batches == [] and stats["unchanged_chunks"] == 2 # a.pdf's first two chunks are identical
+    assert sorted(vector_index.deleted) == ["a.pdf_chunk_2", "a.pdf_chunk_3"]
+    assert set(manifest.chunk_hashes("a.pdf")) == {"a.pdf_chunk_0", "a.pdf_chunk_1"}
+
+
+def test_adding_filter_metadata_reindexes_every_document(manifest, monkeypatch):
+    records = [record("a.pdf", 2), record("b.pdf", 1)]
+    with monkeypatch.context() as patch:
+        patch.setattr(index, "filter_metadata", lambda *args: {}) # Before the filterable fields existed
+        index.run_pipeline(FakeIndex(), records, manifest, FakeEmbedder(batch_size=8), prune=False)
+
+    upgraded = FakeIndex()
+    stats = index.run_pipeline(upgraded, records, manifest, FakeEmbedder(batch_size=8), prune=False)
+
+    assert stats["docs_processed"] == 2 and stats["unchanged_chunks"] == 0
+    assert sorted(upgraded.upserted) == ["a.pdf_chunk_0", "a.pdf_chunk_1", "b.pdf_chunk_0"]
+    assert all(chunk_metadata["source"] == "other" for chunk_metadata in upgraded.upserted_metadata.values())
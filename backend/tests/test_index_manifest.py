@@ -0,0 +1,40 @@
+import json
+
+from index_manifest import IndexManifest, chunk_id_for, content_hash, parse_chunk_id
+
+
+def test_chunk_ids_round_trip():
+    assert parse_chunk_id(chunk_id_for("a_chunk_b.pdf", 12)) == ("a_chunk_b.pdf", 12)
+    assert parse_chunk_id("a.pdf") is None
+    assert parse_chunk_id("a.pdf_chunk_x") is None
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_complete_document_forgets_chunks_it_no_longer_has(tmp_path):
+    manifest = IndexManifest(str(tmp_path / "manifest.sqlite3"))
+    manifest.mark_chunks([("a.pdf", i, bytes([i]) * 16) for i in range(3)])
+    manifest.complete_document("a.pdf", b"d" * 16, {chunk_id_for("a.pdf", 0), chunk_id_for("a.pdf", 1)})
+    assert manifest.chunk_hashes("a.pdf") == {"a.pdf_chunk_0": b"\0" * 16, "a.pdf_chunk_1": b"\1" * 16}
+    assert manifest.doc_hash("a.pdf") == b"d" * 16
+    manifest.close()
+
+    reopened = IndexManifest(str(tmp_path / "manifest.sqlite3"))
+    assert reopened.filenames() == {"a.pdf"} and reopened.chunk_count() == 2
+    reopened.remove_document("a.pdf")
+    assert reopened.filenames() == set() and reopened.chunk_hashes("a.pdf") == {} and reopened.doc_hash("a.pdf") is None
+
+
+def test_load_imports_a_legacy_manifest_once(tmp_path):
+    legacy_path = tmp_path / "index_manifest.json"
+    legacy_path.write_text(json.dumps({"documents": {"a.pdf": {"doc_hash": "ab" * 16, "chunks": {"a.pdf_chunk_0": "cd" * 16, "a.pdf_chunk_1": None}}}}))
+    manifest = IndexManifest.load(str(tmp_path / "manifest.sqlite3"), [str(legacy_path)])
+    assert manifest.doc_hash("a.pdf") == bytes.fromhex("ab" * 16)
+    assert manifest.chunk_hashes("a.pdf") == {"a.pdf_chunk_0": bytes.fromhex("cd" * 16), "a.pdf_chunk_1": None}
+    manifest.remove_document("a.pdf")
+    manifest.close()
+    assert IndexManifest.load(str(tmp_path / "manifest.sqlite3"), [str(legacy_path)]).filenames() == set()
+
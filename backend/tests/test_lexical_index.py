@@ -0,0 +1,67 @@
+import pytest
+
+for dependency in ("dotenv", "langchain_core"):
+    pytest.importorskip(dependency)
+
+from lexical_index import LexicalIndex, tokenize
+
+
+def chunks(filename, texts, **metadata):
+    return [{"source_filename": filename, "chunk_index": i, "chunk_text": text, **metadata} for i, text in enumerate(texts)]
+
+
+def assert_consistent(index):
+    """terms.df and the meta totals must match what the chunks and postings tables actually hold."""
+    conn = index._conn()
+    df = dict(conn.execute("SELECT term, COUNT(*) FROM postings GROUP BY term"))
+    assert dict(conn.execute("SELECT term, df FROM terms")) == df
+    chunk_count, total_length = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+    assert index._totals(conn) == (chunk_count, total_length)
+    assert conn.execute("SELECT COUNT(*) FROM postings WHERE chunk_key NOT IN (SELECT chunk_key FROM chunks)").fetchone()[0] == 0
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    yield index
+    index.close()
+
+
+def test_tokenize_keeps_compound_tokens_and_their_parts():
+    assert tokenize("Section 80C of the Act") == ["section", "80c", "act"]
+    assert tokenize("Notification 15/2024 under RBI/2024-25/12") == ["notification", "15/2024", "15", "2024", "rbi/2024-25/12", "rbi", "2024", "25", "12"]
+    assert tokenize("Limit of ₹1,50,000.") == ["limit", "1,50,000", "1", "50", "000"]
+    assert tokenize("snake_case, trailing-") == ["snake", "case", "trailing"]
+    assert tokenize("the and of") == []
+
+
+def test_replace_and_remove_document_keep_df_and_totals_consistent(index):
+    index.replace_document("a.pdf", b"a1", chunks("a.pdf", ["tax deduction 80C", "home loan interest", "tax slab"]))
+    index.replace_document("b.pdf", b"b1", chunks("b.pdf", ["repo rate tax"]))
+    assert_consistent(index)
+    assert index.chunk_count() == 4 and index._conn().execute("SELECT df FROM terms WHERE term = 'tax'").fetchone() == (3,)
+
+    index.replace_document("a.pdf", b"a2", chunks("a.pdf", ["gst refund"])) # Shrinks from 3 chunks to 1
+    assert_consistent(index)
+    assert index.chunk_count() == 2 and index.doc_hash("a.pdf") == b"a2"
+    assert index._conn().execute("SELECT df FROM terms WHERE term = 'tax'").fetchone() == (1,)
+    assert index._conn().execute("SELECT df FROM terms WHERE term = 'loan'").fetchone() is None
+
+    index.remove_document("a.pdf")
+    index.remove_document("missing.pdf")
+    assert_consistent(index)
+    assert index.filenames() == {"b.pdf"} and index.chunk_count() == 1
+
+
+def test_search_ranks_exact_tokens_and_applies_metadata_filters(index):
+    index.replace_document("a.pdf", b"a", chunks("a.pdf", ["deduction under section 80C", "general savings advice"], source="incometax"))
+    index.replace_document("b.pdf", b"b", chunks("b.pdf", ["section 80C limit raised", "repo rate unchanged"], source="rbi", notification_number="15/2024"))
+
+    assert {match["id"] for match in index.search("80C", top_k=5)} == {"a.pdf_chunk_0", "b.pdf_chunk_0"}
+    # The notification number is indexed with every chunk of its document, even when the text lacks it
+    assert {match["id"] for match in index.search("notification 15/2024", top_k=5)} == {"b.pdf_chunk_0", "b.pdf_chunk_1"}
+
+    filtered = index.search("section 80C", top_k=5, metadata_filter={"source": "rbi"})
+    assert [match["id"] for match in filtered] == ["b.pdf_chunk_0"]
+    assert filtered[0]["metadata"]["chunk_text"] == "section 80C limit raised"
+    assert index.search("the of", top_k=5) == [] and index.search("unknownterm", top_k=5) == []
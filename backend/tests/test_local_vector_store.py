@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+for dependency in ("dotenv", "langchain_core"):
+    pytest.importorskip(dependency)
+
+import local_vector_store
+from local_vector_store import LocalVectorIndex, _filter_mask, matches_filter
+
+DIM = 8
+
+
+def unit(seed):
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32).tolist()
+
+
+def ids(result):
+    return [match["id"] for match in result["matches"]]
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / "vectors")
+
+
+def test_upsert_query_delete_and_reopen(root):
+    index = LocalVectorIndex(root)
+    index.upsert([(f"v{i}", unit(i), {"n": i}) for i in range(5)])
+
+    result = index.query(unit(3), top_k=2)
+    assert ids(result)[0] == "v3" and result["matches"][0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert result["matches"][0]["metadata"] == {"n": 3}
+
+    index.delete(ids=["v3", "missing"])
+    assert "v3" not in ids(index.query(unit(3), top_k=5))
+
+    reopened = LocalVectorIndex(root)
+    assert reopened.describe_index_stats().total_vector_count == 4
+    assert sorted(ids(reopened.query(unit(0), top_k=10))) == ["v0", "v1", "v2", "v4"]
+
+    reopened.delete(delete_all=True)
+    assert reopened.query(unit(0), top_k=3) == {"matches": []}
+
+
+def test_reupsert_tombstones_the_old_row(root):
+    index = LocalVectorIndex(root)
+    index.upsert([("a", unit(1), {"version": 1}), ("b", unit(2), {})])
+    index.upsert([("a", unit(5), {"version": 2})])
+
+    stats = index.describe_index_stats()
+    assert stats.rows == 3 and stats.total_vector_count == 2
+    assert ids(index.query(unit(1), top_k=5)).count("a") == 1
+    assert index.query(unit(5), top_k=1)["matches"][0]["metadata"] == {"version": 2}
+
+
+def test_a_reader_sees_commits_from_another_writer(root):
+    reader = LocalVectorIndex(root)
+    assert reader.query(unit(0), top_k=1) == {"matches": []}
+
+    LocalVectorIndex(root).upsert([("a", unit(0), {})])
+    assert ids(reader.query(unit(0), top_k=1)) == ["a"]
+
+
+def test_flush_compacts_tombstoned_rows(root):
+    index = LocalVectorIndex(root)
+    index.upsert([(f"v{i}", unit(i), {"n": i}) for i in range(10)])
+    index.delete(ids=[f"v{i}" for i in range(0, 10, 2)])
+    index.flush()
+
+    stats = index.describe_index_stats()
+    assert stats.rows == 5 and stats.total_vector_count == 5
+    assert index.query(unit(7), top_k=1)["matches"][0] == {"id": "v7", "score": pytest.approx(1.0, abs=1e-5), "metadata": {"n": 7}}
+
+    index.upsert([("v7", unit(70), {"n": 70})]) # The id -> row map was rebuilt by the compaction
+    assert LocalVectorIndex(root).describe_index_stats().total_vector_count == 5
+
+
+def test_uncommitted_tail_is_truncated_before_the_next_write(root):
+    index = LocalVectorIndex(root)
+    index.upsert([("a", unit(0), {"n": 0}), ("b", unit(1), {"n": 1})])
+    # A crash between appending the row data and committing state.json leaves garbage after the committed rows
+    for name, garbage in (("vectors.f32", b"\1" * (DIM * 4 + 3)), ("rows.jsonl", b'{"id": "torn", "meta'), ("offsets.i64", b"\2" * 8)):
+        with open(index._paths[name], "ab") as f: f.write(garbage)
+
+    writer = LocalVectorIndex(root)
+    writer.upsert([("c", unit(2), {"n": 2})])
+
+    result = LocalVectorIndex(root).query(unit(2), top_k=3)
+    assert result["matches"][0] == {"id": "c", "score": pytest.approx(1.0, abs=1e-5), "metadata": {"n": 2}}
+    assert sorted(ids(result)) == ["a", "b", "c"]
+
+
+def test_hnsw_hits_are_merged_with_the_unindexed_tail(root, monkeypatch):
+    pytest.importorskip("hnswlib")
+    monkeypatch.setattr(local_vector_store, "HNSW_MIN_ROWS", 50)
+    index = LocalVectorIndex(root)
+    index.upsert([(f"g{i}", unit(i), {}) for i in range(60)])
+    index.flush()
+    assert index.describe_index_stats().hnsw_rows == 60
+
+    index.upsert([(f"t{i}", unit(1000 + i), {}) for i in range(10)]) # Not in the graph yet
+    index.delete(ids=["g0", "g1"])
+    vectors = {f"g{i}": unit(i) for i in range(2, 60)} | {f"t{i}": unit(1000 + i) for i in range(10)}
+    normalized = {vector_id: np.asarray(v) / np.linalg.norm(v) for vector_id, v in vectors.items()}
+
+    for seed in (0, 1005, 42):
+        query = np.asarray(unit(seed)) / np.linalg.norm(unit(seed))
+        expected = sorted(normalized, key=lambda vector_id: -float(normalized[vector_id] @ query))[:5]
+        assert ids(index.query(unit(seed), top_k=5)) == expected
+
+
+FILTERS = [
+    {"source": "rbi"},
+    {"source": {"$ne": "rbi"}},
+    {"year": {"$gte": 2022, "$lt": 2024}},
+    {"tags": {"$in": ["tax", "gst"]}},
+    {"tags": {"$nin": ["tax"]}},
+    {"notification_number": {"$exists": True}},
+    {"notification_number": {"$exists": False}},
+    {"$or": [{"source": "incometax"}, {"year": {"$lte": 2020}}]},
+    {"$and": [{"source": "rbi"}, {"tags": "loans"}]},
+    {"year": {"$gt": "2020"}}, # Mismatched types never match
+]
+
+
+def test_filter_mask_agrees_with_matches_filter(root):
+    rng = np.random.default_rng(0)
+    metadatas = []
+    for i in range(40):
+        metadata = {"source": ["rbi", "incometax", "other"][i % 3], "year": int(rng.integers(2018, 2026))}
+        if i % 4: metadata["tags"] = [["tax"], ["gst", "loans"], ["loans"]][i % 3]
+        if i % 5 == 0: metadata["notification_number"] = f"{i}/2024"
+        metadatas.append(metadata)
+    index = LocalVectorIndex(root)
+    index.upsert([(f"v{i}", unit(i), metadata) for i, metadata in enumerate(metadatas)])
+    index.query(unit(0), top_k=1) # Loads the snapshot
+    snap = index._snapshot
+
+    for metadata_filter in FILTERS:
+        expected = [matches_filter(metadata, metadata_filter) for metadata in metadatas]
+        assert _filter_mask(snap, metadata_filter).tolist() == expected, metadata_filter
+        assert sorted(ids(index.query(unit(0), top_k=40, filter=metadata_filter))) == sorted(f"v{i}" for i, hit in enumerate(expected) if hit)
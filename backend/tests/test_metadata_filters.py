@@ -0,0 +1,80 @@
+import pytest
+
+from metadata_filters import (build_metadata_filter, detect_query_filter, extract_notification_ids, filter_metadata,
+                              parse_publish_day)
+
+
+def test_parse_publish_day_formats():
+    assert parse_publish_day("2024-03-31") == 20240331
+    assert parse_publish_day("31/03/2024") == 20240331
+    assert parse_publish_day("31 Mar 2024") == 20240331
+    assert parse_publish_day("March 31, 2024") == 20240331
+    assert parse_publish_day("") is None
+    assert parse_publish_day("sometime in 2024") is None
+
+
+def test_build_metadata_filter_empty():
+    assert build_metadata_filter(None) is None
+    assert build_metadata_filter({}) is None
+
+
+def test_build_metadata_filter_single_clause_is_not_wrapped():
+    assert build_metadata_filter({"source": "RBI"}) == {"source": {"$in": ["rbi"]}}
+
+
+def test_build_metadata_filter_all_fields():
+    metadata_filter = build_metadata_filter({"date_from": "2024-01-01", "date_to": "31/12/2024", "source": ["rbi", "incometax"],
+                                             "notification_number": ["Notification No. 15/2024", "RBI/2024-25/12", "G.S.R. 7"]})
+    assert metadata_filter == {"$and": [
+        {"publish_day": {"$gte": 20240101, "$lte": 20241231}},
+        {"source": {"$in": ["rbi", "incometax"]}},
+        {"notification_ids": {"$in": ["15/2024", "rbi/2024-25/12", "g.s.r. 7"]}},
+    ]}
+
+
+@pytest.mark.parametrize("filters", [
+    ["rbi"],
+    {"sauce": "rbi"},
+    {"date_from": "yesterday"},
+    {"source": "sebi"},
+])
+def test_build_metadata_filter_rejects_bad_input(filters):
+    with pytest.raises(ValueError):
+        build_metadata_filter(filters)
+
+
+def test_extract_notification_ids_needs_a_prefix_in_free_text():
+    assert extract_notification_ids("What does notification no. 15/2024 say? See also Notfn 3/2023.") == ["15/2024", "3/2023"]
+    assert extract_notification_ids("Refer RBI/2024-25/12 and rbi/2024-25/12 dated 02.04.2024") == ["rbi/2024-25/12"]
+
+
+@pytest.mark.parametrize("text", [
+    "How did TDS rates change from 2023/2024?",
+    "Capital gains rules for FY 2023/24",
+    "Circular dated 12/03/2024",
+    "Section 15/2024 of the act",
+])
+def test_extract_notification_ids_ignores_years_and_dates(text):
+    assert extract_notification_ids(text) == []
+
+
+def test_extract_notification_ids_bare_field():
+    assert extract_notification_ids("15/2024", bare=True) == ["15/2024"]
+    assert extract_notification_ids("2023/2024", bare=True) == []
+
+
+def test_detect_query_filter():
+    assert detect_query_filter("Explain notification no. 15/2024") == {"notification_ids": {"$in": ["15/2024"]}}
+    assert detect_query_filter("What is the standard deduction?") is None
+
+
+def test_detect_query_filter_defers_to_request_filter():
+    request_filter = {"$and": [{"source": {"$in": ["incometax"]}}, {"notification_ids": {"$in": ["3/2023"]}}]}
+    assert detect_query_filter("Explain notification no. 15/2024", request_filter) is None
+    assert detect_query_filter("Explain notification no. 15/2024", {"source": {"$in": ["incometax"]}}) is not None
+
+
+def test_filter_metadata_drops_empty_fields():
+    metadata = filter_metadata("https://incometaxindia.gov.in/n.pdf", "", "15/2024", "Notification No. 16/2024 ...")
+    assert metadata == {"source": "incometax", "notification_ids": ["15/2024", "16/2024"]}
+    assert filter_metadata("https://example.com/a.pdf", "unknown", None, "") == {"source": "other"}
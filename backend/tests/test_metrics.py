@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """An empty registry and no flush thread; metrics created in a test register here."""
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    monkeypatch.setattr(metrics, "_flusher_pid", os.getpid())
+    monkeypatch.setattr(metrics, "_shared_dir", None)
+    return metrics.REGISTRY
+
+
+@pytest.fixture
+def shared_dir(registry, tmp_path, monkeypatch):
+    if os.name != "posix": pytest.skip("cross-worker metrics are POSIX only")
+    monkeypatch.setattr(metrics, "_shared_dir", str(tmp_path))
+    return tmp_path
+
+
+def write_snapshot(directory, filename, snapshot):
+    (directory / filename).write_text(json.dumps({name: [[list(key), value] for key, value in values.items()] for name, values in snapshot.items()}))
+
+
+def sample_lines(text):
+    return [line for line in text.splitlines() if not line.startswith("#")]
+
+
+def test_histogram_buckets_are_cumulative_with_inclusive_upper_bounds(registry):
+    histogram = metrics.Histogram("stage_seconds", "Stage time.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 1.0, 3.0):
+        histogram.observe(value, stage="embed")
+
+    assert sample_lines(metrics.render_metrics()) == [
+        'stage_seconds_bucket{stage="embed",le="0.1"} 2',
+        'stage_seconds_bucket{stage="embed",le="1"} 4',
+        'stage_seconds_bucket{stage="embed",le="+Inf"} 5',
+        'stage_seconds_sum{stage="embed"} 4.650000',
+        'stage_seconds_count{stage="embed"} 5',
+    ]
+
+
+def test_exposition_format_has_help_type_and_escaped_labels(registry):
+    counter = metrics.Counter("requests_total", "Queries handled.", ("endpoint", "status"))
+    counter.inc(endpoint="/api/query", status="ok")
+    counter.inc(2, endpoint='say "hi"\\\n', status="ok")
+    metrics.Histogram("unused_seconds", "Never observed.")
+
+    assert metrics.render_metrics() == (
+        "# HELP requests_total Queries handled.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{endpoint="/api/query",status="ok"} 1\n'
+        'requests_total{endpoint="say \\"hi\\"\\\\\\n",status="ok"} 2\n'
+        "# HELP unused_seconds Never observed.\n"
+        "# TYPE unused_seconds histogram\n"
+    )
+
+
+def test_request_timer_records_stages_and_server_timing(registry, monkeypatch):
+    monkeypatch.setattr(metrics, "STAGE_SECONDS", metrics.Histogram("stage", "", ("stage",)))
+    monkeypatch.setattr(metrics, "REQUEST_SECONDS", metrics.Histogram("request", "", ("endpoint", "status")))
+    monkeypatch.setattr(metrics, "REQUESTS_TOTAL", metrics.Counter("requests", "", ("endpoint", "status")))
+    timer = metrics.RequestTimer("query")
+    timer.record("embed", 0.0125)
+    timer.record("embed", 0.0125)
+    timer.record("llm", 0.5)
+    timer.finish()
+
+    assert list(timer.breakdown())[:2] == ["embed", "llm"] and timer.breakdown()["embed"] == 25.0
+    assert timer.server_timing().startswith("embed;dur=25.0, llm;dur=500.0, total;dur=")
+    assert metrics.STAGE_SECONDS.values[("embed",)][-1] == pytest.approx(0.025)
+    assert metrics.REQUESTS_TOTAL.values == {("query", "ok"): 1.0}
+
+
+def test_render_sums_live_workers_and_deletes_dead_ones(shared_dir):
+    counter = metrics.Counter("requests_total", "Queries handled.", ("status",))
+    histogram = metrics.Histogram("stage_seconds", "Stage time.", ("stage",), buckets=(1.0,))
+    counter.inc(status="ok")
+    histogram.observe(0.5, stage="embed")
+
+    parent = os.getppid()
+    live_name = metrics._snapshot_filename(parent, metrics._process_start_time(parent))
+    write_snapshot(shared_dir, live_name, {"requests_total": {("ok",): 2.0, ("error",): 1.0}, "stage_seconds": {("embed",): [0, 1, 2.0]}})
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True, check=True)
+    dead_name = f"metrics-{dead.stdout.strip()}.json"
+    write_snapshot(shared_dir, dead_name, {"requests_total": {("ok",): 100.0}})
+    (shared_dir / "metrics-notes.txt").write_text("ignored")
+
+    assert sample_lines(metrics.render_metrics()) == [
+        'requests_total{status="error"} 1',
+        'requests_total{status="ok"} 3',
+        'stage_seconds_bucket{stage="embed",le="1"} 1',
+        'stage_seconds_bucket{stage="embed",le="+Inf"} 2',
+        'stage_seconds_sum{stage="embed"} 2.500000',
+        'stage_seconds_count{stage="embed"} 2',
+    ]
+    assert sorted(os.listdir(shared_dir)) == sorted([live_name, metrics._own_snapshot_name(), "metrics-notes.txt"])
+
+
+def test_snapshot_of_a_reused_pid_is_deleted(shared_dir):
+    counter = metrics.Counter("requests_total", "Queries handled.")
+    parent = os.getppid()
+    start_time = metrics._process_start_time(parent)
+    if start_time is None: pytest.skip("process start times need /proc")
+    # Written by an earlier process that had the parent's PID, and by an earlier process that had ours
+    write_snapshot(shared_dir, metrics._snapshot_filename(parent, start_time - 1), {"requests_total": {(): 5.0}})
+    write_snapshot(shared_dir, metrics._snapshot_filename(os.getpid(), 0), {"requests_total": {(): 7.0}})
+    counter.inc()
+
+    assert sample_lines(metrics.render_metrics()) == ["requests_total 1"]
+    assert os.listdir(shared_dir) == [metrics._own_snapshot_name()]
+
+
+def test_snapshot_file_names_round_trip():
+    assert metrics._parse_snapshot_filename(metrics._snapshot_filename(123, 4567)) == (123, 4567)
+    assert metrics._parse_snapshot_filename(metrics._snapshot_filename(123, None)) == (123, None)
+    assert metrics._parse_snapshot_filename("metrics-abc.json") is None
+    assert metrics._parse_snapshot_filename("metrics-1.json.tmp") is None
@@ -0,0 +1,61 @@
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+import pdf_extract
+from pdf_extract import extract_pdf_text, iter_pdf_pages, page_for_offset
+
+
+def make_pdf(path, page_count):
+    with fitz.open() as doc:
+        for page_number in range(1, page_count + 1):
+            doc.new_page().insert_text((72, 72), f"Page {page_number} text")
+        doc.save(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def small_ranges(monkeypatch):
+    """Sends PDFs of 4+ pages to the pool in 3-page ranges, so the parallel path runs on small test files."""
+    monkeypatch.setattr(pdf_extract, "PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(pdf_extract, "PAGES_PER_TASK", 3)
+
+
+def test_iter_pdf_pages_in_process(tmp_path):
+    pages = list(iter_pdf_pages(make_pdf(tmp_path / "a.pdf", 3), processes=1))
+    assert [(number, text.strip()) for number, text in pages] == [(1, "Page 1 text"), (2, "Page 2 text"), (3, "Page 3 text")]
+
+
+def test_iter_pdf_pages_through_the_pool_keeps_page_order(tmp_path, small_ranges):
+    path = make_pdf(tmp_path / "a.pdf", 11)
+    in_process = list(iter_pdf_pages(path, processes=1))
+
+    assert list(iter_pdf_pages(path, processes=2)) == in_process
+    assert [number for number, _ in in_process] == list(range(1, 12))
+    assert pdf_extract._pool is not None and pdf_extract._pool_processes == 2
+
+
+def test_pool_is_reused_and_early_stop_cancels_pending_ranges(tmp_path, small_ranges):
+    path = make_pdf(tmp_path / "a.pdf", 30)
+    pages = iter_pdf_pages(path, processes=2)
+    assert next(pages)[0] == 1
+    pool = pdf_extract._pool
+    pages.close() # Runs the finally block with ranges still in flight
+
+    assert [number for number, _ in iter_pdf_pages(path, processes=2)] == list(range(1, 31))
+    assert pdf_extract._pool is pool
+
+
+def test_extract_pdf_text_offsets_follow_the_transformed_pages(tmp_path, small_ranges):
+    path = make_pdf(tmp_path / "a.pdf", 5)
+
+    for processes in (1, 2):
+        text, page_offsets = extract_pdf_text(path, processes, transform=lambda page: page.strip().upper() + "\n")
+        assert text == "".join(f"PAGE {n} TEXT\n" for n in range(1, 6))
+        assert page_offsets == [0, 12, 24, 36, 48]
+    assert page_for_offset(page_offsets, 0) == 1 and page_for_offset(page_offsets, 11) == 1
+    assert page_for_offset(page_offsets, 12) == 2 and page_for_offset(page_offsets, len(text) - 1) == 5
+
+
+def test_page_for_offset_without_offsets_is_page_one():
+    assert page_for_offset([], 100) == 1
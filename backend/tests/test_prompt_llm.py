@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+for dependency in ("dotenv", "groq", "langchain"):
+    pytest.importorskip(dependency)
+
+import prompt_llm
+from prompt_llm import LLM_EMPTY_RESPONSE, LLMStreamError, astream_llm_response, stream_llm_response
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    """Streams the given deltas, then raises `fail_after` if set; `fail_on_create` makes the request itself fail."""
+
+    def __init__(self, deltas, fail_after=None, fail_on_create=None):
+        self.deltas = deltas
+        self.fail_after = fail_after
+        self.fail_on_create = fail_on_create
+        self.requests = []
+
+    def _chunks(self):
+        for delta in self.deltas: yield chunk(delta)
+        if self.fail_after: raise self.fail_after
+
+    def create(self, stream=False, **kwargs):
+        self.requests.append(dict(kwargs, stream=stream))
+        if self.fail_on_create: raise self.fail_on_create
+        return self._chunks()
+
+    async def acreate(self, stream=False, **kwargs):
+        chunks = self.create(stream=stream, **kwargs)
+        async def achunks():
+            for item in chunks: yield item
+        return achunks()
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    def install(*args, **kwargs):
+        completions = FakeCompletions(*args, **kwargs)
+        monkeypatch.setattr(prompt_llm, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        monkeypatch.setattr(prompt_llm, "async_client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=completions.acreate))))
+        return completions
+    return install
+
+
+def collect_async(prompt):
+    async def run():
+        return [delta async for delta in astream_llm_response(prompt)]
+    return asyncio.run(run())
+
+
+def test_stream_yields_deltas_in_order(completions):
+    fake = completions(["Sec", "tion ", None, "80C"])
+    assert list(stream_llm_response("prompt")) == ["Sec", "tion ", "80C"]
+    assert fake.requests[0]["stream"] is True and fake.requests[0]["messages"][-1]["content"] == "prompt"
+
+
+def test_empty_stream_yields_the_empty_response(completions):
+    completions([None, ""])
+    assert list(stream_llm_response("prompt")) == [LLM_EMPTY_RESPONSE]
+
+
+def test_failure_mid_stream_raises_after_the_partial_answer(completions):
+    completions(["Partial ", "answer"], fail_after=ConnectionError("reset by peer"))
+    received = []
+    with pytest.raises(LLMStreamError, match="reset by peer"):
+        for delta in stream_llm_response("prompt"): received.append(delta)
+    assert received == ["Partial ", "answer"]
+
+
+def test_failure_before_any_token_raises(completions):
+    completions([], fail_on_create=TimeoutError("groq timed out"))
+    with pytest.raises(LLMStreamError):
+        list(stream_llm_response("prompt"))
+
+
+def test_async_stream(completions):
+    completions(["a", None, "b"])
+    assert collect_async("prompt") == ["a", "b"]
+    completions([])
+    assert collect_async("prompt") == [LLM_EMPTY_RESPONSE]
+    completions(["a"], fail_after=ConnectionError("reset by peer"))
+    with pytest.raises(LLMStreamError):
+        collect_async("prompt")
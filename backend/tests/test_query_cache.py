@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("dotenv")
+
+import query_cache
+from query_cache import SemanticAnswerCache, bump_index_version
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return SemanticAnswerCache(threshold=0.95, ttl_seconds=60, max_entries=2, version_file=str(tmp_path / "index_version.txt"), clock=clock)
+
+
+def test_hit_needs_the_similarity_threshold(cache):
+    cache.store("What is 80C?", unit(1, 0, 0), "Up to 1.5 lakh.")
+    hit = cache.lookup(unit(1, 0.1, 0)) # cos = 0.995
+    assert hit["answer"] == "Up to 1.5 lakh." and hit["query"] == "What is 80C?" and hit["similarity"] >= 0.95
+    assert cache.lookup(unit(1, 0.5, 0)) is None # cos = 0.894
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_the_ttl(cache, clock):
+    cache.store("q", unit(1, 0, 0), "a")
+    clock.now += 60
+    assert cache.lookup(unit(1, 0, 0)) is not None
+    clock.now += 1
+    assert cache.lookup(unit(1, 0, 0)) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_expired_entry_does_not_hide_a_fresh_match(cache, clock):
+    cache.store("old", unit(1, 0, 0), "old answer")
+    clock.now += 30
+    cache.store("new", unit(1, 0.4, 0), "new answer") # cos = 0.928 to "old": a separate entry
+    clock.now += 45 # "old" has expired, "new" has not
+    hit = cache.lookup(unit(1, 0.15, 0)) # cos = 0.989 to "old", 0.973 to "new"
+    assert hit["answer"] == "new answer"
+
+
+def test_near_duplicate_replaces_the_entry(cache):
+    cache.store("q1", unit(1, 0, 0), "a1")
+    cache.store("q1 again", unit(1, 0.05, 0), "a2")
+    assert cache.stats()["entries"] == 1
+    assert cache.lookup(unit(1, 0, 0))["answer"] == "a2"
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.store("x", unit(1, 0, 0), "x")
+    cache.store("y", unit(0, 1, 0), "y")
+    assert cache.lookup(unit(1, 0, 0)) is not None # x is now more recent than y
+    cache.store("z", unit(0, 0, 1), "z")
+    assert cache.lookup(unit(0, 1, 0)) is None
+    assert cache.lookup(unit(1, 0, 0)) is not None and cache.lookup(unit(0, 0, 1)) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_new_index_version_clears_the_cache(cache, clock):
+    cache.store("q", unit(1, 0, 0), "a")
+    bump_index_version(cache.version_file)
+    assert cache.lookup(unit(1, 0, 0)) is not None # The version file is only re-read every few seconds
+    clock.now += query_cache.VERSION_CHECK_INTERVAL_SECONDS
+    assert cache.lookup(unit(1, 0, 0)) is None
+    assert cache.stats()["invalidations"] == 1
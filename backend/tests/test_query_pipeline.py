@@ -0,0 +1,100 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+for dependency in ("dotenv", "langchain", "pandas", "magic", "sentence_transformers", "fitz"):
+    pytest.importorskip(dependency)
+
+import query_pipeline
+from query_pipeline import chunk_and_embed, iter_split_text, search_session_document
+from session_store import SessionDocumentStore
+
+DIM = 256
+
+
+class FakeEmbedder:
+    """Stand-in for embedding_service.embed_texts: normalised bag-of-words vectors; records every text it encodes."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, normalize=True):
+        texts = list(texts)
+        self.calls.append(texts)
+        vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split(): vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % DIM] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+    def embedded(self):
+        return [text for call in self.calls for text in call]
+
+
+@pytest.fixture
+def embedder(monkeypatch):
+    embedder = FakeEmbedder()
+    monkeypatch.setattr(query_pipeline, "embed_texts", embedder)
+    return embedder
+
+
+def document(paragraphs=10):
+    return "\n\n".join(" ".join([f"topic{i}"] * 60) + "." for i in range(paragraphs))
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_upload_embeds_each_chunk_once(embedder, batch_size):
+    chunks, embeddings = chunk_and_embed(document(), "doc.txt", batch_size)
+    assert len(chunks) > 2
+    assert embedder.embedded() == chunks
+    assert embeddings.dtype == np.float32 and embeddings.shape == (len(chunks), DIM)
+    if batch_size: assert all(len(call) <= batch_size for call in embedder.calls)
+
+
+def test_streamed_pages_are_embedded_once(embedder):
+    pages = iter(document().split("\n\n"))
+    chunks, embeddings = chunk_and_embed(pages, "doc.pdf", batch_size=3)
+    assert embedder.embedded() == chunks and len(embeddings) == len(chunks)
+
+
+def test_queries_reuse_the_stored_embeddings(embedder):
+    store = SessionDocumentStore()
+    chunks, embeddings = chunk_and_embed(document(), "doc.txt")
+    store.put("session", "doc.txt", chunks, embeddings)
+    query_embeddings = {topic: embedder([f"what about topic{topic}"])[0] for topic in (3, 7)}
+    embedder.calls.clear()
+    for topic, query_embedding in query_embeddings.items():
+        doc_context_parts, doc_filename = search_session_document("session", store.get("session"), query_embedding)
+        assert doc_filename == "doc.txt"
+        assert f"topic{topic}" in doc_context_parts[0]
+    assert embedder.calls == [] # Only the question is embedded per query, never the document
+
+
+def pages_of(text, page_chars=700):
+    return [text[start:start + page_chars] for start in range(0, len(text), page_chars)]
+
+
+@pytest.mark.parametrize("window_chars", [1500, 4000, query_pipeline.STREAM_SPLIT_WINDOW_CHARS])
+def test_iter_split_text_matches_splitting_the_whole_text(window_chars):
+    text = document(paragraphs=40)
+    assert list(iter_split_text(pages_of(text), window_chars)) == query_pipeline.text_splitter.split_text(text)
+
+
+def test_iter_split_text_is_lazy():
+    consumed = []
+
+    def pages():
+        for page in pages_of(document(paragraphs=40)):
+            consumed.append(page)
+            yield page
+
+    chunks = iter_split_text(pages(), window_chars=2000)
+    next(chunks)
+    assert 0 < sum(map(len, consumed)) < 2000 + 700 # One window (plus the page that filled it), not the whole text
+    assert all(len(chunk) <= query_pipeline.CHUNK_SIZE for chunk in chunks)
+
+
+def test_iter_split_text_without_text():
+    assert list(iter_split_text([])) == []
+    assert list(iter_split_text(["", "  \n\n "])) == []
+    assert list(iter_split_text(["short page"], window_chars=5)) == ["short page"]
@@ -0,0 +1,109 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+import reranker
+
+
+class Clock:
+    def __init__(self):
+        self.seconds = 0.0
+
+    def perf_counter(self):
+        return self.seconds
+
+
+class StubCrossEncoder:
+    """Scores a pair by the number of (lowercased) query words in the text; each pair advances the clock by `pair_cost_ms`."""
+
+    clock = None
+    pair_cost_ms = 10.0
+
+    def __init__(self, model_name, max_length=None, device=None):
+        self.predicted = []
+        self.fail = False
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None, convert_to_numpy=None):
+        self.predicted.append([text for _, text in pairs])
+        if self.fail: raise RuntimeError("model crashed")
+        self.clock.seconds += len(pairs) * self.pair_cost_ms / 1000
+        return [float(sum(word in text.lower().split() for word in query.lower().split())) for query, text in pairs]
+
+
+@pytest.fixture
+def make_reranker(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(StubCrossEncoder, "clock", clock)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(CrossEncoder=StubCrossEncoder))
+    monkeypatch.setattr(reranker, "time", clock)
+    return lambda budget_ms=1000, cache_size=100: reranker.CrossEncoderReranker("stub", budget_ms=budget_ms, batch_size=8, max_length=64, cache_size=cache_size)
+
+
+def doc(text):
+    return SimpleNamespace(page_content=text)
+
+
+def texts(documents):
+    return [document.page_content for document in documents]
+
+
+def test_rerank_orders_by_cross_encoder_score(make_reranker):
+    documents = [doc("repo rate"), doc("tax regime new slab"), doc("new tax rules")]
+    model = make_reranker()
+
+    assert texts(model.rerank("new tax regime", documents, top_k=2)) == ["tax regime new slab", "new tax rules"]
+    assert texts(model.rerank("anything", documents[:1], top_k=2)) == ["repo rate"] and len(model.model.predicted) == 1
+
+
+def test_rerank_reuses_cached_scores_for_the_same_query(make_reranker):
+    documents = [doc("gst refund"), doc("tax refund status"), doc("refund")]
+    model = make_reranker()
+    first = model.rerank("Tax  refund status", documents, top_k=3)
+
+    # Same query up to case/whitespace: every score comes from the cache; only the new chunk is scored
+    second = model.rerank("tax refund STATUS", documents + [doc("tax status")], top_k=4)
+    assert texts(first) == ["tax refund status", "gst refund", "refund"]
+    assert texts(second) == ["tax refund status", "tax status", "gst refund", "refund"]
+    assert model.model.predicted == [texts(documents), ["tax status"]]
+
+
+def test_rerank_scores_only_what_fits_in_the_budget(make_reranker):
+    documents = [doc(f"chunk {i}") for i in range(6)] + [doc("tax tax"), doc("tax")]
+    model = make_reranker(budget_ms=30) # 30 ms / 5 ms initial per-pair estimate: the first 6 candidates
+
+    reranked = model.rerank("tax", documents, top_k=8)
+    assert model.model.predicted == [texts(documents[:6])]
+    assert texts(reranked) == texts(documents) # Unscored candidates stay below the scored ones, in retrieval order
+    assert model._pair_cost_ms == pytest.approx(5.0 + reranker.COST_SMOOTHING * (10.0 - 5.0))
+
+    # The measured cost (6.5 ms) now affords 4 pairs, and the cached ones need no scoring
+    reranked = model.rerank("tax", documents, top_k=3)
+    assert model.model.predicted[1] == ["tax tax", "tax"]
+    assert texts(reranked) == ["tax tax", "tax", "chunk 0"]
+
+
+def test_rerank_always_scores_the_minimum_number_of_candidates(make_reranker):
+    documents = [doc(f"tax {i}") for i in range(6)]
+    model = make_reranker(budget_ms=0)
+
+    model.rerank("tax", documents, top_k=6)
+    assert len(model.model.predicted[0]) == reranker.MIN_SCORED_CANDIDATES
+
+
+def test_rerank_keeps_retrieval_order_when_prediction_fails(make_reranker):
+    documents = [doc("a"), doc("tax"), doc("b")]
+    model = make_reranker()
+    model.model.fail = True
+
+    assert texts(model.rerank("tax", documents, top_k=2)) == ["a", "tax"]
+    model.model.fail = False
+    assert texts(model.rerank("tax", documents, top_k=2))[0] == "tax" # The failure was not cached
+
+
+def test_score_cache_is_bounded(make_reranker):
+    model = make_reranker(cache_size=3)
+    model.rerank("tax", [doc(f"tax {i}") for i in range(5)], top_k=5)
+    assert len(model._cache) == 3
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+for dependency in ("dotenv", "langchain_community", "pinecone", "sentence_transformers"):
+    pytest.importorskip(dependency)
+
+from langchain_core.documents import Document
+
+from retriever import reciprocal_rank_fusion, search_by_vector
+
+
+def chunk(filename, chunk_index, text=""):
+    return Document(page_content=text or f"{filename} {chunk_index}", metadata={"source_filename": filename, "chunk_index": chunk_index})
+
+
+class FakeVectorStore:
+    """Records by-vector searches; documents are returned for filters listed in `results` (None = unfiltered)."""
+
+    def __init__(self, results):
+        self.results = results
+        self.searches = []
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        self.searches.append({"embedding": embedding, "k": k, "filter": filter})
+        return [(doc, 1.0) for doc in self.results.get(repr(filter), [])[:k]]
+
+
+def fake_retriever(vector_store, k=3):
+    def invoke(query): raise AssertionError("the query must not be embedded again")
+    return SimpleNamespace(vectorstore=vector_store, search_kwargs={"k": k}, invoke=invoke)
+
+
+def test_search_by_vector_reuses_the_query_embedding():
+    documents = [chunk("a.pdf", i) for i in range(5)]
+    vector_store = FakeVectorStore({"None": documents})
+    query_embedding = np.array([0.6, 0.8], dtype=np.float32)
+    assert search_by_vector(fake_retriever(vector_store), query_embedding, "query") == documents[:3]
+    assert vector_store.searches == [{"embedding": [pytest.approx(0.6), pytest.approx(0.8)], "k": 3, "filter": None}]
+
+
+def test_search_by_vector_falls_back_to_invoke_without_a_by_vector_api():
+    documents = [chunk("a.pdf", 0)]
+    retriever = SimpleNamespace(vectorstore=object(), search_kwargs={"k": 3}, invoke=lambda query: documents if query == "query" else [])
+    assert search_by_vector(retriever, np.zeros(2, dtype=np.float32), "query") == documents
+
+
+def test_query_filter_narrows_the_request_filter():
+    narrowed = [chunk("b.pdf", 0)]
+    request_filter, query_filter = {"source": "rbi"}, {"notification_ids": {"$in": ["15/2024"]}}
+    vector_store = FakeVectorStore({repr({"$and": [request_filter, query_filter]}): narrowed, repr(request_filter): [chunk("a.pdf", 0)]})
+    assert search_by_vector(fake_retriever(vector_store), np.zeros(2), "query", request_filter, query_filter) == narrowed
+    assert [search["filter"] for search in vector_store.searches] == [{"$and": [request_filter, query_filter]}]
+
+
+def test_query_filter_is_dropped_when_nothing_matches_it():
+    documents = [chunk("a.pdf", 0)]
+    vector_store = FakeVectorStore({repr({"source": "rbi"}): documents}) # No chunk has the detected notification number
+    query_filter = {"notification_ids": {"$in": ["99/2024"]}}
+    assert search_by_vector(fake_retriever(vector_store), np.zeros(2), "query", {"source": "rbi"}, query_filter) == documents
+    assert [search["filter"] for search in vector_store.searches] == [{"$and": [{"source": "rbi"}, query_filter]}, {"source": "rbi"}]
+
+    vector_store = FakeVectorStore({})
+    assert search_by_vector(fake_retriever(vector_store), np.zeros(2), "query", {"source": "rbi"}) == []
+    assert len(vector_store.searches) == 1 # The request's own filter is never dropped
+
+
+def test_rrf_rewards_chunks_found_by_both_searches():
+    a, b, c, d = chunk("a.pdf", 0), chunk("b.pdf", 0), chunk("c.pdf", 0), chunk("d.pdf", 0)
+    # c: 1/63 + 1/61 beats a: 1/61 (first in one list only); b and d tie on 1/62
+    assert reciprocal_rank_fusion([[a, b, c], [c, d]], k=2, rrf_k=60) == [c, a]
+
+
+def test_rrf_truncates_to_k():
+    dense = [chunk("a.pdf", i) for i in range(5)]
+    assert reciprocal_rank_fusion([dense], k=3) == dense[:3]
+
+
+def test_rrf_matches_chunks_across_float_and_int_chunk_index():
+    other, lexical, dense = chunk("b.pdf", 0), chunk("a.pdf", 1), chunk("a.pdf", 1.0) # Pinecone returns numeric metadata as floats
+    assert reciprocal_rank_fusion([[other, lexical], [dense]], k=5, rrf_k=60) == [lexical, other]
+
+
+def test_rrf_falls_back_to_text_without_chunk_metadata():
+    first, other, duplicate = Document(page_content="same text"), Document(page_content="other"), Document(page_content="same text")
+    assert reciprocal_rank_fusion([[first], [other, duplicate]], k=5, rrf_k=60) == [first, other]
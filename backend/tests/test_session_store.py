@@ -0,0 +1,228 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("dotenv")
+
+from session_store import (DiskSessionDocumentStore, GridFSSessionDocumentStore, SessionDocumentStore, SessionTooLargeError,
+                           estimate_entry_bytes)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def document(rows=4):
+    return [f"chunk {i}" for i in range(rows)], np.ones((rows, 8), dtype=np.float32)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_put_and_get(clock):
+    store = SessionDocumentStore(max_bytes=10**6, ttl_seconds=60, max_sessions=10, clock=clock)
+    chunks, embeddings = document()
+    store.put("s1", "a.pdf", chunks, embeddings)
+    entry = store.get("s1")
+    assert entry["filename"] == "a.pdf" and entry["chunks"] == chunks and entry["embeddings"] is embeddings
+    assert store.get("s2") is None
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+    assert store.stats()["total_bytes"] == estimate_entry_bytes(chunks, embeddings)
+
+
+def test_replacing_a_session_does_not_double_count(clock):
+    store = SessionDocumentStore(max_bytes=10**6, ttl_seconds=60, max_sessions=10, clock=clock)
+    store.put("s1", "a.pdf", *document(4))
+    store.put("s1", "b.pdf", *document(2))
+    assert store.get("s1")["filename"] == "b.pdf"
+    assert store.stats()["sessions"] == 1 and store.stats()["total_bytes"] == estimate_entry_bytes(*document(2))
+
+
+def test_least_recently_used_session_is_evicted_at_the_session_cap(clock):
+    store = SessionDocumentStore(max_bytes=10**6, ttl_seconds=60, max_sessions=2, clock=clock)
+    store.put("s1", "a.pdf", *document())
+    store.put("s2", "b.pdf", *document())
+    assert store.get("s1") is not None # s2 is now the least recently used
+    store.put("s3", "c.pdf", *document())
+    assert store.get("s2") is None
+    assert store.get("s1") is not None and store.get("s3") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_until_the_new_entry_fits(clock):
+    entry_bytes = estimate_entry_bytes(*document())
+    store = SessionDocumentStore(max_bytes=entry_bytes * 2, ttl_seconds=60, max_sessions=10, clock=clock)
+    for session_id in ("s1", "s2", "s3"): store.put(session_id, "a.pdf", *document())
+    assert store.get("s1") is None and store.get("s2") is not None and store.get("s3") is not None
+    assert store.stats()["total_bytes"] == entry_bytes * 2 and store.stats()["evictions"] == 1
+
+
+def test_idle_sessions_expire_after_the_ttl(clock):
+    store = SessionDocumentStore(max_bytes=10**6, ttl_seconds=60, max_sessions=10, clock=clock)
+    store.put("s1", "a.pdf", *document())
+    store.put("s2", "b.pdf", *document())
+    clock.now += 50
+    assert store.get("s1") is not None # Access refreshes the idle timer
+    clock.now += 50
+    assert store.get("s1") is not None
+    assert store.get("s2") is None
+    assert store.stats()["expirations"] == 1 and store.stats()["sessions"] == 1
+
+
+def test_expired_sessions_are_dropped_when_storing(clock):
+    store = SessionDocumentStore(max_bytes=10**6, ttl_seconds=60, max_sessions=10, clock=clock)
+    store.put("s1", "a.pdf", *document())
+    clock.now += 61
+    store.put("s2", "b.pdf", *document())
+    assert store.stats()["sessions"] == 1 and store.stats()["expirations"] == 1 and store.stats()["evictions"] == 0
+
+
+def test_document_larger_than_the_budget_is_rejected(clock):
+    store = SessionDocumentStore(max_bytes=estimate_entry_bytes(*document(4)) - 1, ttl_seconds=60, max_sessions=10, clock=clock)
+    store.put("s1", "a.pdf", *document(1))
+    with pytest.raises(SessionTooLargeError):
+        store.put("s2", "b.pdf", *document(4))
+    assert store.get("s1") is not None # Nothing was evicted for the rejected document
+
+
+# --- Disk store (shared by the workers of one host) ---
+def set_last_access(store, session_id, seconds_ago):
+    timestamp = time.time() - seconds_ago
+    for path in store._paths(session_id): os.utime(path, (timestamp, timestamp))
+
+
+def test_disk_store_is_shared_between_workers(tmp_path):
+    chunks, embeddings = document()
+    DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=10).put("s1", "a.pdf", chunks, embeddings)
+    entry = DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=10).get("s1")
+    assert entry["filename"] == "a.pdf" and entry["chunks"] == chunks
+    assert isinstance(entry["embeddings"], np.memmap) and np.array_equal(entry["embeddings"], embeddings)
+
+
+def test_disk_store_replace_and_delete(tmp_path):
+    store = DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=10)
+    store.put("s1", "a.pdf", *document(4))
+    store.put("s1", "b.pdf", *document(2))
+    assert store.get("s1")["filename"] == "b.pdf" and len(store.get("s1")["embeddings"]) == 2
+    assert store.stats()["sessions"] == 1
+    store.delete("s1")
+    assert store.get("s1") is None and os.listdir(tmp_path) == [".lock"]
+
+
+def test_disk_store_replace_never_serves_a_torn_entry(tmp_path, monkeypatch):
+    store = DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=10)
+    reader = DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=10) # Another worker
+    chunks, embeddings = document(4)
+    store.put("s1", "a.pdf", chunks, embeddings)
+    seen = []
+    real_replace = os.replace
+    def replace(src, dst):
+        seen.append(reader.get("s1"))
+        real_replace(src, dst)
+    monkeypatch.setattr(os, "replace", replace)
+    store.put("s1", "b.pdf", chunks, embeddings * 2) # Same number of chunks, so only the inode check tells the pairs apart
+    monkeypatch.undo()
+    assert seen[0]["filename"] == "a.pdf" and np.array_equal(seen[0]["embeddings"], embeddings) # Both new files written, none renamed yet
+    assert seen[1] is None # New .npy, old .json
+    entry = reader.get("s1")
+    assert entry["filename"] == "b.pdf" and np.array_equal(entry["embeddings"], embeddings * 2)
+    assert reader.stats()["hits"] == 2 and reader.stats()["misses"] == 1
+    assert sorted(os.listdir(tmp_path)) == sorted([".lock", *(os.path.basename(path) for path in store._paths("s1"))])
+
+
+def test_disk_store_expires_idle_sessions(tmp_path):
+    store = DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=10)
+    store.put("s1", "a.pdf", *document())
+    set_last_access(store, "s1", 61)
+    assert store.get("s1") is None
+    assert store.stats()["expirations"] == 1 and store.stats()["sessions"] == 0
+
+
+def test_disk_store_evicts_the_least_recently_used_session(tmp_path):
+    store = DiskSessionDocumentStore(str(tmp_path), max_bytes=10**6, ttl_seconds=60, max_sessions=2)
+    store.put("s1", "a.pdf", *document())
+    store.put("s2", "b.pdf", *document())
+    set_last_access(store, "s1", 30)
+    set_last_access(store, "s2", 20)
+    assert store.get("s1") is not None # Reading refreshes the file times, so s2 is now the oldest
+    store.put("s3", "c.pdf", *document())
+    assert store.get("s2") is None and store.get("s1") is not None and store.get("s3") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_disk_store_byte_budget(tmp_path):
+    probe = DiskSessionDocumentStore(str(tmp_path / "probe"), max_bytes=10**6, ttl_seconds=60, max_sessions=10)
+    probe.put("s", "a.pdf", *document())
+    entry_bytes = probe.stats()["total_bytes"]
+    store = DiskSessionDocumentStore(str(tmp_path / "store"), max_bytes=int(entry_bytes * 2.5), ttl_seconds=60, max_sessions=10)
+    for age, session_id in ((30, "s1"), (20, "s2"), (0, "s3")):
+        store.put(session_id, "a.pdf", *document())
+        set_last_access(store, session_id, age)
+    assert store.get("s1") is None and store.get("s2") is not None and store.get("s3") is not None
+    with pytest.raises(SessionTooLargeError):
+        store.put("s4", "big.pdf", *document(10000))
+
+
+# --- GridFS store (shared by every host through MongoDB) ---
+@pytest.fixture(scope="module")
+def gridfs_integration():
+    pytest.importorskip("mongomock")
+    pytest.importorskip("gridfs")
+    from mongomock.gridfs import enable_gridfs_integration
+    enable_gridfs_integration()
+
+
+@pytest.fixture
+def mongo_db(gridfs_integration):
+    import mongomock
+    client = mongomock.MongoClient()
+    client.options = SimpleNamespace(timeout=None) # GridFSBucket reads the client's timeout option, which mongomock lacks
+    return client["tax_assistant"]
+
+
+def set_gridfs_last_access(db, store, session_id, seconds_ago):
+    db[f"{store.BUCKET_NAME}.files"].update_many({"metadata.session_id": session_id},
+                                                 {"$set": {"metadata.last_access": datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)}})
+
+
+def test_gridfs_store_is_shared_between_hosts(mongo_db):
+    chunks, embeddings = document()
+    GridFSSessionDocumentStore(mongo_db, max_bytes=10**6, ttl_seconds=60, max_sessions=10).put("s1", "a.pdf", chunks, embeddings)
+    other_host = GridFSSessionDocumentStore(mongo_db, max_bytes=10**6, ttl_seconds=60, max_sessions=10)
+    entry = other_host.get("s1")
+    assert entry["filename"] == "a.pdf" and entry["chunks"] == chunks and np.array_equal(entry["embeddings"], embeddings)
+    assert other_host.get("s1") is not None and other_host._local_cache.stats()["hits"] == 1 # Follow-ups are not re-downloaded
+
+
+def test_gridfs_store_replace_keeps_one_revision(mongo_db):
+    store = GridFSSessionDocumentStore(mongo_db, max_bytes=10**6, ttl_seconds=60, max_sessions=10)
+    store.put("s1", "a.pdf", *document(4))
+    assert store.get("s1")["filename"] == "a.pdf"
+    store.put("s1", "b.pdf", *document(2))
+    entry = store.get("s1") # The locally cached old revision is not served
+    assert entry["filename"] == "b.pdf" and len(entry["embeddings"]) == 2
+    assert store.stats()["sessions"] == 1
+    store.delete("s1")
+    assert store.get("s1") is None and store.stats()["sessions"] == 0
+
+
+def test_gridfs_store_expires_and_evicts(mongo_db):
+    store = GridFSSessionDocumentStore(mongo_db, max_bytes=10**6, ttl_seconds=60, max_sessions=2)
+    for session_id in ("s1", "s2", "s3"): store.put(session_id, "a.pdf", *document())
+    assert store.stats()["sessions"] == 2 and store.stats()["evictions"] == 1
+    set_gridfs_last_access(mongo_db, store, "s3", 61)
+    assert store.get("s3") is None
+    store.put("s4", "d.pdf", *document())
+    assert store.stats()["expirations"] == 1 and store.get("s2") is not None and store.get("s4") is not None
+    with pytest.raises(SessionTooLargeError):
+        store.put("s5", "big.pdf", *document(100000))
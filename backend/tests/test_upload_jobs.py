@@ -0,0 +1,164 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+for dependency in ("dotenv", "langchain", "pandas", "magic", "sentence_transformers", "fitz"):
+    pytest.importorskip(dependency)
+
+import upload_jobs
+from session_store import SessionTooLargeError
+from upload_jobs import FAILED, PROCESSING, QUEUED, READY, UploadJobQueue, UploadQueueFullError
+
+
+class RecordingStore:
+    def __init__(self, too_large=False):
+        self.too_large = too_large
+        self.documents = {}
+
+    def put(self, session_id, filename, chunks, embeddings):
+        if self.too_large: raise SessionTooLargeError("over budget")
+        self.documents[session_id] = (filename, chunks)
+
+
+class StubProcessing:
+    """Stands in for extract_uploaded_text/chunk_and_embed. Files named in `gates` block until their event is set."""
+
+    def __init__(self):
+        self.gates = {}
+        self.started = {}
+        self.fail = set()
+
+    def gate(self, filename):
+        self.gates[filename] = threading.Event()
+        self.started[filename] = threading.Event()
+        return self.gates[filename]
+
+    def extract_uploaded_text(self, filepath, filename, stream=False):
+        if filename in self.started: self.started[filename].set()
+        if filename in self.gates: assert self.gates[filename].wait(5)
+        if filename.endswith(".exe"): return None, "application/x-dosexec", False
+        if filename in self.fail: raise RuntimeError("parser crashed")
+        return iter([f"text of {filename}"]), "application/pdf", True
+
+    def chunk_and_embed(self, text, filename, batch_size=None):
+        chunks = list(text)
+        return chunks, np.zeros((len(chunks), 4), dtype=np.float32)
+
+
+@pytest.fixture
+def processing(monkeypatch):
+    stub = StubProcessing()
+    monkeypatch.setattr(upload_jobs, "extract_uploaded_text", stub.extract_uploaded_text)
+    monkeypatch.setattr(upload_jobs, "chunk_and_embed", stub.chunk_and_embed)
+    return stub
+
+
+def wait_until_idle(queue):
+    deadline = time.monotonic() + 5
+    while queue.stats() != {"queued": 0, "processing": 0}:
+        assert time.monotonic() < deadline, queue.stats()
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_queue(tmp_path, processing):
+    queues = []
+
+    def make(store=None, workers=1, queue_size=2):
+        queue = UploadJobQueue(store or RecordingStore(), workers=workers, queue_size=queue_size, job_dir=str(tmp_path / "jobs"), ttl_seconds=3600)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for gate in processing.gates.values(): gate.set() # Let blocked jobs finish while the stubs are still patched in
+    for queue in queues:
+        wait_until_idle(queue)
+        queue.shutdown()
+
+
+def upload(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"data")
+    return str(path)
+
+
+def wait_for(queue, job_id, status):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = queue.status(job_id)
+        if job and job["status"] == status: return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}: {queue.status(job_id)}")
+
+
+def test_job_goes_from_queued_to_processing_to_ready(tmp_path, processing, make_queue):
+    store = RecordingStore()
+    queue = make_queue(store, queue_size=1)
+    gate = processing.gate("a.pdf")
+    path = upload(tmp_path, "a.pdf")
+
+    job = queue.submit("s1", "a.pdf", path)
+    assert job["status"] == QUEUED and queue.status(job["job_id"])["status"] in (QUEUED, PROCESSING)
+    assert processing.started["a.pdf"].wait(5)
+    assert wait_for(queue, job["job_id"], PROCESSING) and queue.stats() == {"queued": 0, "processing": 1}
+
+    gate.set()
+    done = wait_for(queue, job["job_id"], READY)
+    assert done["chunks"] == 1 and done["error"] is None
+    assert store.documents == {"s1": ("a.pdf", ["text of a.pdf"])}
+    assert not (tmp_path / "a.pdf").exists() # The job deletes the upload's temp file
+    assert queue.stats() == {"queued": 0, "processing": 0}
+
+
+@pytest.mark.parametrize("filename, store, message", [
+    ("virus.exe", RecordingStore(), "Unsupported file type: application/x-dosexec"),
+    ("broken.pdf", RecordingStore(), "Error processing file."),
+    ("huge.pdf", RecordingStore(too_large=True), "Document too large to keep as context."),
+])
+def test_failed_jobs_report_why(tmp_path, processing, make_queue, filename, store, message):
+    processing.fail.add("broken.pdf")
+    queue = make_queue(store)
+
+    job = queue.submit("s1", filename, upload(tmp_path, filename))
+    assert wait_for(queue, job["job_id"], FAILED)["error"] == message
+    assert store.documents == {} and not (tmp_path / filename).exists()
+
+
+def test_submit_raises_when_the_queue_is_full(tmp_path, processing, make_queue):
+    queue = make_queue(workers=1, queue_size=1)
+    gate = processing.gate("a.pdf")
+    queue.submit("s1", "a.pdf", upload(tmp_path, "a.pdf"))
+    assert processing.started["a.pdf"].wait(5)
+    queue.submit("s2", "b.pdf", upload(tmp_path, "b.pdf"))
+
+    with pytest.raises(UploadQueueFullError):
+        queue.submit("s3", "c.pdf", upload(tmp_path, "c.pdf"))
+    assert (tmp_path / "c.pdf").exists() # Still owned by the caller
+    assert queue.stats() == {"queued": 1, "processing": 1}
+
+    gate.set()
+    wait_until_idle(queue)
+    queue.submit("s3", "c.pdf", upload(tmp_path, "c.pdf")) # Slots are released when jobs finish
+
+
+def test_newer_upload_supersedes_an_older_one_that_finishes_later(tmp_path, processing, make_queue):
+    store = RecordingStore()
+    queue = make_queue(store, workers=2)
+    old_gate = processing.gate("old.pdf")
+    old = queue.submit("s1", "old.pdf", upload(tmp_path, "old.pdf"))
+    assert processing.started["old.pdf"].wait(5)
+    new = queue.submit("s1", "new.pdf", upload(tmp_path, "new.pdf"))
+    wait_for(queue, new["job_id"], READY)
+
+    old_gate.set()
+    assert wait_for(queue, old["job_id"], FAILED)["error"] == "Superseded by a newer upload for this session."
+    assert store.documents == {"s1": ("new.pdf", ["text of new.pdf"])}
+
+
+def test_status_rejects_malformed_and_unknown_job_ids(make_queue):
+    queue = make_queue()
+    assert queue.status("../../etc/passwd") is None
+    assert queue.status("0" * 32) is None
+    assert queue.status(None) is None
@@ -0,0 +1,156 @@
+# backend/upload_jobs.py
+"""
+Background processing of uploaded documents.
+
+/api/upload only saves the file and queues a job. A small bounded pool streams extract -> chunk -> embed and
+puts the result in the session document store, where the session's next query picks it up; clients poll
+/api/upload/<job_id> until the job is "ready" (or "failed"). When UPLOAD_QUEUE_SIZE jobs are already
+waiting, further uploads are refused with 429 instead of piling up.
+
+Uploads get their own UPLOAD_WORKERS threads and embed in UPLOAD_EMBED_BATCH_SIZE slices, so a burst of
+uploads never holds more than that many short encode calls against the query path. Job statuses are small
+JSON files in UPLOAD_JOB_DIR, so a status poll answered by another gunicorn worker on the host still finds
+the job (the work itself runs in the worker that accepted the upload).
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import UPLOAD_WORKERS, UPLOAD_QUEUE_SIZE, UPLOAD_EMBED_BATCH_SIZE, UPLOAD_JOB_DIR, UPLOAD_JOB_TTL_SECONDS
+from metrics import RequestTimer
+from query_pipeline import extract_uploaded_text, chunk_and_embed
+from session_store import SessionTooLargeError
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+QUEUED, PROCESSING, READY, FAILED = "queued", "processing", "ready", "failed"
+
+
+class UploadQueueFullError(RuntimeError):
+    """Raised by submit() when UPLOAD_QUEUE_SIZE uploads are already waiting."""
+
+
+class UploadJobQueue:
+    """Bounded background pool for upload processing, with job statuses persisted for polling."""
+
+    def __init__(self, session_store, workers=UPLOAD_WORKERS, queue_size=UPLOAD_QUEUE_SIZE,
+                 job_dir=UPLOAD_JOB_DIR, ttl_seconds=UPLOAD_JOB_TTL_SECONDS, embed_batch_size=UPLOAD_EMBED_BATCH_SIZE):
+        self.session_store = session_store
+        self.job_dir = job_dir
+        self.ttl_seconds = ttl_seconds
+        self.embed_batch_size = embed_batch_size
+        self.queue_size = queue_size
+        os.makedirs(job_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._slots = threading.BoundedSemaphore(workers + queue_size) # Running + waiting jobs
+        self._lock = threading.Lock()
+        self._latest_job = {} # session_id -> newest job_id accepted by this process
+        self._active = {QUEUED: 0, PROCESSING: 0}
+
+    def submit(self, session_id, filename, temp_filepath):
+        """
+        Queues processing of an uploaded file (saved at temp_filepath, which the job deletes when done).
+        Returns the job status. Raises UploadQueueFullError (the caller still owns the file) when the queue is full.
+        """
+        if not self._slots.acquire(blocking=False): raise UploadQueueFullError(f"{self.queue_size} uploads are already waiting.")
+        self._prune()
+        job = {"job_id": uuid.uuid4().hex, "status": QUEUED, "session_id": session_id, "filename": filename,
+               "chunks": None, "error": None, "created_at": time.time(), "updated_at": time.time()}
+        with self._lock:
+            self._latest_job[session_id] = job["job_id"]
+            self._active[QUEUED] += 1
+        self._write(job)
+        queued_job = dict(job) # The worker updates `job` in place, possibly before submit() returns
+        try:
+            self._executor.submit(self._run, job, temp_filepath)
+        except Exception:
+            with self._lock: self._active[QUEUED] -= 1
+            self._slots.release()
+            raise
+        logging.info(f"[upload_jobs] Queued job {job['job_id']} for {filename} (session {session_id}).")
+        return queued_job
+
+    def status(self, job_id):
+        """The job's status dict, or None for unknown or expired jobs."""
+        if not JOB_ID_PATTERN.match(job_id or ""): return None
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f: return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def stats(self) -> dict:
+        with self._lock: return {"queued": self._active[QUEUED], "processing": self._active[PROCESSING]}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Worker ---
+    def _run(self, job, temp_filepath):
+        timer = RequestTimer("upload")
+        with self._lock: self._active[QUEUED] -= 1; self._active[PROCESSING] += 1
+        self._update(job, status=PROCESSING)
+        try:
+            # PDFs stream page by page into the chunker and embedder, so "chunk_embed" includes their extraction
+            with timer.stage("extract"): extracted_text, mime_type, supported = extract_uploaded_text(temp_filepath, job["filename"], stream=True)
+            if not supported: return self._fail(job, timer, f"Unsupported file type: {mime_type}")
+            if not extracted_text: return self._fail(job, timer, "Failed to extract text.")
+            with timer.stage("chunk_embed"): text_chunks, chunk_embeddings = chunk_and_embed(extracted_text, job["filename"], self.embed_batch_size)
+            if not text_chunks: return self._fail(job, timer, "Failed to extract text.")
+            # A newer upload for the same session wins, even if this older one finishes later
+            with self._lock: superseded = self._latest_job.get(job["session_id"]) != job["job_id"]
+            if superseded: return self._fail(job, timer, "Superseded by a newer upload for this session.")
+            try:
+                with timer.stage("store"): self.session_store.put(job["session_id"], job["filename"], text_chunks, chunk_embeddings)
+            except SessionTooLargeError as size_e:
+                logging.warning(f"[upload_jobs] Upload rejected for session {job['session_id']}: {size_e}")
+                return self._fail(job, timer, "Document too large to keep as context.")
+            logging.info(f"[upload_jobs] Job {job['job_id']}: stored {len(text_chunks)} chunks for session {job['session_id']}.")
+            timer.finish("ok")
+            self._update(job, status=READY, chunks=len(text_chunks))
+        except Exception as e:
+            logging.exception(f"[upload_jobs] Error processing uploaded file {job['filename']}: {e}")
+            self._fail(job, timer, "Error processing file.")
+        finally:
+            with self._lock:
+                self._active[PROCESSING] -= 1
+                if self._latest_job.get(job["session_id"]) == job["job_id"]: del self._latest_job[job["session_id"]]
+            self._slots.release()
+            try: os.remove(temp_filepath); logging.info(f"[upload_jobs] Removed temp file: {temp_filepath}")
+            except OSError as e: logging.error(f"[upload_jobs] Error removing temp file {temp_filepath}: {e}")
+
+    def _fail(self, job, timer, message):
+        timer.finish("error")
+        self._update(job, status=FAILED, error=message)
+
+    # --- Status Files ---
+    def _path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def _update(self, job, **changes):
+        job.update(changes, updated_at=time.time())
+        self._write(job)
+
+    def _write(self, job):
+        path = self._path(job["job_id"])
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f: json.dump(job, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logging.error(f"[upload_jobs] Could not write status of job {job['job_id']}: {e}")
+
+    def _prune(self):
+        """Deletes status files not updated for ttl_seconds (jobs finished that long ago)."""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            with os.scandir(self.job_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                        try: os.remove(entry.path)
+                        except OSError: pass
+        except OSError as e:
+            logging.warning(f"[upload_jobs] Could not prune {self.job_dir}: {e}")
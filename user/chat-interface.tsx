@@ -242,7 +242,15 @@ export default function ChatInterface() {
                 const errorData = await response.json().catch(() => ({ error: "Upload failed." }));
                 throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
             }
-            const result = await response.json();
+            // The backend processes the file in the background (202 + job_id); poll until it is ready
+            let result = await response.json();
+            while (result.status === "queued" || result.status === "processing") {
+                await new Promise((resolve) => setTimeout(resolve, 1000));
+                const statusResponse = await fetch(`${BACKEND_URL}/api/upload/${result.job_id}`);
+                if (!statusResponse.ok) throw new Error(`Could not check upload status (HTTP ${statusResponse.status}).`);
+                result = await statusResponse.json();
+            }
+            if (result.status === "failed") throw new Error(result.error || "Could not process document.");
             toast({ title: "Document Processed", description: `Context from '${result.filename}' is now active for this session.` });
             // Set the active document context indicator using the ID we sent
             setActiveDocument({ filename: result.filename, session_id: sessionIdToSend });